@@ -0,0 +1,118 @@
+"""
+Benchmark of the cache serialization format.
+
+Compares the size and encode/decode time of a large, synthetic ESI response
+(e.g. a character's assets) stored as a plain pickle of the full response
+(as previously done by :meth:`sni.db.cache.cache_set`), to the format of
+:mod:`sni.db.codec`, where unused headers are dropped. If the ``msgpack``
+package is installed, MessagePack (with the same compression) is measured
+as well, as the alternative binary encoding.
+
+Usage::
+
+    python -m bench.cache_codec [item_count]
+"""
+
+import pickle  # nosec
+import random
+import sys
+import timeit
+import zlib
+
+from sni.conf import CONFIGURATION as conf
+from sni.db.codec import decode, encode
+from sni.esi.esi import esi_cached_headers
+
+NUMBER = 20
+
+HEADERS = {
+    "Access-Control-Allow-Credentials": "true",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization,...",
+    "Access-Control-Allow-Methods": "GET,HEAD,OPTIONS",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Expose-Headers": "Content-Type,Warning,ETag,X-Pages",
+    "Access-Control-Max-Age": "600",
+    "Allow": "GET,HEAD,OPTIONS",
+    "Cache-Control": "private",
+    "Content-Encoding": "gzip",
+    "Content-Type": "application/json; charset=UTF-8",
+    "Date": "Sat, 17 Oct 2020 12:00:00 GMT",
+    "ETag": '"0123456789abcdef0123456789abcdef0123456789abcdef01234567"',
+    "Expires": "Sat, 17 Oct 2020 13:00:00 GMT",
+    "Last-Modified": "Sat, 17 Oct 2020 12:00:00 GMT",
+    "Strict-Transport-Security": "max-age=31536000",
+    "Vary": "Accept-Encoding",
+    "X-Esi-Error-Limit-Remain": "100",
+    "X-Esi-Error-Limit-Reset": "60",
+    "X-Esi-Request-Id": "01234567-89ab-cdef-0123-456789abcdef",
+    "X-Pages": "1",
+}
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    data = [
+        {
+            "is_singleton": random.random() < 0.1,
+            "item_id": random.randint(10 ** 12, 10 ** 13),
+            "location_flag": random.choice(["Hangar", "Cargo", "AutoFit"]),
+            "location_id": random.randint(60000000, 60010000),
+            "location_type": "station",
+            "quantity": random.randint(1, 10000),
+            "type_id": random.randint(1, 50000),
+        }
+        for _ in range(item_count)
+    ]
+    legacy_value = {
+        "data": data,
+        "headers": HEADERS,
+        "id_annotations": {},
+        "status_code": 200,
+    }
+    value = {
+        **legacy_value,
+        "headers": esi_cached_headers(HEADERS),
+        "body_size": 0,
+    }
+
+    formats = [
+        (
+            "pickle",
+            lambda: pickle.dumps(legacy_value),
+            pickle.loads,  # nosec
+        ),
+        ("codec", lambda: encode(value), decode),
+    ]
+    try:
+        import msgpack  # pylint: disable=import-outside-toplevel
+
+        formats.append(
+            (
+                "msgpack",
+                lambda: zlib.compress(
+                    msgpack.packb(value), conf.redis.cache_compression_level
+                ),
+                lambda data: msgpack.unpackb(zlib.decompress(data)),
+            )
+        )
+    except ImportError:
+        pass
+    print(f"{item_count} items")
+    for name, encoder, decoder in formats:
+        encoded = encoder()
+        encode_time = min(timeit.repeat(encoder, number=NUMBER, repeat=3))
+        decode_time = min(
+            timeit.repeat(lambda: decoder(encoded), number=NUMBER, repeat=3)
+        )
+        print(
+            f"{name:>8}: {len(encoded) / 1024:8.1f} KiB, "
+            f"encode {encode_time / NUMBER * 1000:6.2f} ms, "
+            f"decode {decode_time / NUMBER * 1000:6.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Microbenchmark and property check of cache key derivation.
+
+First checks, on randomly generated key documents, that equal documents
+(including dicts with permuted items, tuples instead of lists, and equal
+numbers of different types) map to the same key, and that distinct documents
+map to distinct encodings. Then compares the time taken by
+:meth:`sni.db.cache.hash_key` to the previous implementation, which hashed
+the pickled document.
+
+Usage::
+
+    python -m bench.cache_key [seed]
+"""
+
+import pickle  # nosec
+import random
+import sys
+import timeit
+
+from xxhash import xxh64_hexdigest
+
+from sni.db.cache import encode_key_document, hash_key
+
+NUMBER = 100000
+PROPERTY_CHECKS = 10000
+
+
+def equivalent_document(document):
+    """
+    Returns a document that is equal to the given one, but built
+    differently: dicts have their items shuffled, lists become tuples (and
+    vice versa), and integers become floats or booleans when possible.
+    """
+    if isinstance(document, dict):
+        items = list(document.items())
+        random.shuffle(items)
+        return {key: equivalent_document(value) for key, value in items}
+    if isinstance(document, list):
+        return tuple(equivalent_document(item) for item in document)
+    if isinstance(document, tuple):
+        return [equivalent_document(item) for item in document]
+    if isinstance(document, int) and not isinstance(document, bool):
+        if document in (0, 1) and random.random() < 0.5:
+            return bool(document)
+        return float(document)
+    return document
+
+
+def random_document(depth=0):
+    """
+    Generates a random key document
+    """
+    choices = ["none", "int", "str", "float"]
+    if depth < 3:
+        choices += ["list", "tuple", "dict"]
+    choice = random.choice(choices)
+    if choice == "none":
+        return None
+    if choice == "int":
+        return random.choice([0, 1, random.randint(-(2 ** 40), 2 ** 40)])
+    if choice == "float":
+        return random.random() * 1000
+    if choice == "str":
+        return "".join(random.choices("ab:;le0123", k=random.randint(0, 6)))
+    if choice == "list":
+        return [
+            random_document(depth + 1) for _ in range(random.randint(0, 4))
+        ]
+    if choice == "tuple":
+        return tuple(
+            random_document(depth + 1) for _ in range(random.randint(0, 4))
+        )
+    return {
+        random.choice(["a", "b", "c", 1, 2]): random_document(depth + 1)
+        for _ in range(random.randint(0, 4))
+    }
+
+
+def check_properties():
+    """
+    Checks that equal documents have the same encoding, and that documents
+    with the same encoding are equal (up to list/tuple conversion)
+    """
+    encodings = {}
+    for _ in range(PROPERTY_CHECKS):
+        document = random_document()
+        equivalent = equivalent_document(document)
+        assert _normalize(document) == _normalize(equivalent)
+        encoding = encode_key_document(document)
+        assert encoding == encode_key_document(equivalent), document
+        previous = encodings.setdefault(encoding, document)
+        assert _normalize(previous) == _normalize(document), document
+    print(f"{PROPERTY_CHECKS} property checks passed")
+
+
+def main():
+    """
+    Runs the property checks and the benchmark
+    """
+    random.seed(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    check_properties()
+
+    keys = [
+        ("esi", ["latest/characters/123456789/assets/", None, [("page", 2)]]),
+        ("clr", [123456789, "esi-location.read_location.v1", 987654321]),
+        ("sde:30000142", None),
+    ]
+
+    def pickle_hash_key(key):
+        prefix, document = key
+        raw = [
+            prefix,
+            xxh64_hexdigest(pickle.dumps(document))
+            if document is not None
+            else None,
+        ]
+        return ":".join(filter(None, raw))
+
+    for key in keys:
+        print(key)
+        for name, function in [
+            ("pickle", pickle_hash_key),
+            ("canonical", hash_key),
+        ]:
+            duration = min(
+                timeit.repeat(lambda: function(key), number=NUMBER, repeat=3)
+            )
+            print(f"{name:>12}: {duration / NUMBER * 1e6:6.2f} us/key")
+
+
+def _normalize(document):
+    """
+    Converts tuples to lists, recursively
+    """
+    if isinstance(document, (list, tuple)):
+        return [_normalize(item) for item in document]
+    if isinstance(document, dict):
+        return {key: _normalize(value) for key, value in document.items()}
+    return document
+
+
+if __name__ == "__main__":
+    main()
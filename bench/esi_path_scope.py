@@ -0,0 +1,71 @@
+"""
+Microbenchmark of ESI path to scope resolution.
+
+Compares a linear scan over the path regular expressions (as previously done
+by :meth:`sni.esi.esi.get_esi_path_scope`, minus the database round trip) to
+the segment trie of :mod:`sni.esi.routing`. The ESI swagger specification is
+read from the file given as argument, or fetched from the ESI.
+
+Usage::
+
+    python -m bench.esi_path_scope [swagger.json]
+"""
+
+import json
+import random
+import re
+import sys
+import timeit
+
+import requests
+
+from sni.esi.routing import EsiPathTrie
+
+ESI_SWAGGER = "https://esi.evetech.net/latest/swagger.json"
+NUMBER = 10000
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as swagger_file:
+            swagger = json.load(swagger_file)
+    else:
+        swagger = requests.get(ESI_SWAGGER).json()
+    base_path = swagger["basePath"][1:]
+    paths = []
+    for path, path_data in swagger["paths"].items():
+        for method_data in path_data.values():
+            full_path = base_path + path
+            path_re = "^" + re.sub(r"{\w+_id}", "[^/]+", full_path) + "?$"
+            scope = None
+            for security in method_data.get("security", []):
+                scope = security.get("evesso", [scope])[0]
+            paths.append((full_path, path_re, scope))
+
+    trie = EsiPathTrie.from_paths((path, scope) for path, _, scope in paths)
+    samples = [
+        re.sub(r"{\w+_id}", str(random.randint(1, 2 ** 31)), path)
+        for path, _, _ in random.choices(paths, k=NUMBER)
+    ]
+
+    def linear_scan():
+        for sample in samples:
+            for _, path_re, scope in paths:
+                if re.search(path_re, sample):
+                    break
+
+    def trie_lookup():
+        for sample in samples:
+            trie.lookup(sample)
+
+    print(f"{len(paths)} paths, {NUMBER} lookups")
+    for name, function in [("regex scan", linear_scan), ("trie", trie_lookup)]:
+        duration = min(timeit.repeat(function, number=1, repeat=5))
+        print(f"{name:>12}: {duration / NUMBER * 1e6:8.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark of the SDE import.
+
+Compares the import rate (in rows per second) of a synthetic table when each
+row is upserted individually (as previously done by
+:meth:`sni.sde.sde.import_sde_dump_inv_types`), to the incremental import of
+:mod:`sni.sde.sde`. Each is run three times: on an empty collection, on an
+unchanged table, and after renaming 1% of the rows. Requires the MongoDB and
+Redis instances of the configuration. The synthetic rows use a field name
+that does not exist in the SDE, and are deleted afterwards.
+
+Usage::
+
+    python -m bench.sde_import [row_count]
+"""
+
+import sqlite3
+import sys
+import time
+
+from sni.db.mongodb import init_mongodb
+from sni.sde.models import EsiObjectName
+from sni.sde.sde import SDE_HASHES_KEY_PREFIX, _import_sde_table, connection
+
+FIELD_NAME = "bench_type_id"
+
+TABLE = "benchTypes"
+
+
+def import_incremental(client: sqlite3.Connection) -> None:
+    """
+    Incremental import, see :meth:`sni.sde.sde._import_sde_table`
+    """
+    _import_sde_table(client, TABLE, "typeID", "typeName", [FIELD_NAME])
+
+
+def import_per_row(client: sqlite3.Connection) -> None:
+    """
+    Previous implementation of :meth:`sni.sde.sde.import_sde_dump_inv_types`
+    """
+    for row in client.execute(f"SELECT * FROM {TABLE};"):  # nosec
+        EsiObjectName.objects(
+            field_id=row["typeID"], field_names=FIELD_NAME,
+        ).update(
+            set___version=EsiObjectName.SCHEMA_VERSION,
+            set__field_id=row["typeID"],
+            set__field_names=[FIELD_NAME],
+            set__name=row["typeName"],
+            upsert=True,
+        )
+
+
+def reset() -> None:
+    """
+    Deletes the synthetic documents and the recorded batch hashes
+    """
+    EsiObjectName.objects(field_names=FIELD_NAME).delete()
+    connection.delete(SDE_HASHES_KEY_PREFIX + TABLE)
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    client = sqlite3.connect(":memory:")
+    client.row_factory = sqlite3.Row
+    client.execute(f"CREATE TABLE {TABLE} (typeID INTEGER, typeName TEXT);")
+    init_mongodb()
+    try:
+        for name, function in [
+            ("Per-row upserts", import_per_row),
+            ("Incremental", import_incremental),
+        ]:
+            reset()
+            client.execute(f"DELETE FROM {TABLE};")  # nosec
+            client.executemany(
+                f"INSERT INTO {TABLE} VALUES (?, ?);",  # nosec
+                [(type_id, f"Type {type_id}") for type_id in range(row_count)],
+            )
+            for run in ["insert", "same", "1%"]:
+                if run == "1%":
+                    client.execute(
+                        f"UPDATE {TABLE} SET typeName = "  # nosec
+                        "typeName || '*' WHERE typeID % 100 = 0;"
+                    )
+                start = time.monotonic()
+                function(client)
+                duration = time.monotonic() - start
+                print(
+                    f"{name:16} {run:7} {row_count / duration:10.0f} rows/s "
+                    f"({duration:.2f}s)"
+                )
+    finally:
+        reset()
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
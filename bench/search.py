@@ -0,0 +1,88 @@
+"""
+Benchmark of the name search index.
+
+Builds a :class:`sni.search.search.SearchIndex` of synthetic names (made of
+random syllables, like EVE character names), and reports the build time and
+the latency of prefix and fuzzy (misspelled) queries, as well as the
+proportion of queries whose target name is among the results. Does not
+require any database.
+
+Usage::
+
+    python -m bench.search [entry_count] [query_count]
+"""
+
+from typing import Dict, List, Tuple
+import random
+import statistics
+import sys
+import time
+
+from sni.search.search import SEARCH_CATEGORIES, SearchIndex
+
+SYLLABLES = [
+    consonant + vowel + coda
+    for consonant in "bdgklmnrstvz"
+    for vowel in "aeiou"
+    for coda in ["", "n", "r"]
+]
+"""Syllables of the synthetic names"""
+
+
+def random_name(rng: random.Random) -> str:
+    """
+    Returns a random name of one to three words
+    """
+    return " ".join(
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        .capitalize()
+        for _ in range(rng.randint(1, 3))
+    )
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    entry_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = random.Random(42)
+    names = [random_name(rng) for _ in range(entry_count)]
+    start = time.monotonic()
+    index = SearchIndex(
+        (rng.choice(SEARCH_CATEGORIES), object_id, name)
+        for object_id, name in enumerate(names)
+    )
+    print(f"Built {len(index)} entries in {time.monotonic() - start:.2f}s")
+    queries: Dict[str, List[Tuple[str, str]]] = {"prefix": [], "fuzzy": []}
+    for _ in range(query_count):
+        name = rng.choice(names)
+        queries["prefix"].append((name[: rng.randint(2, len(name))], name))
+        position = rng.randrange(len(name))
+        queries["fuzzy"].append(
+            (
+                name[:position]
+                + rng.choice("aeiouxyz")
+                + name[position + 1 :],
+                name,
+            )
+        )
+    for kind, kind_queries in queries.items():
+        durations = []
+        found = 0
+        for query, name in kind_queries:
+            start = time.perf_counter()
+            results = index.search(query)
+            durations.append((time.perf_counter() - start) * 1000)
+            found += any(result.name == name for result in results)
+        durations.sort()
+        print(
+            f"{kind:7} median {statistics.median(durations):6.2f}ms "
+            f"p99 {durations[int(0.99 * len(durations))]:6.2f}ms "
+            f"max {durations[-1]:6.2f}ms "
+            f"found {100 * found / len(kind_queries):5.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
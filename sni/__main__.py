@@ -29,6 +29,7 @@ def connect_database_signals() -> None:
         "sni.esi.signals": True,
         "sni.sde.signals": True,
         "sni.index.signals": True,
+        "sni.search.signals": True,
         "sni.uac.signals": True,
         "sni.user.signals": True,
         "sni.api.signals": True,
@@ -165,10 +166,17 @@ def main():
 
     from sni.esi.esi import load_esi_openapi
 
-    load_esi_openapi()
+    load_esi_openapi(force=arguments.reload_esi_openapi_spec)
     if arguments.reload_esi_openapi_spec:
         sys.exit()
 
+    from sni.sde.name_table import init_sde_name_table
+    from sni.sde.sde import sde_dump_path
+    from sni.sde.universe import init_solar_system_graph
+
+    init_sde_name_table()
+    init_solar_system_graph(sde_dump_path())
+
     # --------------------------------------------------------------------------
     # Scheduler start
     # --------------------------------------------------------------------------
@@ -275,6 +283,7 @@ def schedule_jobs() -> None:
         "sni.uac.jobs": True,
         "sni.user.jobs": True,
         "sni.index.jobs": True,
+        "sni.search.jobs": True,
         "sni.api.jobs": True,
         "sni.discord.jobs": conf.discord.enabled,
         "sni.teamspeak.jobs": conf.teamspeak.enabled,
@@ -6,6 +6,7 @@ from traceback import format_exception
 from typing import Optional
 import logging
 
+from aiohttp import ClientResponseError
 from fastapi import status
 from fastapi.responses import JSONResponse
 from requests import Request
@@ -107,6 +108,26 @@ def requests_httperror_handler(_request: Request, error: HTTPError):
     )
 
 
+@app.exception_handler(ClientResponseError)
+def aiohttp_clientresponseerror_handler(
+    _request: Request, error: ClientResponseError
+):
+    """
+    Catches :class:`aiohttp.ClientResponseError` exceptions (raised by
+    :mod:`sni.esi.async_esi`) and forwards them as ``500``'s.
+    """
+    # send_exception_to_sentry(error)
+    content = None
+    if conf.general.debug:
+        content = {
+            "details": f'Failed to issue {error.request_info.method} to "'
+            + f'{error.request_info.real_url}": {str(error)}'
+        }
+    return JSONResponse(
+        content=content, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+    )
+
+
 @app.exception_handler(Exception)
 def exception_handler(request: Request, error: Exception):
     """
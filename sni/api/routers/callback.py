@@ -6,6 +6,7 @@ import logging
 from typing import List, Sequence
 
 from fastapi import APIRouter, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import (
     HTMLResponse,
     PlainTextResponse,
@@ -16,9 +17,9 @@ import requests
 from sni.user.models import User
 
 from sni.esi.sso import (
+    async_get_access_token_from_callback_code,
     decode_access_token,
     EsiTokenError,
-    get_access_token_from_callback_code,
 )
 from sni.esi.scope import EsiScope
 from sni.esi.token import save_esi_tokens, token_has_enough_scopes
@@ -115,9 +116,9 @@ async def get_callback_esi(code: str, state: str):
     state_code.delete()
 
     try:
-        esi_response = get_access_token_from_callback_code(code)
+        esi_response = await async_get_access_token_from_callback_code(code)
         access_token = decode_access_token(esi_response.access_token)
-        save_esi_tokens(esi_response)
+        await run_in_threadpool(save_esi_tokens, esi_response)
     except EsiTokenError:
         return token_manipulation_error_response()
 
@@ -16,6 +16,7 @@ from fastapi import (
 )
 import pydantic as pdt
 
+from sni.db.cache import invalidate_tag, invalidate_tags
 from sni.esi.scope import EsiScope
 from sni.uac.clearance import assert_has_clearance
 from sni.uac.token import (
@@ -149,6 +150,7 @@ def delete_coalition(
         "Deleting coalition %s (%s)", coalition.coalition_name, coalition_id
     )
     coalition.delete()
+    invalidate_tag(f"coalition:{coalition_id}")
 
 
 @router.get(
@@ -232,6 +234,8 @@ def put_coalition(
     logging.debug(
         "Updating coalition %s (%s)", coalition.coalition_name, coalition_id
     )
+    old_alliances = set(coalition.member_alliances)
+    old_corporations = set(coalition.member_corporations)
     if data.add_member_alliances is not None:
         coalition.member_alliances += [
             Alliance.objects.get(alliance_id=member_id)
@@ -274,6 +278,21 @@ def put_coalition(
     coalition.member_corporations = list(set(coalition.member_corporations))
     coalition.member_alliances = list(set(coalition.member_alliances))
     coalition.save()
+    invalidate_tags(
+        [f"coalition:{coalition_id}"]
+        + [
+            f"alliance:{alliance.alliance_id}"
+            for alliance in old_alliances.symmetric_difference(
+                coalition.member_alliances
+            )
+        ]
+        + [
+            f"corp:{corporation.corporation_id}"
+            for corporation in old_corporations.symmetric_difference(
+                coalition.member_corporations
+            )
+        ]
+    )
     return GetCoalitionOut.from_record(coalition)
 
 
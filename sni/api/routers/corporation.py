@@ -5,11 +5,14 @@ Corporation management paths
 from datetime import datetime
 from typing import Dict, Iterator, List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 import pydantic as pdt
 
 from sni.esi.scope import EsiScope, esi_scope_set_to_hex
 from sni.esi.token import tracking_status, TrackingStatus
+from sni.index.models import EsiCharacterLocation
+from sni.sde.sde import sde_get_names
+from sni.sde.universe import solar_system_jumps
 from sni.uac.clearance import assert_has_clearance
 from sni.uac.token import (
     create_state_code,
@@ -110,6 +113,19 @@ class GetCorporationShortOut(pdt.BaseModel):
         )
 
 
+class GetMemberJumpsOut(pdt.BaseModel):
+    """
+    Latest known location of a corporation member, and its distance (in
+    jumps) to the origin solar systems
+    """
+
+    jumps: Optional[int]
+    solar_system_id: int
+    solar_system_name: str
+    timestamp: datetime
+    user: GetUserShortOut
+
+
 class GetTrackingOut(pdt.BaseModel):
     """
     Represents a corporation tracking response.
@@ -305,6 +321,71 @@ def post_corporation_guest(
     return PostCorporationGuestOut(state_code=str(state_code.uuid))
 
 
+@router.get(
+    "/{corporation_id}/jumps",
+    response_model=List[GetMemberJumpsOut],
+    summary="Corporation members' jump distances",
+)
+def get_corporation_jumps(
+    corporation_id: int,
+    origin: List[int] = Query(...),
+    tkn: Token = Depends(from_authotization_header_nondyn),
+):
+    """
+    Reports the latest known location (see
+    :class:`sni.index.models.EsiCharacterLocation`) of each member of a
+    corporation, and its distance (in jumps) to the nearest of the ``origin``
+    solar systems (e.g. a staging system), see
+    :meth:`sni.sde.universe.solar_system_jumps`. The distance is ``null`` if
+    the location is unreachable by stargates. Members whose location is
+    unknown are omitted. The results are sorted by distance. Requires having
+    clearance to access the ESI scope ``esi-location.read_location.v1`` of the
+    corporation's CEO.
+    """
+    corporation: Corporation = Corporation.objects(
+        corporation_id=corporation_id
+    ).get()
+    assert_has_clearance(
+        tkn.owner, "esi-location.read_location.v1", corporation.ceo
+    )
+    users = {usr.pk: usr for usr in corporation.user_iterator()}
+    locations = list(
+        EsiCharacterLocation.objects(user__in=list(users.keys())).aggregate(
+            [
+                {"$sort": {"timestamp": -1}},
+                {
+                    "$group": {
+                        "_id": "$user",
+                        "solar_system_id": {"$first": "$solar_system_id"},
+                        "timestamp": {"$first": "$timestamp"},
+                    }
+                },
+            ]
+        )
+    )
+    solar_system_ids = {location["solar_system_id"] for location in locations}
+    jumps = solar_system_jumps(origin, solar_system_ids)
+    names = sde_get_names(dict.fromkeys(solar_system_ids, "solar_system_id"))
+    result = [
+        GetMemberJumpsOut(
+            jumps=jumps[location["solar_system_id"]],
+            solar_system_id=location["solar_system_id"],
+            solar_system_name=names.get(location["solar_system_id"], ""),
+            timestamp=location["timestamp"],
+            user=GetUserShortOut.from_record(users[location["_id"]]),
+        )
+        for location in locations
+    ]
+    result.sort(
+        key=lambda member: (
+            member.jumps is None,
+            member.jumps,
+            member.user.character_name,
+        )
+    )
+    return result
+
+
 @router.get(
     "/{corporation_id}/tracking",
     response_model=GetTrackingOut,
@@ -3,7 +3,18 @@ ESI related paths
 """
 
 from datetime import datetime
-from typing import Callable, List, Optional
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Union,
+)
+import json
 
 from fastapi import (
     APIRouter,
@@ -13,6 +24,8 @@ from fastapi import (
     Response,
     status,
 )
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 import pydantic as pdt
 
 from sni.user.models import User
@@ -20,13 +33,17 @@ from sni.user.models import User
 from sni.index.index import get_user_location
 from sni.esi.scope import EsiScope
 from sni.esi.token import get_access_token
+from sni.esi.async_esi import (
+    async_esi_get_all_pages,
+    async_esi_get,
+    async_esi_iter_pages,
+    async_id_annotations,
+)
 from sni.esi.esi import (
-    esi_get_all_pages,
-    esi_get,
     EsiResponse,
     get_esi_path_scope,
-    id_annotations,
     id_to_name,
+    ids_to_names,
 )
 from sni.index.models import (
     EsiCharacterLocation,
@@ -35,7 +52,7 @@ from sni.index.models import (
     EsiSkillPoints,
     EsiWalletBalance,
 )
-from sni.uac.clearance import assert_has_clearance
+from sni.uac.clearance import assert_has_clearance, assert_has_clearances
 from sni.uac.token import (
     from_authotization_header_nondyn,
     Token,
@@ -49,10 +66,12 @@ router = APIRouter()
 
 class EsiRequestIn(pdt.BaseModel):
     """
-    Data to be forwarded to the ESI
+    Data to be forwarded to the ESI. If ``all_pages`` is ``stream``, all pages
+    are streamed as newline delimited JSON (one record per line), see
+    :meth:`sni.api.routers.esi.stream_esi_all_pages`.
     """
 
-    all_pages: bool = False
+    all_pages: Union[bool, Literal["stream"]] = False
     id_annotations: bool = False
     on_behalf_of: Optional[int] = None
     params: dict = {}
@@ -84,29 +103,47 @@ class GetCharacterLocationOut(pdt.BaseModel):
         Converts a :class:`sni.index.models.EsiCharacterLocation` to a
         :class:`sni.api.routers.esi.GetCharacterLocationOut`
         """
-        ship_type_name = id_to_name(location.ship_type_id, "type_id")
-        solar_system_name = id_to_name(
-            location.solar_system_id, "solar_system_id"
-        )
-        station_name = (
-            id_to_name(location.station_id, "station_id")
-            if location.station_id is not None
-            else None
-        )
-        return GetCharacterLocationOut(
-            user=GetUserShortOut.from_record(location.user),
-            online=location.online,
-            ship_name=location.ship_name,
-            ship_type_id=location.ship_type_id,
-            ship_type_name=ship_type_name,
-            solar_system_id=location.solar_system_id,
-            solar_system_name=solar_system_name,
-            station_id=location.station_id,
-            station_name=station_name,
-            structure_id=location.structure_id,
-            structure_name=location.structure_name,
-            timestamp=location.timestamp,
-        )
+        return GetCharacterLocationOut.from_records([location])[0]
+
+    @staticmethod
+    def from_records(
+        locations: Iterable[EsiCharacterLocation],
+    ) -> List["GetCharacterLocationOut"]:
+        """
+        Converts :class:`sni.index.models.EsiCharacterLocation` records to
+        :class:`sni.api.routers.esi.GetCharacterLocationOut`. The names of
+        all ships, solar systems, and stations are resolved at once, see
+        :meth:`sni.esi.esi.ids_to_names`.
+        """
+        locations = list(locations)
+        ids: Dict[int, str] = {}
+        for location in locations:
+            ids[location.ship_type_id] = "type_id"
+            ids[location.solar_system_id] = "solar_system_id"
+            if location.station_id is not None:
+                ids[location.station_id] = "station_id"
+        names = ids_to_names(ids)
+        return [
+            GetCharacterLocationOut(
+                user=GetUserShortOut.from_record(location.user),
+                online=location.online,
+                ship_name=location.ship_name,
+                ship_type_id=location.ship_type_id,
+                ship_type_name=names.get(location.ship_type_id, ""),
+                solar_system_id=location.solar_system_id,
+                solar_system_name=names.get(location.solar_system_id, ""),
+                station_id=location.station_id,
+                station_name=(
+                    names.get(location.station_id, "")
+                    if location.station_id is not None
+                    else None
+                ),
+                structure_id=location.structure_id,
+                structure_name=location.structure_name,
+                timestamp=location.timestamp,
+            )
+            for location in locations
+        ]
 
 
 class GetCharacterMailOut(pdt.BaseModel):
@@ -266,14 +303,18 @@ def get_history_character_location(
     ``X-Pages`` header.
     """
     usr: User = User.objects(character_id=character_id).get()
-    assert_has_clearance(tkn.owner, "esi-location.read_location.v1", usr)
-    assert_has_clearance(tkn.owner, "esi-location.read_online.v1", usr)
-    assert_has_clearance(tkn.owner, "esi-location.read_ship_type.v1", usr)
+    assert_has_clearances(
+        tkn.owner,
+        [
+            ("esi-location.read_location.v1", usr),
+            ("esi-location.read_online.v1", usr),
+            ("esi-location.read_ship_type.v1", usr),
+        ],
+    )
     query_set = EsiCharacterLocation.objects(user=usr).order_by("-timestamp")
-    return [
-        GetCharacterLocationOut.from_record(location)
-        for location in paginate(query_set, 50, page, response)
-    ]
+    return GetCharacterLocationOut.from_records(
+        paginate(query_set, 50, page, response)
+    )
 
 
 @router.post(
@@ -291,9 +332,14 @@ def post_history_character_location_now(
     the character.
     """
     usr: User = User.objects(character_id=character_id).get()
-    assert_has_clearance(tkn.owner, "esi-location.read_location.v1", usr)
-    assert_has_clearance(tkn.owner, "esi-location.read_online.v1", usr)
-    assert_has_clearance(tkn.owner, "esi-location.read_ship_type.v1", usr)
+    assert_has_clearances(
+        tkn.owner,
+        [
+            ("esi-location.read_location.v1", usr),
+            ("esi-location.read_online.v1", usr),
+            ("esi-location.read_ship_type.v1", usr),
+        ],
+    )
     location = get_user_location(usr)
     location.save()
     return GetCharacterLocationOut.from_record(location)
@@ -403,8 +449,10 @@ async def get_esi(
             target = User.objects.get(character_id=data.on_behalf_of)
             assert_has_clearance(tkn.owner, esi_scope, target)
             try:
-                esi_token = get_access_token(
-                    data.on_behalf_of, esi_scope,
+                esi_token = (
+                    await run_in_threadpool(
+                        get_access_token, data.on_behalf_of, esi_scope,
+                    )
                 ).access_token
             except LookupError:
                 raise HTTPException(
@@ -414,12 +462,47 @@ async def get_esi(
                     + str(data.on_behalf_of),
                 )
 
-    function: Callable[
-        ..., EsiResponse
-    ] = esi_get_all_pages if data.all_pages else esi_get
-    result = function(
+    if data.all_pages == "stream":
+        if data.id_annotations:
+            raise HTTPException(
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="ID annotations are not available in streaming mode",
+            )
+        return await stream_esi_all_pages(
+            esi_path, token=esi_token, kwargs={"params": data.params},
+        )
+
+    function: Callable[..., Awaitable[EsiResponse]] = (
+        async_esi_get_all_pages if data.all_pages else async_esi_get
+    )
+    result = await function(
         esi_path, token=esi_token, kwargs={"params": data.params},
     )
     if data.id_annotations:
-        result.id_annotations = id_annotations(result.data)
+        result.id_annotations = await async_id_annotations(result.data)
     return result
+
+
+async def stream_esi_all_pages(
+    esi_path: str, *, kwargs: dict, token: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Streams all pages of an ESI path as newline delimited JSON. The first page
+    is fetched before the response starts, so that ESI errors are still
+    reported with an error status, and so that the ``X-Pages`` header can be
+    set. See :meth:`sni.esi.async_esi.async_esi_iter_pages`.
+    """
+    pages = async_esi_iter_pages(esi_path, token=token, kwargs=kwargs)
+    first_page = await pages.__anext__()
+    headers = {"X-Pages": str(first_page.headers.get("X-Pages", 1))}
+
+    async def ndjson_lines() -> AsyncIterator[str]:
+        nonlocal first_page
+        yield "".join(json.dumps(record) + "\n" for record in first_page.data)
+        del first_page
+        async for page in pages:
+            yield "".join(json.dumps(record) + "\n" for record in page.data)
+
+    return StreamingResponse(
+        ndjson_lines(), headers=headers, media_type="application/x-ndjson",
+    )
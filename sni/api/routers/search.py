@@ -0,0 +1,67 @@
+"""
+Search paths
+"""
+
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
+import pydantic as pdt
+
+from sni.search.search import SearchResult, search
+from sni.uac.clearance import assert_has_clearance
+from sni.uac.token import (
+    from_authotization_header_nondyn,
+    Token,
+)
+
+router = APIRouter()
+
+
+class GetSearchResultOut(pdt.BaseModel):
+    """
+    Search result, see :class:`sni.search.search.SearchResult`
+    """
+
+    category: str
+    id: int
+    name: str
+    score: float
+
+    @staticmethod
+    def from_record(result: SearchResult) -> "GetSearchResultOut":
+        """
+        Converts a :class:`sni.search.search.SearchResult` to a
+        :class:`sni.api.routers.search.GetSearchResultOut`
+        """
+        return GetSearchResultOut(
+            category=result.category,
+            id=result.id,
+            name=result.name,
+            score=result.score,
+        )
+
+
+@router.get(
+    "",
+    response_model=List[GetSearchResultOut],
+    summary="Search by name",
+)
+def get_search(
+    q: str = Query(..., min_length=1),
+    category: Optional[List[str]] = Query(None),
+    limit: int = Query(10, ge=1, le=50),
+    tkn: Token = Depends(from_authotization_header_nondyn),
+):
+    """
+    Searches types, solar systems, constellations, regions, characters,
+    corporations, and alliances by partial name, for autocompletion. Names
+    starting with ``q``, or having a word starting with ``q``, come first,
+    followed by fuzzy matches. The results can be restricted to some
+    categories (see :data:`sni.search.search.SEARCH_CATEGORIES`). Requires a
+    clearance level of 0 or more.
+    """
+    assert_has_clearance(tkn.owner, "sni.search")
+    return [
+        GetSearchResultOut.from_record(result)
+        for result in search(q, limit, category)
+    ]
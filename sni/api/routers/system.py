@@ -3,7 +3,7 @@ SNI instance administrative paths
 """
 
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from apscheduler.job import Job
 from fastapi import (
@@ -15,6 +15,15 @@ from fastapi import (
 import pydantic as pdt
 
 from sni.conf import CONFIGURATION, Config
+from sni.db.cache import local_cache_statistics, LocalCacheStatistics
+from sni.db.cache_statistics import cache_statistics, CachePrefixStatistics
+from sni.esi.esi import etag_statistics, EtagStatistics
+from sni.esi.limiter import error_limit_status, ErrorLimitStatus
+from sni.esi.session import (
+    connection_pool_statistics,
+    ConnectionPoolStatistics,
+)
+from sni.index.index import index_run_statistics, IndexRunStatistics
 from sni.scheduler import scheduler
 from sni.uac.token import (
     from_authotization_header_nondyn,
@@ -26,6 +35,25 @@ from sni.utils import object_from_name
 router = APIRouter()
 
 
+class GetCacheStatisticsOut(pdt.BaseModel):
+    """
+    Statistics about the cache
+    """
+
+    local_cache: LocalCacheStatistics
+    prefixes: Dict[str, CachePrefixStatistics]
+
+
+class GetEsiStatisticsOut(pdt.BaseModel):
+    """
+    Statistics about ESI and EVE SSO traffic of this SNI process
+    """
+
+    connection_pools: List[ConnectionPoolStatistics]
+    error_limit: ErrorLimitStatus
+    etag: EtagStatistics
+
+
 class GetJobOut(pdt.BaseModel):
     """
     Represents a job
@@ -61,6 +89,30 @@ class GetJobOut(pdt.BaseModel):
         )
 
 
+@router.get(
+    "/cache",
+    response_model=GetCacheStatisticsOut,
+    summary="Gets cache statistics",
+)
+def get_cache_statistics(
+    tkn: Token = Depends(from_authotization_header_nondyn),
+):
+    """
+    Gets cluster-wide statistics about the cache, by key prefix (e.g.
+    ``esi``, ``sde``, ``clr``, ``ts``): hits, misses, writes, bytes written,
+    time spent decoding values, and a sampled histogram of value sizes.
+    Counters are flushed to Redis periodically (see
+    ``redis.cache_statistics_interval``), so the latest operations may be
+    missing. Also returns the statistics of the local cache of the SNI
+    process serving the request. Requires a clearance level of 10.
+    """
+    assert_has_clearance(tkn.owner, "sni.system.read_cache_statistics")
+    return GetCacheStatisticsOut(
+        local_cache=local_cache_statistics(),
+        prefixes=cache_statistics(),
+    )
+
+
 @router.get(
     "/configuration",
     response_model=Config,
@@ -75,6 +127,47 @@ def get_configuration(tkn: Token = Depends(from_authotization_header_nondyn),):
     return CONFIGURATION
 
 
+@router.get(
+    "/esi",
+    response_model=GetEsiStatisticsOut,
+    summary="Gets ESI traffic statistics",
+)
+def get_esi_statistics(
+    tkn: Token = Depends(from_authotization_header_nondyn),
+):
+    """
+    Gets statistics about the ESI and EVE SSO traffic of the SNI process
+    serving the request, e.g. how often kept-alive connections are reused,
+    the state of the (cluster-wide) ESI error budget, and how many cached
+    responses were revalidated with an ETag. Requires a clearance level of
+    10.
+    """
+    assert_has_clearance(tkn.owner, "sni.system.read_esi_statistics")
+    return GetEsiStatisticsOut(
+        connection_pools=connection_pool_statistics(),
+        error_limit=error_limit_status(),
+        etag=etag_statistics(),
+    )
+
+
+@router.get(
+    "/index",
+    response_model=Dict[str, IndexRunStatistics],
+    summary="Gets indexation job statistics",
+)
+def get_index_statistics(
+    tkn: Token = Depends(from_authotization_header_nondyn),
+):
+    """
+    Gets the statistics of the latest run of each indexation job (e.g.
+    ``location``, ``mails``, ``skillpoints``, ``wallets``): number of
+    eligible characters, number of failures, duration, and throughput.
+    Requires a clearance level of 10.
+    """
+    assert_has_clearance(tkn.owner, "sni.system.read_index_statistics")
+    return index_run_statistics()
+
+
 @router.get(
     "/job",
     response_model=List[GetJobOut],
@@ -5,7 +5,7 @@ API Server
 import logging
 from typing import List
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 import pydantic as pdt
 import uvicorn
 import yaml
@@ -80,6 +80,11 @@ ROUTERS: List[RouterConfig] = [
         prefix="/group",
         kwargs={"tags": ["Group management"]},
     ),
+    RouterConfig(
+        router="sni.api.routers.search:router",
+        prefix="/search",
+        kwargs={"tags": ["Search"]},
+    ),
     RouterConfig(
         router="sni.api.routers.teamspeak:router",
         prefix="/teamspeak",
@@ -113,6 +118,39 @@ def add_included_routers():
             router.add_to_application(app)
 
 
+# pylint: disable=import-outside-toplevel
+@app.on_event("shutdown")
+async def close_async_clients() -> None:
+    """
+    Closes the asyncio HTTP session and redis connections used by
+    :mod:`sni.esi.async_esi`.
+    """
+    from sni.db.cache import async_connection as cache_connection
+    from sni.esi.async_esi import close_async_session
+    from sni.esi.limiter import async_connection as limiter_connection
+
+    await close_async_session()
+    await cache_connection.close()
+    await limiter_connection.close()
+
+
+@app.middleware("http")
+async def mark_esi_calls_interactive(request: Request, call_next):
+    """
+    ESI calls made while serving an API request are interactive, and have
+    priority over scheduled jobs when the ESI error budget runs low. See
+    :mod:`sni.esi.limiter`.
+    """
+    # pylint: disable=import-outside-toplevel
+    from sni.esi.limiter import interactive
+
+    token = interactive.set(True)
+    try:
+        return await call_next(request)
+    finally:
+        interactive.reset(token)
+
+
 # @app.get('/ping', tags=['Testing'], summary='Replies "pong"')
 # async def get_ping():
 #     """
@@ -92,6 +92,117 @@ class ESIConfig(pdt.BaseModel):
         default="", description="ESI client secret.",
     )
 
+    error_limit_interactive_threshold: int = pdt.Field(
+        default=5,
+        description=(
+            "When the remaining ESI error budget falls to this value, "
+            "interactive (API) requests to the ESI are paused until the error "
+            "window resets."
+        ),
+        ge=0,
+    )
+
+    error_limit_pause_threshold: int = pdt.Field(
+        default=20,
+        description=(
+            "When the remaining ESI error budget falls to this value, "
+            "non-interactive (scheduled job) requests to the ESI are paused "
+            "until the error window resets."
+        ),
+        ge=0,
+    )
+
+    error_limit_throttle_threshold: int = pdt.Field(
+        default=50,
+        description=(
+            "When the remaining ESI error budget falls to this value, "
+            "non-interactive (scheduled job) requests to the ESI are slowed "
+            "down so that the rest of the budget is spread over the error "
+            "window."
+        ),
+        ge=0,
+    )
+
+    etag_retention: int = pdt.Field(
+        default=12 * 3600,
+        description=(
+            "How long (in seconds) ESI responses are kept in the cache after "
+            "they expire, so that they can be revalidated using their ETag "
+            "instead of being downloaded again. Set to 0 to disable."
+        ),
+        ge=0,
+    )
+
+    http_backoff_factor: float = pdt.Field(
+        default=0.5,
+        description=(
+            "Backoff factor (in seconds) between retries of failed ESI and "
+            "EVE SSO requests."
+        ),
+        ge=0,
+    )
+
+    http_connect_timeout: float = pdt.Field(
+        default=5,
+        description="Connection timeout (in seconds) of ESI and SSO requests.",
+        gt=0,
+    )
+
+    http_max_retries: int = pdt.Field(
+        default=3,
+        description=(
+            "Maximum number of retries of ESI and SSO requests that fail "
+            "because of a connection error or a 502, 503, or 504 response."
+        ),
+        ge=0,
+    )
+
+    http_pool_size: Optional[int] = pdt.Field(
+        default=None,
+        description=(
+            "Number of keep-alive connections to keep open per host. If "
+            "unset, defaults to ``general.scheduler_thread_count``."
+        ),
+        ge=1,
+    )
+
+    http_read_timeout: float = pdt.Field(
+        default=30,
+        description="Read timeout (in seconds) of ESI and SSO requests.",
+        gt=0,
+    )
+
+    index_concurrency: int = pdt.Field(
+        default=8,
+        description=(
+            "Maximum number of characters that are indexed concurrently by "
+            "each indexation job (location, mails, skill points, wallets)."
+        ),
+        ge=1,
+    )
+
+    page_concurrency: int = pdt.Field(
+        default=5,
+        description=(
+            "Maximum number of pages of a paginated ESI path that are "
+            "fetched concurrently."
+        ),
+        ge=1,
+    )
+
+    stale_while_revalidate: int = pdt.Field(
+        default=0,
+        description=(
+            "Grace period (in seconds) after an ESI response expires, during "
+            "which it is still served from the cache while it is refreshed "
+            "in the background. If the refresh fails, the stale response "
+            "keeps being served until the end of the grace period. Stale "
+            "responses carry an ``X-SNI-Stale`` header. Set to 0 to "
+            "disable."
+        ),
+        ge=0,
+    )
+
 
 class GeneralConfig(pdt.BaseModel):
     """
@@ -227,6 +338,42 @@ class RedisConfig(pdt.BaseModel):
     Redis configuration model
     """
 
+    cache_compression_level: int = pdt.Field(
+        default=1,
+        description="Zlib compression level of large cache values.",
+        ge=1,
+        le=9,
+    )
+
+    cache_compression_threshold: int = pdt.Field(
+        default=1024,
+        description=(
+            "Cache values whose serialized size (in bytes) exceeds this "
+            "threshold are compressed."
+        ),
+        ge=0,
+    )
+
+    cache_statistics_interval: int = pdt.Field(
+        default=10,
+        description=(
+            "How often (in seconds) each SNI process adds its cache "
+            "statistics to the cluster-wide statistics in Redis. Set to 0 to "
+            "disable cache statistics."
+        ),
+        ge=0,
+    )
+
+    cache_statistics_sample_rate: float = pdt.Field(
+        default=0.01,
+        description=(
+            "Fraction of the cache writes whose size is sampled for the key "
+            "size histograms of the cache statistics."
+        ),
+        ge=0,
+        le=1,
+    )
+
     database: int = pdt.Field(
         default=0, description="Redis database to use.",
     )
@@ -235,10 +382,107 @@ class RedisConfig(pdt.BaseModel):
         default="redis", description="Redis hostname.",
     )
 
+    local_cache_size: int = pdt.Field(
+        default=0,
+        description=(
+            "Maximum number of cache values each SNI process keeps in memory, "
+            "in front of Redis. Set to 0 to disable the local cache."
+        ),
+        ge=0,
+    )
+
+    local_cache_ttl: int = pdt.Field(
+        default=10,
+        description=(
+            "Maximum time (in seconds) a cache value is kept in the local "
+            "cache of an SNI process."
+        ),
+        ge=1,
+    )
+
     port: int = pdt.Field(
         default=6379, description="Redis port.", ge=0, le=65535,
     )
 
+    single_flight_timeout: int = pdt.Field(
+        default=60,
+        description=(
+            "Maximum time (in seconds) a process holds a single-flight lock "
+            "(e.g. while making an ESI request on behalf of other "
+            "processes). Other processes stop waiting after that time."
+        ),
+        ge=1,
+    )
+
+
+class SDEConfig(pdt.BaseModel):
+    """
+    SDE (EVE Static Data Export) configuration model
+    """
+
+    data_directory: str = pdt.Field(
+        default=".",
+        description=(
+            "Directory where the SDE dump is downloaded and decompressed. A "
+            "partial download is kept there, and resumed by the next SDE "
+            "update."
+        ),
+    )
+
+    download_chunk_size: int = pdt.Field(
+        default=1048576,
+        description=(
+            "Size (in bytes) of the chunks in which the SDE dump is "
+            "downloaded."
+        ),
+        ge=1,
+    )
+
+    download_queue_size: int = pdt.Field(
+        default=16,
+        description=(
+            "Maximum number of downloaded SDE dump chunks waiting to be "
+            "decompressed."
+        ),
+        ge=1,
+    )
+
+    import_batch_size: int = pdt.Field(
+        default=1000,
+        description=(
+            "Average number of rows of the SDE import batches. Each batch "
+            "is hashed, and only the batches that changed since the last "
+            "import are compared to the database and written."
+        ),
+        ge=1,
+    )
+
+    name_table_mmap: bool = pdt.Field(
+        default=True,
+        description=(
+            "Wether the SDE name table file is memory-mapped, so that all "
+            "SNI processes share its pages. Otherwise, each process reads it "
+            "in memory."
+        ),
+    )
+
+    name_table_path: str = pdt.Field(
+        default="sde_names.bin",
+        description=(
+            "Path of the SDE name table file, which is generated after each "
+            "SDE import, and used to resolve the names of SDE objects "
+            "without querying the database."
+        ),
+    )
+
+    solar_system_graph_path: str = pdt.Field(
+        default="sde_universe.bin",
+        description=(
+            "Path of the solar system graph file, which is generated after "
+            "each SDE import, and used to compute jump distances."
+        ),
+    )
+
 
 class SentryConfig(pdt.BaseModel):
     """
@@ -363,6 +607,10 @@ class Config(pdt.BaseSettings):
         default=RedisConfig(), description="Redis configuration document.",
     )
 
+    sde: SDEConfig = pdt.Field(
+        default=SDEConfig(), description="SDE configuration document.",
+    )
+
     sentry: SentryConfig = pdt.Field(
         default=SentryConfig(), description="Sentry configuration document.",
     )
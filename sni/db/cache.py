@@ -1,53 +1,742 @@
 """
 Redis based TTL cache
+
+Optionally, values read through :meth:`sni.db.cache.cache_get` are also kept
+in a small in-process cache (the local cache), for at most
+``redis.local_cache_ttl`` seconds, and never longer than they remain in
+Redis. Invalidations, and writes (since they may overwrite a value), are
+broadcasted to all SNI processes through Redis pub/sub, so that they drop
+their local copy, see :meth:`sni.db.cache.invalidate_cache` and
+:meth:`sni.db.cache.cache_set`.
+
+Cache entries can carry tags (e.g. ``user:<character_id>``), see
+:meth:`sni.db.cache.cache_tag_many`. All the entries carrying a tag can then
+be invalidated at once with :meth:`sni.db.cache.invalidate_tag`.
+
+Functions can be cached with the :meth:`sni.db.cache.cached` decorator, or
+:meth:`sni.db.cache.cached_call`, which store values in
+:class:`sni.db.cache.CacheEntry` envelopes.
 """
 
-from typing import Any, Optional, Tuple
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 import logging
+import math
 import pickle  # nosec
+import random
+import time
 
+import pydantic as pdt
+from redis.client import Pipeline, PubSubWorkerThread
 from redis.exceptions import RedisError
 from xxhash import xxh64_hexdigest
 
-from .redis import new_redis_connection
+from sni.conf import CONFIGURATION as conf
+
+from .cache_statistics import record_get, record_set
+from .codec import decode, encode
+from .redis import new_async_redis_connection, new_redis_connection
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+"""Redis pub/sub channel over which invalidated (hashed) keys are
+broadcasted"""
+
+TAG_PREFIX = "tag:"
+"""Prefix of the Redis sets holding the (hashed) keys of the cache entries
+carrying a given tag"""
+
+TAG_SCRIPT = """
+redis.call("SADD", KEYS[1], ARGV[1])
+if redis.call("TTL", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+"""
+"""Lua script adding a (hashed) key to a tag set, and extending the TTL of the
+set to that of the entry if it is longer. ``EXPIRE`` with the ``NX`` and
+``GT`` options would require Redis 7."""
+
+T = TypeVar("T")
 
 connection = new_redis_connection()
 
+async_connection = new_async_redis_connection()
+"""Asyncio redis connection, to be used from the API server event loop"""
+
+_invalidation_thread: Optional[PubSubWorkerThread] = None
+_invalidation_thread_lock = Lock()
+_tag_script = connection.register_script(TAG_SCRIPT)
+
+
+class CacheEntry(NamedTuple):
+    """
+    Envelope of the values cached by :meth:`sni.db.cache.cached_call`.
+    """
+
+    value: Any
+    """Cached value, ``None`` for negative results"""
+
+    delta: float
+    """Time (in seconds) it took to compute the value"""
+
+    expires_at: float
+    """Timestamp at which the value expires"""
+
+    @classmethod
+    def new(cls, value: Any, ttl: int, delta: float = 0.0) -> "CacheEntry":
+        """
+        Creates an entry expiring in ``ttl`` seconds. Use this to write
+        values that are read by :meth:`sni.db.cache.cached_call`, e.g. in
+        bulk with :meth:`sni.db.cache.cache_set_many`.
+        """
+        return cls(value=value, delta=delta, expires_at=time.time() + ttl)
+
+
+class LocalCache:
+    """
+    Thread-safe, bounded, in-process LRU cache with per-entry TTL. Values
+    are stored encoded, so that callers never share mutable objects.
+    """
+
+    hits: int
+    max_size: int
+    misses: int
+
+    _entries: "OrderedDict[str, Tuple[float, bytes]]"
+    _lock: Lock
+
+    def __init__(self, max_size: int):
+        self.hits = 0
+        self.max_size = max_size
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """
+        Drops all entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def delete(self, key: str) -> None:
+        """
+        Drops an entry, if present
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the value of an entry, or ``None`` if it is absent or
+        expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """
+        Sets an entry, evicting the least recently used one if the cache is
+        full
+        """
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class LocalCacheStatistics(pdt.BaseModel):
+    """
+    Statistics of the local cache of this SNI process
+    """
+
+    enabled: bool
+    hits: int
+    max_size: int
+    misses: int
+    size: int
+
+
+local_cache = LocalCache(conf.redis.local_cache_size)
+"""Local cache of this process"""
+
+
+async def async_cache_expire(key: Tuple[Optional[str], Any], ttl: int) -> None:
+    """
+    Asyncio version of :meth:`sni.db.cache.cache_expire`.
+    """
+    try:
+        await async_connection.expire(hash_key(key), ttl)
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+async def async_cache_get(key: Tuple[Optional[str], Any]) -> Optional[Any]:
+    """
+    Asyncio version of :meth:`sni.db.cache.cache_get`.
+    """
+    hashed_key = hash_key(key)
+    if local_cache.max_size <= 0:
+        result = await async_connection.get(hashed_key)
+    else:
+        result = local_cache.get(hashed_key)
+        if result is None:
+            _start_invalidation_listener()
+            async with async_connection.pipeline(
+                transaction=False
+            ) as pipeline:
+                pipeline.get(hashed_key)
+                pipeline.ttl(hashed_key)
+                result, ttl = await pipeline.execute()
+            if result is not None:
+                local_cache.set(
+                    hashed_key, result, min(ttl, conf.redis.local_cache_ttl)
+                )
+    if result is not None:
+        logging.debug("Cache hit %s %s", hashed_key, str(key)[:30])
+    return _decode(key, hashed_key, result)
+
+
+async def async_cache_get_many(
+    keys: List[Tuple[Optional[str], Any]]
+) -> List[Optional[Any]]:
+    """
+    Asyncio version of :meth:`sni.db.cache.cache_get_many`.
+    """
+    hashed_keys = [hash_key(key) for key in keys]
+    results, missing = _local_cache_get_many(hashed_keys)
+    if missing:
+        async with async_connection.pipeline(transaction=False) as pipeline:
+            pipeline.mget([hashed_keys[i] for i in missing])
+            if local_cache.max_size > 0:
+                _start_invalidation_listener()
+                for i in missing:
+                    pipeline.ttl(hashed_keys[i])
+            fetched, *ttls = await pipeline.execute()
+        _local_cache_set_many(hashed_keys, results, missing, fetched, ttls)
+    return [
+        _decode(key, hashed_key, result)
+        for key, hashed_key, result in zip(keys, hashed_keys, results)
+    ]
+
+
+async def async_cache_get_many_with_ttl(
+    keys: List[Tuple[Optional[str], Any]]
+) -> List[Tuple[Optional[Any], int]]:
+    """
+    Asyncio version of :meth:`sni.db.cache.cache_get_many_with_ttl`.
+    """
+    hashed_keys = [hash_key(key) for key in keys]
+    async with async_connection.pipeline(transaction=False) as pipeline:
+        for hashed_key in hashed_keys:
+            pipeline.get(hashed_key)
+            pipeline.ttl(hashed_key)
+        results = await pipeline.execute()
+    return [
+        (_decode(key, hashed_key, results[2 * i]), results[2 * i + 1])
+        for i, (key, hashed_key) in enumerate(zip(keys, hashed_keys))
+    ]
+
+
+async def async_cache_get_with_ttl(
+    key: Tuple[Optional[str], Any]
+) -> Tuple[Optional[Any], int]:
+    """
+    Asyncio version of :meth:`sni.db.cache.cache_get_with_ttl`.
+    """
+    hashed_key = hash_key(key)
+    async with async_connection.pipeline(transaction=False) as pipeline:
+        pipeline.get(hashed_key)
+        pipeline.ttl(hashed_key)
+        result, ttl = await pipeline.execute()
+    if result is not None:
+        logging.debug("Cache hit %s %s", hashed_key, str(key)[:30])
+    return _decode(key, hashed_key, result), ttl
+
+
+async def async_cache_set(
+    key: Tuple[Optional[str], Any], value: Any, ttl: int = 60
+) -> None:
+    """
+    Asyncio version of :meth:`sni.db.cache.cache_set`.
+    """
+    hashed_key = hash_key(key)
+    local_cache.delete(hashed_key)
+    try:
+        async with async_connection.pipeline(transaction=False) as pipeline:
+            pipeline.setex(hashed_key, ttl, _encode(key, value))
+            _publish_write(pipeline, hashed_key)
+            await pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+async def async_cache_set_many(
+    items: Iterable[Tuple[Tuple[Optional[str], Any], Any, int]]
+) -> None:
+    """
+    Asyncio version of :meth:`sni.db.cache.cache_set_many`.
+    """
+    try:
+        async with async_connection.pipeline(transaction=False) as pipeline:
+            for key, value, ttl in items:
+                hashed_key = hash_key(key)
+                local_cache.delete(hashed_key)
+                pipeline.setex(hashed_key, ttl, _encode(key, value))
+                _publish_write(pipeline, hashed_key)
+            await pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+async def async_invalidate_cache(key: Tuple[Optional[str], Any]) -> None:
+    """
+    Asyncio version of :meth:`sni.db.cache.invalidate_cache`.
+    """
+    hashed_key = hash_key(key)
+    local_cache.delete(hashed_key)
+    async with async_connection.pipeline(transaction=False) as pipeline:
+        pipeline.delete(hashed_key)
+        pipeline.publish(INVALIDATION_CHANNEL, hashed_key)
+        await pipeline.execute()
+
+
+def cache_expire(key: Tuple[Optional[str], Any], ttl: int) -> None:
+    """
+    Sets the remaining TTL of a cache value, without transferring it.
+    """
+    try:
+        connection.expire(hash_key(key), ttl)
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
 
 def cache_get(key: Tuple[Optional[str], Any]) -> Optional[Any]:
     """
     Retrieves a value from the cache, or returns None if the key is unknown.
-    The key must be a picklable object.
+    The key must be a picklable object. The local cache is looked up first,
+    if enabled.
     """
     hashed_key = hash_key(key)
-    result = connection.get(hashed_key)
+    if local_cache.max_size <= 0:
+        result = connection.get(hashed_key)
+    else:
+        result = local_cache.get(hashed_key)
+        if result is None:
+            _start_invalidation_listener()
+            pipeline = connection.pipeline(transaction=False)
+            pipeline.get(hashed_key)
+            pipeline.ttl(hashed_key)
+            result, ttl = pipeline.execute()
+            if result is not None:
+                local_cache.set(
+                    hashed_key, result, min(ttl, conf.redis.local_cache_ttl)
+                )
     if result is not None:
         logging.debug("Cache hit %s %s", hashed_key, str(key)[:30])
-        return pickle.loads(result)  # nosec
-    return None
+    return _decode(key, hashed_key, result)
+
+
+def cache_get_many(
+    keys: List[Tuple[Optional[str], Any]]
+) -> List[Optional[Any]]:
+    """
+    Bulk version of :meth:`sni.db.cache.cache_get`. Returns the values in the
+    same order as the keys (``None`` for unknown keys). Values that are not in
+    the local cache are retrieved in a single round trip, using ``MGET``.
+    """
+    hashed_keys = [hash_key(key) for key in keys]
+    results, missing = _local_cache_get_many(hashed_keys)
+    if missing:
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.mget([hashed_keys[i] for i in missing])
+        if local_cache.max_size > 0:
+            _start_invalidation_listener()
+            for i in missing:
+                pipeline.ttl(hashed_keys[i])
+        fetched, *ttls = pipeline.execute()
+        _local_cache_set_many(hashed_keys, results, missing, fetched, ttls)
+    return [
+        _decode(key, hashed_key, result)
+        for key, hashed_key, result in zip(keys, hashed_keys, results)
+    ]
+
+
+def cache_get_many_with_ttl(
+    keys: List[Tuple[Optional[str], Any]]
+) -> List[Tuple[Optional[Any], int]]:
+    """
+    Bulk version of :meth:`sni.db.cache.cache_get_with_ttl`. Returns the
+    ``(value, ttl)`` pairs in the same order as the keys, in a single round
+    trip.
+    """
+    hashed_keys = [hash_key(key) for key in keys]
+    pipeline = connection.pipeline(transaction=False)
+    for hashed_key in hashed_keys:
+        pipeline.get(hashed_key)
+        pipeline.ttl(hashed_key)
+    results = pipeline.execute()
+    return [
+        (_decode(key, hashed_key, results[2 * i]), results[2 * i + 1])
+        for i, (key, hashed_key) in enumerate(zip(keys, hashed_keys))
+    ]
+
+
+def cache_get_with_ttl(
+    key: Tuple[Optional[str], Any]
+) -> Tuple[Optional[Any], int]:
+    """
+    Like :meth:`sni.db.cache.cache_get`, but also returns the remaining TTL
+    of the value (in seconds), in the same round trip. If the key is unknown,
+    the returned value is ``None``, and the TTL is negative.
+    """
+    hashed_key = hash_key(key)
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.get(hashed_key)
+    pipeline.ttl(hashed_key)
+    result, ttl = pipeline.execute()
+    if result is not None:
+        logging.debug("Cache hit %s %s", hashed_key, str(key)[:30])
+    return _decode(key, hashed_key, result), ttl
 
 
 def cache_set(
-    key: Tuple[Optional[str], Any], value: Any, ttl: int = 60
+    key: Tuple[Optional[str], Any],
+    value: Any,
+    ttl: int = 60,
+    *,
+    tags: Iterable[str] = (),
+) -> None:
+    """
+    Sets a value in the cache. The key and value must be picklable. The entry
+    can be tagged, see :meth:`sni.db.cache.cache_tag_many`. If the local
+    cache is enabled, the write is broadcasted so that other SNI processes
+    drop their local copy of the previous value.
+    """
+    hashed_key = hash_key(key)
+    local_cache.delete(hashed_key)
+    try:
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.setex(hashed_key, ttl, _encode(key, value))
+        _publish_write(pipeline, hashed_key)
+        _tag(pipeline, hashed_key, tags, ttl)
+        pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+def cache_set_many(
+    items: Iterable[Tuple[Tuple[Optional[str], Any], Any, int]]
+) -> None:
+    """
+    Bulk version of :meth:`sni.db.cache.cache_set`. Takes an iterable of
+    ``(key, value, ttl)`` triples, which are set in a single round trip,
+    using pipelined ``SETEX`` commands.
+    """
+    try:
+        pipeline = connection.pipeline(transaction=False)
+        for key, value, ttl in items:
+            hashed_key = hash_key(key)
+            local_cache.delete(hashed_key)
+            pipeline.setex(hashed_key, ttl, _encode(key, value))
+            _publish_write(pipeline, hashed_key)
+        pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+def cache_tag_many(
+    items: Iterable[Tuple[Tuple[Optional[str], Any], Iterable[str], int]]
 ) -> None:
     """
-    Sets a value in the cache. The key and value must be picklable.
+    Tags cache entries. Takes an iterable of ``(key, tags, ttl)`` triples,
+    where ``ttl`` is the TTL of the entry. The hashed key of the entry is
+    added to the Redis set of each tag (see
+    :data:`sni.db.cache.TAG_PREFIX`), which lives at least as long as the
+    entry. Tagged entries can be invalidated with
+    :meth:`sni.db.cache.invalidate_tag`.
     """
     try:
-        connection.setex(hash_key(key), ttl, pickle.dumps(value))
+        pipeline = connection.pipeline(transaction=False)
+        for key, tags, ttl in items:
+            _tag(pipeline, hash_key(key), tags, ttl)
+        pipeline.execute()
     except RedisError as error:
         logging.error("Redis error: %s", str(error))
 
 
+def cached(
+    key: Callable[..., Tuple[Optional[str], Any]],
+    ttl: Union[int, Callable[[Any], int]] = 60,
+    *,
+    early_refresh: float = 1.0,
+    negative_ttl: Optional[int] = None,
+    single_flight: bool = False,
+    tags: Optional[Callable[..., Iterable[str]]] = None,
+) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """
+    Decorator that caches the results of a function. The cache key, and the
+    tags of the entry if ``tags`` is set, are computed by calling ``key`` and
+    ``tags`` with the arguments of the function. See
+    :meth:`sni.db.cache.cached_call` for the other arguments.
+
+    Example::
+
+        @cached(lambda field_id: ("sde:" + str(field_id), None), 1 * DAY)
+        def get_name(field_id: int) -> Optional[str]:
+            ...
+
+    """
+
+    def decorator(function: Callable[..., T]) -> Callable[..., T]:
+        @wraps(function)
+        def wrapper(*args, **kwargs) -> T:
+            return cached_call(
+                key(*args, **kwargs),
+                lambda: function(*args, **kwargs),
+                ttl,
+                early_refresh=early_refresh,
+                negative_ttl=negative_ttl,
+                single_flight=single_flight,
+                tags=(lambda: tags(*args, **kwargs)) if tags else None,
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def cached_call(
+    key: Tuple[Optional[str], Any],
+    function: Callable[[], T],
+    ttl: Union[int, Callable[[Any], int]] = 60,
+    *,
+    early_refresh: float = 1.0,
+    negative_ttl: Optional[int] = None,
+    single_flight: bool = False,
+    tags: Optional[Callable[[], Iterable[str]]] = None,
+) -> T:
+    """
+    Returns the cached value at the given key, or calls the function and
+    caches its result.
+
+    Args:
+        key: Cache key, see :meth:`sni.db.cache.hash_key`
+        function: Computes the value if it is not cached
+        ttl: TTL of the cached value (in seconds), or a function computing
+            it from the value. Values with a non positive TTL are not cached.
+        early_refresh: To avoid cache stampedes, a cached value may be
+            recomputed before it expires, with a probability that increases
+            as it nears expiration and with the time it took to compute
+            (the XFetch algorithm, of which this is the ``beta`` parameter).
+            Set to 0 to disable.
+        negative_ttl: If set, ``None`` results are cached for that long.
+            Otherwise, they are not cached.
+        single_flight: If set, concurrent calls with the same key only call
+            the function once, see :mod:`sni.db.singleflight`.
+        tags: If set, computes the tags of the entry when it is stored, see
+            :meth:`sni.db.cache.cache_tag_many`.
+    """
+    entry = cache_get(key)
+    if isinstance(entry, CacheEntry) and not _needs_refresh(
+        entry, early_refresh
+    ):
+        return entry.value
+
+    def compute() -> T:
+        if single_flight:
+            # Another process may have just computed the value
+            new_entry = cache_get(key)
+            if isinstance(new_entry, CacheEntry) and (
+                not isinstance(entry, CacheEntry)
+                or new_entry.expires_at > entry.expires_at
+            ):
+                return new_entry.value
+        start = time.monotonic()
+        value = function()
+        delta = time.monotonic() - start
+        if value is None:
+            value_ttl = negative_ttl if negative_ttl is not None else 0
+        else:
+            value_ttl = ttl(value) if callable(ttl) else ttl
+        if value_ttl > 0:
+            cache_set(
+                key,
+                CacheEntry.new(value, value_ttl, delta),
+                value_ttl,
+                tags=tags() if tags is not None else (),
+            )
+        return value
+
+    if single_flight:
+        # pylint: disable=import-outside-toplevel
+        from .singleflight import single_flight as run_single_flight
+
+        return run_single_flight(key, compute)
+    return compute()
+
+
+def _decode(
+    key: Tuple[Optional[str], Any], hashed_key: str, value: Optional[bytes]
+) -> Optional[Any]:
+    """
+    Decodes a cache value read at a given key, see :mod:`sni.db.codec`, and
+    records the lookup, see :mod:`sni.db.cache_statistics`. Values that are
+    ``None`` or that cannot be decoded are cache misses.
+    """
+    if value is None:
+        record_get(key[0], hits=0, misses=1, decode_time=0.0)
+        return None
+    start = time.perf_counter()
+    try:
+        result = decode(value)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.warning(
+            "Could not decode cache value %s: %s", hashed_key, str(error)
+        )
+        record_get(key[0], hits=0, misses=1, decode_time=0.0)
+        return None
+    record_get(
+        key[0], hits=1, misses=0, decode_time=time.perf_counter() - start
+    )
+    return result
+
+
+def _encode(key: Tuple[Optional[str], Any], value: Any) -> bytes:
+    """
+    Encodes a cache value to be written at a given key, see
+    :mod:`sni.db.codec`, and records the write, see
+    :mod:`sni.db.cache_statistics`.
+    """
+    data = encode(value)
+    record_set(key[0], len(data))
+    return data
+
+
+def encode_key_document(document: Any) -> str:
+    """
+    Encodes a cache key document in a canonical form: if two documents are
+    equal, then so are their encodings. In addition, lists and tuples are
+    encoded the same way, as are sets and frozensets. Dict items and set
+    elements are sorted by encoding, so their order does not matter. Values
+    of types other than ``None``, ``bool``, ``int``, ``float``, ``str``,
+    ``bytes``, lists, tuples, sets, and dicts are pickled, which is not
+    guaranteed to be canonical.
+    """
+    parts: List[str] = []
+    _encode_key_document(document, parts)
+    return "".join(parts)
+
+
+def _encode_key_document(document: Any, parts: List[str]) -> None:
+    """
+    Recursive implementation of :meth:`sni.db.cache.encode_key_document`.
+    Strings are length-prefixed and numbers are terminated, so that the
+    encoding is unambiguous. The common cases (exact strings, integers, and
+    ``None``, possibly in a list or tuple) are tested first, by type
+    identity.
+    """
+    kind = type(document)
+    if kind is str:
+        parts.append(f"s{len(document)}:")
+        parts.append(document)
+    elif kind is int:
+        parts.append(f"i{document};")
+    elif document is None:
+        parts.append("n")
+    elif kind is list or kind is tuple:
+        parts.append("l")
+        for item in document:
+            item_kind = type(item)
+            if item_kind is str:
+                parts.append(f"s{len(item)}:")
+                parts.append(item)
+            elif item_kind is int:
+                parts.append(f"i{item};")
+            elif item is None:
+                parts.append("n")
+            else:
+                _encode_key_document(item, parts)
+        parts.append("e")
+    else:
+        _encode_other_key_document(document, parts)
+
+
+def _encode_other_key_document(document: Any, parts: List[str]) -> None:
+    """
+    Encodes the less common cases for
+    :meth:`sni.db.cache._encode_key_document`, including subclasses of
+    ``str``, ``int``, ``list``, and ``tuple`` (e.g. enums).
+    """
+    if isinstance(document, str):
+        parts.append(f"s{len(document)}:")
+        parts.append(str.__str__(document))
+    elif isinstance(document, int):
+        parts.append(f"i{int(document)};")
+    elif isinstance(document, float):
+        if document.is_integer():
+            parts.append(f"i{int(document)};")
+        else:
+            parts.append(f"f{document!r};")
+    elif isinstance(document, (list, tuple)):
+        _encode_key_document(list(document), parts)
+    elif isinstance(document, dict):
+        parts.append("d")
+        parts.extend(
+            sorted(
+                encode_key_document(key) + encode_key_document(value)
+                for key, value in document.items()
+            )
+        )
+        parts.append("e")
+    elif isinstance(document, (set, frozenset)):
+        parts.append("S")
+        parts.extend(sorted(encode_key_document(item) for item in document))
+        parts.append("e")
+    elif isinstance(document, bytes):
+        parts.append(f"b{len(document)}:")
+        parts.append(document.hex())
+    else:
+        pickled = pickle.dumps(document).hex()
+        parts.append(f"p{len(pickled)}:")
+        parts.append(pickled)
+
+
 def hash_key(key: Tuple[Optional[str], Any]) -> str:
     """
-    Creates a key from a picklable document and an optional humann readable
-    prefix.
+    Creates a key from a document and an optional humann readable prefix. The
+    document is encoded with :meth:`sni.db.cache.encode_key_document`, so
+    that equal documents always map to the same key.
     """
     prefix, document = key
     raw = [
         prefix,
-        xxh64_hexdigest(pickle.dumps(document))
+        xxh64_hexdigest(encode_key_document(document).encode())
         if document is not None
         else None,
     ]
@@ -56,6 +745,179 @@ def hash_key(key: Tuple[Optional[str], Any]) -> str:
 
 def invalidate_cache(key: Tuple[Optional[str], Any]):
     """
-    Invalidates a cache value
+    Invalidates a cache value, in Redis and in the local caches of all SNI
+    processes.
+    """
+    hashed_key = hash_key(key)
+    local_cache.delete(hashed_key)
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.delete(hashed_key)
+    pipeline.publish(INVALIDATION_CHANNEL, hashed_key)
+    pipeline.execute()
+
+
+def invalidate_tag(tag: str) -> None:
+    """
+    Invalidates all the cache entries carrying a tag, see
+    :meth:`sni.db.cache.invalidate_tags`.
+    """
+    invalidate_tags([tag])
+
+
+def invalidate_tags(tags: Iterable[str]) -> None:
+    """
+    Invalidates all the cache entries carrying any of the given tags, in
+    Redis and in the local caches of all SNI processes. The tag sets are read
+    and deleted atomically, so that entries tagged concurrently are either
+    invalidated or remain tagged.
+    """
+    tags = list(tags)
+    tag_keys = [TAG_PREFIX + tag for tag in tags]
+    if not tag_keys:
+        return
+    try:
+        pipeline = connection.pipeline(transaction=True)
+        for tag_key in tag_keys:
+            pipeline.smembers(tag_key)
+        pipeline.delete(*tag_keys)
+        *members, _ = pipeline.execute()
+        hashed_keys = {
+            hashed_key.decode() for keys in members for hashed_key in keys
+        }
+        if not hashed_keys:
+            return
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.delete(*hashed_keys)
+        for hashed_key in hashed_keys:
+            local_cache.delete(hashed_key)
+            pipeline.publish(INVALIDATION_CHANNEL, hashed_key)
+        pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+    logging.debug("Invalidated cache tags %s", ", ".join(tags))
+
+
+def _invalidation_listener_exception_handler(
+    error: BaseException, pubsub: Any, thread: PubSubWorkerThread
+) -> None:
+    """
+    Called when the invalidation listener loses its connection. Since
+    invalidations may have been missed, the local cache is cleared.
+    """
+    logging.error("Redis error: %s", str(error))
+    local_cache.clear()
+    time.sleep(1)
+
+
+def local_cache_statistics() -> LocalCacheStatistics:
+    """
+    Returns the statistics of the local cache of this process
+    """
+    return LocalCacheStatistics(
+        enabled=local_cache.max_size > 0,
+        hits=local_cache.hits,
+        max_size=local_cache.max_size,
+        misses=local_cache.misses,
+        size=len(local_cache),
+    )
+
+
+def _local_cache_get_many(
+    hashed_keys: List[str],
+) -> Tuple[List[Optional[bytes]], List[int]]:
+    """
+    Looks up (hashed) keys in the local cache. Returns the (encoded) values,
+    and the indices of the keys that were not found.
+    """
+    if local_cache.max_size <= 0:
+        return [None] * len(hashed_keys), list(range(len(hashed_keys)))
+    results = [local_cache.get(hashed_key) for hashed_key in hashed_keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    return results, missing
+
+
+def _local_cache_set_many(
+    hashed_keys: List[str],
+    results: List[Optional[bytes]],
+    missing: List[int],
+    fetched: List[Optional[bytes]],
+    ttls: List[int],
+) -> None:
+    """
+    Fills the missing results of :meth:`sni.db.cache._local_cache_get_many`
+    with the values fetched from Redis, and stores them in the local cache if
+    it is enabled (in which case the TTLs of the values are given).
+    """
+    for j, i in enumerate(missing):
+        results[i] = fetched[j]
+        if fetched[j] is not None and ttls:
+            local_cache.set(
+                hashed_keys[i],
+                fetched[j],
+                min(ttls[j], conf.redis.local_cache_ttl),
+            )
+
+
+def _needs_refresh(entry: CacheEntry, early_refresh: float) -> bool:
+    """
+    Tells wether a cached value should be recomputed before it expires, see
+    :meth:`sni.db.cache.cached_call`.
+
+    See also:
+        `Optimal Probabilistic Cache Stampede Prevention <https://cseweb.ucsd.edu/~avattani/papers/cache_stampede.pdf>`_
+    """
+    if early_refresh <= 0:
+        return False
+    jitter = -entry.delta * early_refresh * math.log(1 - random.random())
+    return time.time() + jitter >= entry.expires_at
+
+
+def _on_invalidation(message: dict) -> None:
+    """
+    Drops an invalidated key from the local cache
+    """
+    local_cache.delete(message["data"].decode())
+
+
+def _publish_write(pipeline: Any, hashed_key: str) -> None:
+    """
+    Queues the broadcast of a write to a (hashed) key, so that the other SNI
+    processes drop it from their local cache. Does nothing if the local cache
+    is disabled, since the configuration is shared by all processes.
+    """
+    if local_cache.max_size > 0:
+        pipeline.publish(INVALIDATION_CHANNEL, hashed_key)
+
+
+def _start_invalidation_listener() -> None:
+    """
+    Starts the thread listening to invalidation broadcasts, if it is not
+    running already.
+    """
+    global _invalidation_thread
+    if _invalidation_thread is not None:
+        return
+    with _invalidation_thread_lock:
+        if _invalidation_thread is not None:
+            return
+        pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATION_CHANNEL: _on_invalidation})
+        _invalidation_thread = pubsub.run_in_thread(
+            daemon=True,
+            exception_handler=_invalidation_listener_exception_handler,
+            sleep_time=1,
+        )
+
+
+def _tag(
+    pipeline: Pipeline, hashed_key: str, tags: Iterable[str], ttl: int
+) -> None:
+    """
+    Queues the commands adding a (hashed) key to the sets of the given tags.
+    Each set is set to expire with the longest lived of its entries, see
+    :data:`sni.db.cache.TAG_SCRIPT`.
     """
-    connection.delete(hash_key(key))
+    for tag in tags:
+        _tag_script(
+            keys=[TAG_PREFIX + tag], args=[hashed_key, ttl], client=pipeline
+        )
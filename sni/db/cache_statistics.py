@@ -0,0 +1,192 @@
+"""
+Cache statistics.
+
+Every SNI process counts, for each key prefix, the hits, misses, and sets of
+:mod:`sni.db.cache`, the number of bytes written, and the time spent decoding
+values. It also samples the size of the values it writes (see
+``redis.cache_statistics_sample_rate``). The counters are kept in memory, and
+a background thread adds them to Redis every
+``redis.cache_statistics_interval`` seconds, where they are aggregated across
+all processes. See :meth:`sni.db.cache_statistics.cache_statistics`.
+
+Keys are grouped by the first ``:``-separated segment of their prefix, so
+that e.g. ``ts:clientlist`` and ``ts:servergrouplist`` are both counted
+under ``ts``, and ``sde:30000142`` under ``sde``.
+"""
+
+from collections import Counter
+from threading import Lock, Thread
+from typing import Dict, Optional, Tuple
+import logging
+import random
+import time
+
+import pydantic as pdt
+from redis.exceptions import RedisError
+
+from sni.conf import CONFIGURATION as conf
+
+from .redis import new_redis_connection
+
+CACHE_STATISTICS_KEY = "cache:statistics"
+"""Redis set of the known statistics prefixes. The counters of a prefix are
+stored in the hash ``cache:statistics:<prefix>``."""
+
+NO_PREFIX = "none"
+"""Statistics prefix of the keys that have no prefix"""
+
+connection = new_redis_connection()
+
+_counters: "Counter[Tuple[str, str]]" = Counter()
+_counters_lock = Lock()
+_flush_thread: Optional[Thread] = None
+_flush_thread_lock = Lock()
+
+
+class CachePrefixStatistics(pdt.BaseModel):
+    """
+    Cluster-wide statistics of the cache keys sharing a prefix
+    """
+
+    bytes_written: int
+    decode_time: float
+    """Total time (in seconds) spent decoding values"""
+    hit_ratio: Optional[float]
+    hits: int
+    key_sizes: Dict[int, int]
+    """Histogram of the sampled sizes of the values written, mapping a power
+    of two to the number of values whose size (in bytes) is at most that
+    power of two, and more than the previous one"""
+    misses: int
+    sets: int
+
+
+def cache_statistics() -> Dict[str, CachePrefixStatistics]:
+    """
+    Returns the cluster-wide cache statistics, by prefix. Counters that have
+    not been flushed to Redis yet are not included.
+    """
+    prefixes = sorted(
+        prefix.decode() for prefix in connection.smembers(CACHE_STATISTICS_KEY)
+    )
+    pipeline = connection.pipeline(transaction=False)
+    for prefix in prefixes:
+        pipeline.hgetall(CACHE_STATISTICS_KEY + ":" + prefix)
+    result: Dict[str, CachePrefixStatistics] = {}
+    for prefix, raw in zip(prefixes, pipeline.execute()):
+        counters = {field.decode(): value for field, value in raw.items()}
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+        result[prefix] = CachePrefixStatistics(
+            bytes_written=int(counters.get("bytes_written", 0)),
+            decode_time=float(counters.get("decode_time", 0)),
+            hit_ratio=hits / (hits + misses) if hits + misses > 0 else None,
+            hits=hits,
+            key_sizes={
+                int(field[5:]): int(value)
+                for field, value in counters.items()
+                if field.startswith("size:")
+            },
+            misses=misses,
+            sets=int(counters.get("sets", 0)),
+        )
+    return result
+
+
+def flush_cache_statistics() -> None:
+    """
+    Adds the in-memory counters of this process to the cluster-wide
+    statistics in Redis, in a single round trip, and resets them.
+    """
+    global _counters
+    with _counters_lock:
+        counters, _counters = _counters, Counter()
+    if not counters:
+        return
+    try:
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.sadd(
+            CACHE_STATISTICS_KEY, *{prefix for prefix, _ in counters}
+        )
+        for (prefix, field), amount in counters.items():
+            key = CACHE_STATISTICS_KEY + ":" + prefix
+            if isinstance(amount, float):
+                pipeline.hincrbyfloat(key, field, amount)
+            else:
+                pipeline.hincrby(key, field, amount)
+        pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+def _flush_loop() -> None:
+    """
+    Periodically flushes the counters of this process, see
+    :meth:`sni.db.cache_statistics.flush_cache_statistics`.
+    """
+    while True:
+        time.sleep(conf.redis.cache_statistics_interval)
+        flush_cache_statistics()
+
+
+def _record(prefix: str, counters: Dict[str, float]) -> None:
+    """
+    Adds to the in-memory counters of a prefix.
+    """
+    with _counters_lock:
+        for field, amount in counters.items():
+            _counters[(prefix, field)] += amount
+    _start_flush_thread()
+
+
+def record_get(
+    key_prefix: Optional[str], hits: int, misses: int, decode_time: float
+) -> None:
+    """
+    Records cache lookups of keys with the given prefix.
+    """
+    if conf.redis.cache_statistics_interval <= 0:
+        return
+    _record(
+        statistics_prefix(key_prefix),
+        {"decode_time": decode_time, "hits": hits, "misses": misses},
+    )
+
+
+def record_set(key_prefix: Optional[str], size: int) -> None:
+    """
+    Records a cache write of ``size`` bytes, of a key with the given prefix.
+    """
+    if conf.redis.cache_statistics_interval <= 0:
+        return
+    counters = {"bytes_written": size, "sets": 1}
+    if random.random() < conf.redis.cache_statistics_sample_rate:  # nosec
+        counters["size:" + str(1 << max(size - 1, 0).bit_length())] = 1
+    _record(statistics_prefix(key_prefix), counters)
+
+
+def _start_flush_thread() -> None:
+    """
+    Starts the thread flushing the counters of this process, if it is not
+    running already.
+    """
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    with _flush_thread_lock:
+        if _flush_thread is not None:
+            return
+        _flush_thread = Thread(
+            daemon=True, name="cache-statistics", target=_flush_loop
+        )
+        _flush_thread.start()
+
+
+def statistics_prefix(key_prefix: Optional[str]) -> str:
+    """
+    Returns the statistics prefix of a cache key prefix, i.e. its first
+    ``:``-separated segment.
+    """
+    if not key_prefix:
+        return NO_PREFIX
+    return key_prefix.split(":", 1)[0]
@@ -0,0 +1,107 @@
+"""
+Cache serialization format.
+
+Every value stored by :mod:`sni.db.cache` starts with a version byte, which
+designates the :class:`sni.db.codec.Codec` that encoded it. New codecs can be
+added to :data:`sni.db.codec.CODECS` without invalidating the existing
+entries. Values written before the version byte was introduced are plain
+pickles, which start with byte ``0x80``, and are still read. Values with an
+unknown version byte cannot be decoded, and are treated as cache misses.
+
+The binary encoding is pickle: the large cached values are ESI responses,
+i.e. lists of dicts sharing the same keys, which pickle stores once per
+value thanks to its memo, whereas MessagePack repeats them in every dict.
+See ``bench/cache_codec.py``, which compares both.
+"""
+
+from typing import Any, Dict
+import pickle  # nosec
+import zlib
+
+from sni.conf import CONFIGURATION as conf
+
+LEGACY_PICKLE_MARKER = 0x80
+"""First byte of values written as plain pickles (protocol 2 and above)"""
+
+
+class Codec:
+    """
+    Base class for cache codecs
+    """
+
+    version: int
+    """Version byte of this codec, must be unique and not
+    :data:`sni.db.codec.LEGACY_PICKLE_MARKER`"""
+
+    def decode(self, payload: bytes) -> Any:
+        """
+        Decodes a payload (i.e. a value without its version byte)
+        """
+        raise NotImplementedError
+
+    def encode(self, value: Any) -> bytes:
+        """
+        Encodes a value, without the version byte
+        """
+        raise NotImplementedError
+
+
+class PickleZlibCodec(Codec):
+    """
+    Values are pickled using the highest protocol available, and compressed
+    with zlib if they are larger than ``redis.cache_compression_threshold``
+    bytes. The payload starts with a flag byte indicating wether it is
+    compressed.
+    """
+
+    COMPRESSED = b"\x01"
+    UNCOMPRESSED = b"\x00"
+
+    version = 1
+
+    def decode(self, payload: bytes) -> Any:
+        data = payload[1:]
+        if payload[:1] == self.COMPRESSED:
+            data = zlib.decompress(data)
+        return pickle.loads(data)  # nosec
+
+    def encode(self, value: Any) -> bytes:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > conf.redis.cache_compression_threshold:
+            return self.COMPRESSED + zlib.compress(
+                data, conf.redis.cache_compression_level
+            )
+        return self.UNCOMPRESSED + data
+
+
+CODECS: Dict[int, Codec] = {
+    codec.version: codec for codec in [PickleZlibCodec()]
+}
+"""Known codecs, by version byte"""
+
+DEFAULT_CODEC: Codec = CODECS[PickleZlibCodec.version]
+"""Codec used to encode new values"""
+
+
+def decode(data: bytes) -> Any:
+    """
+    Decodes a value read from the cache. Raises a :class:`ValueError` if its
+    version byte is unknown.
+    """
+    if not data:
+        raise ValueError("Empty cache value")
+    version = data[0]
+    if version == LEGACY_PICKLE_MARKER:
+        return pickle.loads(data)  # nosec
+    codec = CODECS.get(version)
+    if codec is None:
+        raise ValueError(f"Unknown cache codec version {version}")
+    return codec.decode(data[1:])
+
+
+def encode(value: Any) -> bytes:
+    """
+    Encodes a value to be written to the cache, using
+    :data:`sni.db.codec.DEFAULT_CODEC`.
+    """
+    return bytes([DEFAULT_CODEC.version]) + DEFAULT_CODEC.encode(value)
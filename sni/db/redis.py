@@ -3,6 +3,7 @@ Redis related module
 """
 
 from redis import ConnectionPool, Redis
+from redis.asyncio import Redis as AsyncRedis
 
 from sni.conf import CONFIGURATION as conf
 
@@ -16,3 +17,13 @@ def new_redis_connection() -> Redis:
     Returns a new redis connection handler
     """
     return Redis(connection_pool=connection_pool)
+
+
+def new_async_redis_connection() -> AsyncRedis:
+    """
+    Returns a new asyncio redis connection handler. It holds its own
+    connection pool, which is bound to the event loop it is first used in.
+    """
+    return AsyncRedis(
+        db=conf.redis.database, host=conf.redis.host, port=conf.redis.port,
+    )
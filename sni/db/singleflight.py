@@ -0,0 +1,154 @@
+"""
+Single-flight call deduplication.
+
+When several callers need the same value at the same time (e.g. many
+scheduler threads requesting the same ESI path), only one of them, the
+leader, actually computes it. Within a process, the other callers wait for
+the leader and share its result. Across processes, the leader holds a short
+Redis lock, and leaders of other processes wait for it to be released before
+proceeding. Since the computed value is typically written to the cache
+(:mod:`sni.db.cache`), the computation function is expected to look it up
+first, so that these leaders find it there.
+
+If Redis is unavailable, or if the lock is held for longer than
+``redis.single_flight_timeout`` seconds, callers proceed without it.
+"""
+
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+import asyncio
+import logging
+
+from redis.exceptions import RedisError
+
+from sni.conf import CONFIGURATION as conf
+
+from .cache import async_connection, connection, hash_key
+
+T = TypeVar("T")
+
+_async_flights: Dict[str, "asyncio.Task[Any]"] = {}
+_flights: Dict[str, "Future[Any]"] = {}
+_flights_lock = Lock()
+
+
+async def _async_locked_call(
+    hashed_key: str, function: Callable[[], Awaitable[T]]
+) -> T:
+    """
+    Asyncio version of :meth:`sni.db.singleflight._locked_call`.
+    """
+    lock = async_connection.lock(
+        "lock:" + hashed_key,
+        blocking_timeout=conf.redis.single_flight_timeout,
+        timeout=conf.redis.single_flight_timeout,
+    )
+    try:
+        acquired = await lock.acquire()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+        return await function()
+    if not acquired:
+        logging.debug("Timed out waiting for single-flight %s", hashed_key)
+    try:
+        return await function()
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except RedisError as error:
+                logging.error("Redis error: %s", str(error))
+
+
+async def async_single_flight(
+    key: Tuple[Optional[str], Any], function: Callable[[], Awaitable[T]]
+) -> T:
+    """
+    Asyncio version of :meth:`sni.db.singleflight.single_flight`. In-process
+    deduplication is done among the coroutines of the current event loop.
+    The call runs in a task of its own, which callers await through
+    :meth:`asyncio.shield`, so that cancelling a caller (e.g. because its
+    client disconnected) never cancels the call the other callers wait for.
+    """
+    hashed_key = hash_key(key)
+    flight = _async_flights.get(hashed_key)
+    if flight is None:
+        flight = asyncio.get_event_loop().create_task(
+            _async_locked_call(hashed_key, function)
+        )
+        _async_flights[hashed_key] = flight
+        flight.add_done_callback(
+            lambda task: _async_flight_done(hashed_key, task)
+        )
+    return await asyncio.shield(flight)
+
+
+def _async_flight_done(hashed_key: str, task: "asyncio.Task[Any]") -> None:
+    """
+    Forgets a finished in-process flight, and marks its exception, if any,
+    as retrieved, since all its callers may have been cancelled.
+    """
+    if _async_flights.get(hashed_key) is task:
+        del _async_flights[hashed_key]
+    if not task.cancelled():
+        task.exception()
+
+
+def _locked_call(hashed_key: str, function: Callable[[], T]) -> T:
+    """
+    Calls the function while holding the Redis lock associated to the
+    (hashed) key.
+    """
+    lock = connection.lock(
+        "lock:" + hashed_key,
+        blocking_timeout=conf.redis.single_flight_timeout,
+        timeout=conf.redis.single_flight_timeout,
+    )
+    try:
+        acquired = lock.acquire()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+        return function()
+    if not acquired:
+        logging.debug("Timed out waiting for single-flight %s", hashed_key)
+    try:
+        return function()
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except RedisError as error:
+                logging.error("Redis error: %s", str(error))
+
+
+def single_flight(
+    key: Tuple[Optional[str], Any], function: Callable[[], T]
+) -> T:
+    """
+    Calls the function, unless a call with the same key is already in flight
+    in this process, in which case its result (or exception) is returned
+    instead. The key is a cache key, see :meth:`sni.db.cache.hash_key`.
+
+    Note that concurrent callers receive the same result object, which
+    should therefore not be mutated.
+    """
+    hashed_key = hash_key(key)
+    with _flights_lock:
+        flight = _flights.get(hashed_key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _flights[hashed_key] = Future()
+    if not is_leader:
+        return flight.result()
+    try:
+        result = _locked_call(hashed_key, function)
+    except BaseException as error:
+        flight.set_exception(error)
+        raise
+    else:
+        flight.set_result(result)
+        return result
+    finally:
+        with _flights_lock:
+            del _flights[hashed_key]
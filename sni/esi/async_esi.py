@@ -0,0 +1,542 @@
+"""
+Asyncio counterpart of :mod:`sni.esi.esi`, to be used in coroutines (e.g. in
+FastAPI path operations) so that ESI calls do not block the event loop.
+
+Responses are cached under the same keys and with the same TTLs as in
+:meth:`sni.esi.esi.esi_request`, so both layers share a single cache.
+"""
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+import aiohttp
+
+from sni.conf import CONFIGURATION as conf
+from sni.db.cache import (
+    async_cache_expire,
+    async_cache_get_many,
+    async_cache_get_many_with_ttl,
+    async_cache_set,
+    async_cache_set_many,
+    async_invalidate_cache,
+    hash_key,
+)
+from sni.db.singleflight import async_single_flight
+from sni.sde.sde import sde_get_names
+from sni.utils import DAY
+
+from .esi import (
+    ESI_BASE,
+    ESI_NAMES_CHUNK_SIZE,
+    ESI_NAMES_FIELDS,
+    ESI_NAMES_MAX_ERRORS,
+    ESI_NAMES_NEGATIVE_TTL,
+    ESI_PAGINATION_MAX_RESTARTS,
+    esi_cache_items,
+    esi_cache_key,
+    esi_cache_retention,
+    esi_cached_headers,
+    esi_etag,
+    esi_headers,
+    esi_headers_cache_key,
+    esi_is_stale_servable,
+    esi_merge_pages,
+    esi_name_cache_key,
+    esi_names_split,
+    esi_page_count,
+    esi_pages_are_consistent,
+    esi_response_ttl,
+    esi_same_cache_version,
+    esi_stale_response,
+    EsiResponse,
+    executor,
+    ID_ANNOTATORS,
+    id_fields,
+    record_etag_revalidation,
+)
+from .limiter import async_record_error_limit, async_wait_for_error_budget
+
+RETRY_METHODS = frozenset(["GET", "HEAD"])
+"""HTTP methods of the requests that are retried upon a
+:data:`sni.esi.async_esi.RETRY_STATUS_CODES` response, a timeout, or a lost
+connection. Others (e.g. the POST of an EVE SSO authorization code) may not
+be idempotent, and are only retried if the connection could not be
+established, i.e. if the request was not sent."""
+
+RETRY_STATUS_CODES = (502, 503, 504)
+"""HTTP status codes upon which a request is retried"""
+
+_refreshes: Dict[str, "asyncio.Task[None]"] = {}
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def async_esi_cache_get(
+    key: Tuple[str, Any]
+) -> Tuple[Optional[dict], int]:
+    """
+    Asyncio version of :meth:`sni.esi.esi.esi_cache_get`.
+    """
+    (cached, cached_ttl), (headers, _) = await async_cache_get_many_with_ttl(
+        [key, esi_headers_cache_key(key)]
+    )
+    if cached is not None and headers is not None:
+        cached["headers"] = headers
+    return cached, cached_ttl
+
+
+async def async_esi_get(
+    path: str, *, kwargs: Optional[dict] = None, token: Optional[str] = None,
+) -> EsiResponse:
+    """
+    Wrapper for :meth:`sni.esi.async_esi.async_esi_request` for GET requests.
+    """
+    return await async_esi_request("get", path, token=token, kwargs=kwargs)
+
+
+async def async_esi_get_all_pages(
+    path: str,
+    *,
+    kwargs: Optional[dict] = None,
+    token: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+) -> EsiResponse:
+    """
+    Asyncio version of :meth:`sni.esi.esi.esi_get_all_pages`.
+    """
+    if max_concurrency is None:
+        max_concurrency = conf.esi.page_concurrency
+    kwargs = kwargs if kwargs is not None else {}
+    params = kwargs.get("params", {})
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def get_page(page: int) -> EsiResponse:
+        async with semaphore:
+            return await async_esi_get(
+                path,
+                token=token,
+                kwargs={**kwargs, "params": {**params, "page": page}},
+            )
+
+    for _ in range(ESI_PAGINATION_MAX_RESTARTS + 1):
+        pages = [await get_page(1)]
+        max_page = esi_page_count(pages[0])
+        pages += await asyncio.gather(
+            *[get_page(page) for page in range(2, max_page + 1)]
+        )
+        if esi_pages_are_consistent(pages):
+            break
+        logging.debug("ESI cache of %s changed during fetch, restarting", path)
+        for page in range(1, max_page + 1):
+            await async_invalidate_cache(
+                esi_cache_key(path, token, {**params, "page": page})
+            )
+    else:
+        logging.warning(
+            "Pages of %s are inconsistent after %d restarts",
+            path,
+            ESI_PAGINATION_MAX_RESTARTS,
+        )
+    return esi_merge_pages(pages)
+
+
+async def _async_esi_get_uncached(
+    path: str, key: Tuple[Optional[str], Any], kwargs: dict
+) -> dict:
+    """
+    Asyncio version of :meth:`sni.esi.esi._esi_get_uncached`.
+    """
+    cached, cached_ttl = await async_esi_cache_get(key)
+    if cached is not None:
+        if cached_ttl > esi_cache_retention():
+            return cached
+        etag = esi_etag(cached["headers"])
+        if etag is not None:
+            kwargs = {
+                **kwargs,
+                "headers": {**kwargs["headers"], "If-None-Match": etag},
+            }
+
+    await async_wait_for_error_budget()
+    response, body_size = await _async_request(
+        "get", ESI_BASE + path, **kwargs
+    )
+
+    if response.status_code == 304 and cached is not None:
+        ttl = max(esi_response_ttl(response.headers), 0)
+        await asyncio.get_event_loop().run_in_executor(
+            executor, record_etag_revalidation, cached.get("body_size", 0)
+        )
+        if "Expires" in response.headers:
+            cached["headers"]["Expires"] = response.headers["Expires"]
+        ttl += esi_cache_retention()
+        if cached.pop("refresh_failed", False):
+            await async_cache_set_many(esi_cache_items(key, cached, ttl))
+        else:
+            await async_cache_set(
+                esi_headers_cache_key(key), cached["headers"], ttl
+            )
+            await async_cache_expire(key, ttl)
+        return cached
+
+    result = {**response.dict(), "body_size": body_size}
+    result["headers"] = esi_cached_headers(result["headers"])
+    ttl = esi_response_ttl(response.headers)
+    if ttl > 0:
+        await async_cache_set_many(
+            esi_cache_items(key, result, ttl + esi_cache_retention())
+        )
+    return result
+
+
+async def async_esi_get_names(ids: List[int]) -> Dict[int, str]:
+    """
+    Asyncio version of :meth:`sni.esi.esi.esi_get_names`. Chunks are
+    resolved concurrently.
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    error_budget = [ESI_NAMES_MAX_ERRORS]
+    chunks = await asyncio.gather(
+        *[
+            _async_esi_get_names_chunk(
+                unique_ids[i : i + ESI_NAMES_CHUNK_SIZE], error_budget
+            )
+            for i in range(0, len(unique_ids), ESI_NAMES_CHUNK_SIZE)
+        ]
+    )
+    if error_budget[0] <= 0:
+        logging.warning("Too many unresolvable IDs, some were not resolved")
+    return {
+        id_field_value: name
+        for chunk in chunks
+        for id_field_value, name in chunk.items()
+    }
+
+
+async def _async_esi_get_names_chunk(
+    ids: List[int], error_budget: List[int]
+) -> Dict[int, str]:
+    """
+    Asyncio version of :meth:`sni.esi.esi._esi_get_names_chunk`. The parts
+    of a rejected chunk are retried concurrently.
+    """
+    if not ids:
+        return {}
+    if error_budget[0] <= 0:
+        return {}
+    try:
+        response = await async_esi_request(
+            "post", "latest/universe/names/", kwargs={"json": ids}
+        )
+    except aiohttp.ClientResponseError as error:
+        if error.status != 404:
+            raise
+        error_budget[0] -= 1
+        if len(ids) == 1:
+            logging.debug("Could not resolve the name of ID %d", ids[0])
+            await async_cache_set(
+                esi_name_cache_key(ids[0]), "", ESI_NAMES_NEGATIVE_TTL
+            )
+            return {}
+        parts = await asyncio.gather(
+            *[
+                _async_esi_get_names_chunk(part, error_budget)
+                for part in esi_names_split(ids)
+            ]
+        )
+        return {
+            id_field_value: name
+            for part in parts
+            for id_field_value, name in part.items()
+        }
+    result = {item["id"]: item["name"] for item in response.data}
+    await async_cache_set_many(
+        (esi_name_cache_key(id_field_value), name, DAY)
+        for id_field_value, name in result.items()
+    )
+    return result
+
+
+async def async_esi_iter_pages(
+    path: str, *, kwargs: Optional[dict] = None, token: Optional[str] = None,
+) -> AsyncIterator[EsiResponse]:
+    """
+    Iterates over the pages of an ESI GET path, in page order. While a page is
+    being consumed, the next one is fetched, so that at most two pages are
+    held in memory at any time. Pages are fetched (and cached) individually,
+    like in :meth:`sni.esi.async_esi.async_esi_get_all_pages`.
+
+    Since pages are consumed as they arrive, the iteration cannot restart if
+    the ESI cache changes in the middle of it. Instead, a warning is logged.
+    """
+    kwargs = kwargs if kwargs is not None else {}
+    params = kwargs.get("params", {})
+
+    def get_page(page: int) -> "asyncio.Future[EsiResponse]":
+        return asyncio.ensure_future(
+            async_esi_get(
+                path,
+                token=token,
+                kwargs={**kwargs, "params": {**params, "page": page}},
+            )
+        )
+
+    first_page = await get_page(1)
+    max_page = esi_page_count(first_page)
+    first_page_headers = first_page.headers
+    next_page = get_page(2) if max_page > 1 else None
+    try:
+        yield first_page
+        del first_page
+        for page in range(2, max_page + 1):
+            current_page = await next_page
+            next_page = get_page(page + 1) if page < max_page else None
+            if not esi_same_cache_version(
+                first_page_headers, current_page.headers
+            ):
+                logging.warning(
+                    "ESI cache of %s changed while streaming page %d",
+                    path,
+                    page,
+                )
+            yield current_page
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+
+async def _async_esi_refresh(
+    path: str, key: Tuple[Optional[str], Any], kwargs: dict
+) -> None:
+    """
+    Asyncio version of :meth:`sni.esi.esi._esi_refresh`.
+    """
+    try:
+        await async_single_flight(
+            key, lambda: _async_esi_get_uncached(path, key, kwargs)
+        )
+    except Exception as error:
+        logging.warning("Could not refresh ESI response %s: %s", path, error)
+        cached, cached_ttl = await async_esi_cache_get(key)
+        if cached is not None and cached_ttl > 0:
+            if not cached.get("refresh_failed", False):
+                cached["refresh_failed"] = True
+                await async_cache_set(key, cached, cached_ttl)
+    finally:
+        del _refreshes[hash_key(key)]
+
+
+async def async_esi_request(
+    http_method: str,
+    path: str,
+    *,
+    kwargs: Optional[dict] = None,
+    token: Optional[str] = None,
+) -> EsiResponse:
+    """
+    Asyncio version of :meth:`sni.esi.esi.esi_request`. Raises a
+    :class:`aiohttp.ClientResponseError` if the ESI responds with an error.
+    """
+    kwargs = dict(kwargs) if kwargs is not None else {}
+    kwargs["headers"] = esi_headers(kwargs.get("headers", {}), token)
+    params = kwargs.get("params", {})
+    kwargs["params"] = {
+        key: value if isinstance(value, (int, float, str)) else str(value)
+        for key, value in params.items()
+    }
+
+    if http_method.upper() != "GET":
+        await async_wait_for_error_budget()
+        return await async_request(http_method, ESI_BASE + path, **kwargs)
+
+    key = esi_cache_key(path, token, params)
+    cached, cached_ttl = await async_esi_cache_get(key)
+    if cached is not None:
+        if cached_ttl > esi_cache_retention():
+            return EsiResponse(**cached)
+        if esi_is_stale_servable(cached_ttl):
+            _async_refresh_in_background(path, key, kwargs)
+            return esi_stale_response(cached)
+    return EsiResponse(
+        **await async_single_flight(
+            key, lambda: _async_esi_get_uncached(path, key, kwargs)
+        )
+    )
+
+
+async def async_id_annotations(data: Any) -> Dict[int, str]:
+    """
+    Asyncio version of :meth:`sni.esi.esi.id_annotations`.
+    """
+    return await async_ids_to_names(id_fields(data))
+
+
+async def async_id_to_name(id_field_value: int, id_field_name: str) -> str:
+    """
+    Asyncio version of :meth:`sni.esi.esi.id_to_name`.
+    """
+    names = await async_ids_to_names({id_field_value: id_field_name})
+    return names.get(id_field_value, "")
+
+
+async def _async_id_to_name_from_endpoint(
+    id_field_value: int, id_field_name: str
+) -> str:
+    """
+    Asyncio version of :meth:`sni.esi.esi._id_to_name_from_endpoint`.
+    """
+    annotator = ID_ANNOTATORS[id_field_name]
+    raw = await async_esi_get(annotator[0].format(id_field_value))
+    result = raw.data.get(annotator[1])
+    return str(result) if result is not None else ""
+
+
+async def async_ids_to_names(ids: Dict[int, str]) -> Dict[int, str]:
+    """
+    Asyncio version of :meth:`sni.esi.esi.ids_to_names`. SDE lookups are
+    delegated to the :data:`sni.esi.esi.executor` thread pool.
+    """
+    result = await asyncio.get_event_loop().run_in_executor(
+        executor,
+        sde_get_names,
+        {
+            id_field_value: id_field_name
+            for id_field_value, id_field_name in ids.items()
+            if id_field_name not in ID_ANNOTATORS
+        },
+    )
+    esi_ids = {
+        id_field_value: id_field_name
+        for id_field_value, id_field_name in ids.items()
+        if id_field_name in ID_ANNOTATORS
+    }
+    cached_names = await async_cache_get_many(
+        [esi_name_cache_key(id_field_value) for id_field_value in esi_ids]
+    )
+    bulk: List[int] = []
+    endpoint_ids: Dict[int, str] = {}
+    for (id_field_value, id_field_name), name in zip(
+        esi_ids.items(), cached_names
+    ):
+        if name == "":
+            continue  # Unresolvable, see ESI_NAMES_NEGATIVE_TTL
+        if name is not None:
+            result[id_field_value] = name
+        elif id_field_name in ESI_NAMES_FIELDS:
+            bulk.append(id_field_value)
+        else:
+            endpoint_ids[id_field_value] = id_field_name
+    result.update(await async_esi_get_names(bulk))
+    names = await asyncio.gather(
+        *[
+            _async_id_to_name_from_endpoint(id_field_value, id_field_name)
+            for id_field_value, id_field_name in endpoint_ids.items()
+        ]
+    )
+    result.update(
+        {
+            id_field_value: name
+            for id_field_value, name in zip(endpoint_ids.keys(), names)
+            if name
+        }
+    )
+    return result
+
+
+def _async_refresh_in_background(
+    path: str, key: Tuple[Optional[str], Any], kwargs: dict
+) -> None:
+    """
+    Asyncio version of :meth:`sni.esi.esi._refresh_in_background`. The
+    refresh runs as a task of the current event loop.
+    """
+    hashed_key = hash_key(key)
+    if hashed_key not in _refreshes:
+        _refreshes[hashed_key] = asyncio.ensure_future(
+            _async_esi_refresh(path, key, kwargs)
+        )
+
+
+async def async_request(method: str, url: str, **kwargs) -> EsiResponse:
+    """
+    Issues an HTTP request through the shared
+    :class:`aiohttp.ClientSession`. Connection failures, and the timeouts,
+    lost connections, and 502, 503, and 504 responses of GET and HEAD
+    requests, are retried with exponential backoff, like in
+    :mod:`sni.esi.session`. The ESI error budget reported
+    in the response headers, if any, is recorded, see
+    :mod:`sni.esi.limiter`.
+    """
+    response, _ = await _async_request(method, url, **kwargs)
+    return response
+
+
+async def _async_request(
+    method: str, url: str, **kwargs
+) -> Tuple[EsiResponse, int]:
+    """
+    Implementation of :meth:`sni.esi.async_esi.async_request`. Also returns
+    the size of the response body, in bytes.
+    """
+    session = get_async_session()
+    attempt = 0
+    while True:
+        try:
+            async with session.request(method, url, **kwargs) as raw:
+                await async_record_error_limit(raw.headers)
+                if (
+                    raw.status in RETRY_STATUS_CODES
+                    and method.upper() in RETRY_METHODS
+                    and attempt < conf.esi.http_max_retries
+                ):
+                    raise aiohttp.ServerConnectionError(
+                        f"ESI responded with status {raw.status}"
+                    )
+                raw.raise_for_status()
+                body = await raw.read()
+                return (
+                    EsiResponse(
+                        data=await raw.json(content_type=None),
+                        headers=dict(raw.headers),
+                        status_code=raw.status,
+                    ),
+                    len(body),
+                )
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+            if attempt >= conf.esi.http_max_retries or not (
+                method.upper() in RETRY_METHODS
+                or isinstance(error, aiohttp.ClientConnectorError)
+            ):
+                raise
+            delay = conf.esi.http_backoff_factor * (2 ** attempt)
+            logging.debug(
+                "Retrying %s %s in %.1fs: %s", method, url, delay, str(error)
+            )
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+async def close_async_session() -> None:
+    """
+    Closes the shared :class:`aiohttp.ClientSession`, if any.
+    """
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """
+    Returns the shared :class:`aiohttp.ClientSession`, creating it if needed.
+    Must be called from within the event loop that will use the session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=conf.esi.http_connect_timeout,
+                sock_read=conf.esi.http_read_timeout,
+            ),
+        )
+    return _session
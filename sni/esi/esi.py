@@ -3,29 +3,118 @@ EVE ESI (public API) layer
 """
 
 from concurrent.futures import Future, ThreadPoolExecutor
-from typing import Any, Dict, Optional
+from contextvars import copy_context
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
 import logging
 import re
 
 from dateutil import parser
 import mongoengine as me
 import pydantic as pdt
-from requests import request, Response
+from pymongo import UpdateOne
+from redis.exceptions import RedisError
+from requests import HTTPError, Response
+from xxhash import xxh64_hexdigest
 
 from sni.conf import CONFIGURATION as conf
-from sni.db.cache import cache_get, cache_set
+from sni.db.cache import (
+    cache_expire,
+    cache_get_many,
+    cache_get_many_with_ttl,
+    cache_set,
+    cache_set_many,
+    hash_key,
+    invalidate_cache,
+)
+from sni.db.redis import new_redis_connection
+from sni.db.singleflight import single_flight
 from sni.esi.scope import EsiScope
-from sni.sde.sde import sde_get_name
+from sni.sde.sde import sde_get_names
 import sni.utils as utils
 
+from .limiter import record_error_limit, wait_for_error_budget
 from .models import EsiPath, EsiScope
+from .routing import EsiPathTrie
+from .session import request
 
 ESI_BASE = "https://esi.evetech.net/"
 ESI_SWAGGER = ESI_BASE + "latest/swagger.json"
 
 
+ESI_CACHED_HEADERS = frozenset(["etag", "expires", "last-modified", "x-pages"])
+"""Response headers (in lower case) that are kept when an ESI response is
+cached. The others are dropped to save space."""
+
+ESI_PAGINATION_MAX_RESTARTS = 3
+"""How many times :meth:`sni.esi.esi.esi_get_all_pages` restarts when the ESI
+cache changes during a fetch"""
+
+ESI_NAMES_CHUNK_SIZE = 1000
+"""Maximum number of IDs in a ``POST latest/universe/names/`` request"""
+
+ESI_NAMES_FIELDS = frozenset(
+    ["alliance_id", "character_id", "corporation_id", "station_id"]
+)
+"""ID field names of :data:`sni.esi.esi.ID_ANNOTATORS` that are resolved in
+bulk through ``POST latest/universe/names/``. The others are resolved one by
+one through their own endpoint."""
+
+ESI_NAMES_MAX_ERRORS = 32
+"""Maximum number of ``POST latest/universe/names/`` requests rejected
+because of unresolvable IDs, per call to :meth:`sni.esi.esi.esi_get_names`.
+Each rejection draws on the ESI error budget (see :mod:`sni.esi.limiter`),
+so the IDs that are left once this is reached are not resolved."""
+
+ESI_NAMES_MIN_SPLIT_SIZE = 32
+"""Size under which a rejected chunk of IDs is retried ID by ID, instead of
+being split in two"""
+
+ESI_NAMES_NEGATIVE_TTL = 1 * utils.HOUR
+"""TTL (in seconds) of the cache entries of IDs that cannot be resolved
+through ``POST latest/universe/names/``. They are cached as empty names, so
+that they are not sent again."""
+
+ESI_STALE_HEADER = "X-SNI-Stale"
+"""Header added to stale responses served from the cache, see
+:meth:`sni.esi.esi.esi_request`. Its value is ``revalidating``, or ``error``
+if the last attempt to refresh the response failed."""
+
+ESI_SWAGGER_KEY = "esi:swagger"
+"""Redis key of the hash holding the ETag and hash of the last loaded ESI
+swagger specification, see :meth:`sni.esi.esi.load_esi_openapi`"""
+
+ETAG_STATISTICS_KEY = "esi:etag_statistics"
+"""Redis key of the hash holding the ETag revalidation statistics"""
+
+ID_ANNOTATORS: Dict[str, Tuple[str, str]] = {
+    "alliance_id": ("latest/alliances/{}/", "name"),
+    "asteroid_belt_id": ("latest/universe/asteroid_belts/{}/", "name"),
+    "character_id": ("latest/characters/{}/", "name"),
+    "corporation_id": ("latest/corporations/{}/", "name"),
+    "graphic_id": ("latest/universe/graphics/{}/", "graphic_file"),
+    "moon_id": ("latest/universe/moons/{}/", "name"),
+    "planet_id": ("latest/universe/planets/{}/", "name"),
+    "star_id": ("latest/universe/stars/{}/", "name"),
+    "stargate_id": ("latest/universe/stargates/{}/", "name"),
+    "station_id": ("latest/universe/stations/{}/", "name"),
+    "structure_id": ("latest/universe/structures/{}/", "name"),
+}
+"""ID field names that are resolved through the ESI, along with the path and
+the response field holding the name. Other ID fields are resolved through the
+SDE, see :meth:`sni.sde.sde.sde_get_name`."""
+
+connection = new_redis_connection()
+
 executor = ThreadPoolExecutor(max_workers=20)
-"""Executor for :meth:`sni.esi.esi._id_annotations`"""
+"""Executor for :meth:`sni.esi.esi.ids_to_names` and background refreshes of
+stale ESI responses"""
+
+_path_trie: Optional[EsiPathTrie] = None
+_path_trie_lock = Lock()
+
+_refreshes: Set[str] = set()
+_refreshes_lock = Lock()
 
 
 class EsiResponse(pdt.BaseModel):
@@ -51,7 +140,79 @@ class EsiResponse(pdt.BaseModel):
         )
 
 
+class EtagStatistics(pdt.BaseModel):
+    """
+    Cluster-wide statistics of ETag revalidations of cached ESI responses
+    """
+
+    bytes_saved: int
+    revalidations: int
+
+
+def esi_cache_key(
+    path: str, token: Optional[str], params: dict
+) -> Tuple[str, Any]:
+    """
+    Cache key of an ESI GET request. This is shared between
+    :meth:`sni.esi.esi.esi_request` and
+    :meth:`sni.esi.async_esi.async_esi_request`.
+    """
+    return ("esi", [path, token, sorted(params.items())])
+
+
+def esi_cache_get(key: Tuple[str, Any]) -> Tuple[Optional[dict], int]:
+    """
+    Returns a cached ESI response (as a dict) and its remaining TTL, see
+    :meth:`sni.db.cache.cache_get_with_ttl`. Its headers are read from their
+    own entry (see :meth:`sni.esi.esi.esi_headers_cache_key`), in the same
+    round trip.
+    """
+    (cached, cached_ttl), (headers, _) = cache_get_many_with_ttl(
+        [key, esi_headers_cache_key(key)]
+    )
+    if cached is not None and headers is not None:
+        cached["headers"] = headers
+    return cached, cached_ttl
+
+
+def esi_cache_items(
+    key: Tuple[str, Any], response: dict, ttl: int
+) -> List[Tuple[Tuple[str, Any], Any, int]]:
+    """
+    Returns the cache entries of an ESI response, as ``(key, value, ttl)``
+    triples to be written with :meth:`sni.db.cache.cache_set_many`: the
+    response itself, and its headers, see
+    :meth:`sni.esi.esi.esi_headers_cache_key`.
+    """
+    return [
+        (key, response, ttl),
+        (esi_headers_cache_key(key), response["headers"], ttl),
+    ]
+
+
 # pylint: disable=dangerous-default-value
+def esi_cache_retention() -> int:
+    """
+    How long (in seconds) ESI responses are kept in the cache after they
+    expire, either to be revalidated using their ETag (see
+    ``esi.etag_retention``), or to be served while stale (see
+    ``esi.stale_while_revalidate``).
+    """
+    return max(conf.esi.etag_retention, conf.esi.stale_while_revalidate)
+
+
+def esi_cached_headers(headers: dict) -> dict:
+    """
+    Filters the headers of an ESI response that are worth caching, see
+    :data:`sni.esi.esi.ESI_CACHED_HEADERS`.
+    """
+    return {
+        name: value
+        for name, value in headers.items()
+        if name.lower() in ESI_CACHED_HEADERS
+    }
+
+
 def esi_delete(
     path: str, *, kwargs: dict = {}, token: Optional[str] = None,
 ) -> EsiResponse:
@@ -61,6 +222,16 @@ def esi_delete(
     return esi_request("delete", path, token=token, kwargs=kwargs)
 
 
+def esi_etag(headers: dict) -> Optional[str]:
+    """
+    Returns the ``ETag`` header of an ESI response, if any.
+    """
+    for name, value in headers.items():
+        if name.lower() == "etag":
+            return value
+    return None
+
+
 # pylint: disable=dangerous-default-value
 def esi_get(
     path: str, *, kwargs: dict = {}, token: Optional[str] = None,
@@ -73,30 +244,262 @@ def esi_get(
 
 # pylint: disable=dangerous-default-value
 def esi_get_all_pages(
-    path: str, *, token: Optional[str] = None, kwargs: dict = {},
+    path: str,
+    *,
+    token: Optional[str] = None,
+    kwargs: dict = {},
+    max_concurrency: Optional[int] = None,
 ) -> EsiResponse:
     """
-    Returns all pages of an ESI GET path
-    """
-    current_page = 1
-    max_page = 1
-    response_data = []
-    response_headers = {}
-    response_status_code = -1
-    if "params" not in kwargs:
-        kwargs["params"] = {}
-    while current_page <= max_page:
-        kwargs["params"]["page"] = current_page
-        current_response = esi_request("get", path, token=token, kwargs=kwargs)
-        response_data += current_response.data
-        response_headers = current_response.headers
-        response_status_code = current_response.status_code
-        max_page = int(current_response.headers.get("X-Pages", -1))
-        current_page += 1
+    Returns all pages of an ESI GET path. The first page is fetched alone to
+    read the page count from its ``X-Pages`` header, then the other pages are
+    fetched concurrently, at most ``max_concurrency`` at a time (defaults to
+    the ``esi.page_concurrency`` configuration field). The data of all pages
+    is concatenated in page order.
+
+    If a page does not have the same ``X-Pages`` and ``Expires`` headers as
+    the first page, then the ESI cache was refreshed during the fetch. In this
+    case, the cached pages are invalidated and the fetch restarts, at most
+    :const:`sni.esi.esi.ESI_PAGINATION_MAX_RESTARTS` times.
+    """
+    if max_concurrency is None:
+        max_concurrency = conf.esi.page_concurrency
+    params = kwargs.get("params", {})
+    context = copy_context()
+
+    def get_page(page: int) -> EsiResponse:
+        return context.copy().run(
+            esi_request,
+            "get",
+            path,
+            token=token,
+            kwargs={**kwargs, "params": {**params, "page": page}},
+        )
+
+    for _ in range(ESI_PAGINATION_MAX_RESTARTS + 1):
+        pages = [get_page(1)]
+        max_page = esi_page_count(pages[0])
+        if max_page > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(max_concurrency, max_page - 1)
+            ) as page_executor:
+                pages += page_executor.map(get_page, range(2, max_page + 1))
+        if esi_pages_are_consistent(pages):
+            break
+        logging.debug("ESI cache of %s changed during fetch, restarting", path)
+        for page in range(1, max_page + 1):
+            invalidate_cache(
+                esi_cache_key(path, token, {**params, "page": page})
+            )
+    else:
+        logging.warning(
+            "Pages of %s are inconsistent after %d restarts",
+            path,
+            ESI_PAGINATION_MAX_RESTARTS,
+        )
+    return esi_merge_pages(pages)
+
+
+def esi_get_names(ids: List[int]) -> Dict[int, str]:
+    """
+    Resolves character, corporation, alliance, and station IDs (among others)
+    through ``POST latest/universe/names/``, in chunks of
+    :data:`sni.esi.esi.ESI_NAMES_CHUNK_SIZE`. Resolved names are cached for a
+    day, and unresolvable IDs for
+    :data:`sni.esi.esi.ESI_NAMES_NEGATIVE_TTL` seconds. Returns a dict
+    mapping IDs to names. IDs that cannot be resolved are omitted.
+    """
+    result: Dict[int, str] = {}
+    unique_ids = list(dict.fromkeys(ids))
+    error_budget = [ESI_NAMES_MAX_ERRORS]
+    for i in range(0, len(unique_ids), ESI_NAMES_CHUNK_SIZE):
+        result.update(
+            _esi_get_names_chunk(
+                unique_ids[i : i + ESI_NAMES_CHUNK_SIZE], error_budget
+            )
+        )
+    if error_budget[0] <= 0:
+        logging.warning("Too many unresolvable IDs, some were not resolved")
+    return result
+
+
+def _esi_get_names_chunk(
+    ids: List[int], error_budget: List[int]
+) -> Dict[int, str]:
+    """
+    Resolves a chunk of IDs for :meth:`sni.esi.esi.esi_get_names`. The ESI
+    rejects the whole request if a single ID is invalid, in which case the
+    chunk is split (see :meth:`sni.esi.esi.esi_names_split`), and the parts
+    are retried. ``error_budget`` is a single element list holding the number
+    of rejections still allowed, see
+    :data:`sni.esi.esi.ESI_NAMES_MAX_ERRORS`.
+    """
+    if not ids:
+        return {}
+    if error_budget[0] <= 0:
+        return {}
+    try:
+        response = esi_post("latest/universe/names/", kwargs={"json": ids})
+    except HTTPError as error:
+        if error.response is None or error.response.status_code != 404:
+            raise
+        error_budget[0] -= 1
+        if len(ids) == 1:
+            logging.debug("Could not resolve the name of ID %d", ids[0])
+            cache_set(esi_name_cache_key(ids[0]), "", ESI_NAMES_NEGATIVE_TTL)
+            return {}
+        result: Dict[int, str] = {}
+        for part in esi_names_split(ids):
+            result.update(_esi_get_names_chunk(part, error_budget))
+        return result
+    result = {item["id"]: item["name"] for item in response.data}
+    cache_set_many(
+        (esi_name_cache_key(id_field_value), name, utils.DAY)
+        for id_field_value, name in result.items()
+    )
+    return result
+
+
+def _esi_get_uncached(
+    path: str, key: Tuple[Optional[str], Any], kwargs: dict
+) -> dict:
+    """
+    Makes a GET request to the ESI, unless a fresh response is in the cache,
+    and returns the response as a dict. Expired cached responses are
+    revalidated using their ETag: on a ``304 Not Modified``, only the TTL of
+    the cached body is refreshed, and its headers are rewritten. Called by
+    :meth:`sni.esi.esi.esi_request` through
+    :meth:`sni.db.singleflight.single_flight`, so that concurrent identical
+    requests are only made once.
+    """
+    cached, cached_ttl = esi_cache_get(key)
+    if cached is not None:
+        if cached_ttl > esi_cache_retention():
+            return cached
+        etag = esi_etag(cached["headers"])
+        if etag is not None:
+            kwargs = {
+                **kwargs,
+                "headers": {**kwargs["headers"], "If-None-Match": etag},
+            }
+
+    wait_for_error_budget()
+    raw = request("get", ESI_BASE + path, **kwargs)
+    record_error_limit(raw.headers)
+    raw.raise_for_status()
+
+    if raw.status_code == 304 and cached is not None:
+        ttl = max(esi_response_ttl(raw.headers), 0)
+        record_etag_revalidation(cached.get("body_size", 0))
+        if "Expires" in raw.headers:
+            cached["headers"]["Expires"] = raw.headers["Expires"]
+        ttl += esi_cache_retention()
+        if cached.pop("refresh_failed", False):
+            cache_set_many(esi_cache_items(key, cached, ttl))
+        else:
+            cache_set(esi_headers_cache_key(key), cached["headers"], ttl)
+            cache_expire(key, ttl)
+        return cached
+
+    response = {
+        **EsiResponse.from_response(raw).dict(),
+        "body_size": len(raw.content),
+    }
+    response["headers"] = esi_cached_headers(response["headers"])
+    ttl = esi_response_ttl(response["headers"])
+    if ttl > 0:
+        cache_set_many(
+            esi_cache_items(key, response, ttl + esi_cache_retention())
+        )
+    return response
+
+
+def esi_headers(headers: dict, token: Optional[str] = None) -> dict:
+    """
+    Completes a set of HTTP headers with the ones required by the ESI.
+    """
+    result = {
+        "Accept-Encoding": "gzip",
+        "accept": "application/json",
+        "User-Agent": "SeAT Navy Issue @ " + conf.general.root_url,
+        **headers,
+    }
+    if token:
+        result["Authorization"] = "Bearer " + token
+    return result
+
+
+def esi_headers_cache_key(key: Tuple[str, Any]) -> Tuple[str, Any]:
+    """
+    Cache key of the headers of a cached ESI response. They are also stored
+    apart from the response, so that revalidating it (i.e. a ``304 Not
+    Modified``) updates its ``Expires`` header without transferring its
+    body, see :meth:`sni.esi.esi._esi_get_uncached`.
+    """
+    return ("esi:headers", key[1])
+
+
+def esi_is_stale_servable(cached_ttl: int) -> bool:
+    """
+    Tells wether an expired cached ESI response, whose cache entry has the
+    given remaining TTL, is still within the ``esi.stale_while_revalidate``
+    grace period.
+    """
+    return (
+        conf.esi.stale_while_revalidate > 0
+        and cached_ttl
+        > esi_cache_retention() - conf.esi.stale_while_revalidate
+    )
+
+
+def esi_merge_pages(pages: List[EsiResponse]) -> EsiResponse:
+    """
+    Concatenates the data of ESI response pages. The headers and status code
+    are those of the first page.
+    """
     return EsiResponse(
-        data=response_data,
-        headers=response_headers,
-        status_code=response_status_code,
+        data=[item for page in pages for item in page.data],
+        headers=pages[0].headers,
+        status_code=pages[0].status_code,
+    )
+
+
+def esi_name_cache_key(id_field_value: int) -> Tuple[str, None]:
+    """
+    Cache key of the name of an ID resolved through the ESI, see
+    :meth:`sni.esi.esi.ids_to_names`.
+    """
+    return ("name:" + str(id_field_value), None)
+
+
+def esi_names_split(ids: List[int]) -> List[List[int]]:
+    """
+    Splits a chunk of IDs rejected by ``POST latest/universe/names/``: in
+    two halves, or ID by ID if the chunk is smaller than
+    :data:`sni.esi.esi.ESI_NAMES_MIN_SPLIT_SIZE`.
+    """
+    if len(ids) <= ESI_NAMES_MIN_SPLIT_SIZE:
+        return [[id_field_value] for id_field_value in ids]
+    middle = len(ids) // 2
+    return [ids[:middle], ids[middle:]]
+
+
+def esi_page_count(response: EsiResponse) -> int:
+    """
+    Returns the page count of a paginated ESI response, as indicated in its
+    ``X-Pages`` header, or 1 if the header is absent.
+    """
+    return int(response.headers.get("X-Pages", 1))
+
+
+def esi_pages_are_consistent(pages: List[EsiResponse]) -> bool:
+    """
+    Tells wether all pages come from the same version of the ESI cache, see
+    :meth:`sni.esi.esi.esi_same_cache_version`.
+    """
+    return all(
+        esi_same_cache_version(pages[0].headers, page.headers)
+        for page in pages[1:]
     )
 
 
@@ -121,6 +524,30 @@ def esi_put(
 
 
 # pylint: disable=dangerous-default-value
+def _esi_refresh(
+    path: str, key: Tuple[Optional[str], Any], kwargs: dict
+) -> None:
+    """
+    Refreshes a stale cached ESI response. Runs in the
+    :data:`sni.esi.esi.executor` thread pool, see
+    :meth:`sni.esi.esi._refresh_in_background`. If the refresh fails, the
+    cached response is flagged so that it is served with an
+    :data:`sni.esi.esi.ESI_STALE_HEADER` header of ``error``.
+    """
+    try:
+        single_flight(key, lambda: _esi_get_uncached(path, key, kwargs))
+    except Exception as error:
+        logging.warning("Could not refresh ESI response %s: %s", path, error)
+        cached, cached_ttl = esi_cache_get(key)
+        if cached is not None and cached_ttl > 0:
+            if not cached.get("refresh_failed", False):
+                cached["refresh_failed"] = True
+                cache_set(key, cached, cached_ttl)
+    finally:
+        with _refreshes_lock:
+            _refreshes.discard(hash_key(key))
+
+
 def esi_request(
     http_method: str,
     path: str,
@@ -130,44 +557,86 @@ def esi_request(
 ) -> EsiResponse:
     """
     Makes an HTTP request to the ESI, and returns the response object.
+
+    GET responses are cached. If ``esi.stale_while_revalidate`` is set, an
+    expired response is still returned during that grace period, with an
+    :data:`sni.esi.esi.ESI_STALE_HEADER` header, while it is refreshed in the
+    background.
     """
-    kwargs["headers"] = {
-        "Accept-Encoding": "gzip",
-        "accept": "application/json",
-        "User-Agent": "SeAT Navy Issue @ " + conf.general.root_url,
-        **kwargs.get("headers", {}),
-    }
-    if token:
-        kwargs["headers"]["Authorization"] = "Bearer " + token
+    kwargs["headers"] = esi_headers(kwargs.get("headers", {}), token)
 
     if http_method.upper() != "GET":
+        wait_for_error_budget()
         raw = request(http_method, ESI_BASE + path, **kwargs)
+        record_error_limit(raw.headers)
         raw.raise_for_status()
         return EsiResponse.from_response(raw)
 
-    key = ("esi", [path, token, sorted(kwargs.get("params", {}).items())])
-    response = cache_get(key)
-    if response is not None:
-        return EsiResponse(**response)
+    key = esi_cache_key(path, token, kwargs.get("params", {}))
+    cached, cached_ttl = esi_cache_get(key)
+    if cached is not None:
+        if cached_ttl > esi_cache_retention():
+            return EsiResponse(**cached)
+        if esi_is_stale_servable(cached_ttl):
+            _refresh_in_background(path, key, kwargs)
+            return esi_stale_response(cached)
+    return EsiResponse(
+        **single_flight(key, lambda: _esi_get_uncached(path, key, kwargs))
+    )
 
-    raw = request(http_method, ESI_BASE + path, **kwargs)
-    raw.raise_for_status()
-    response = EsiResponse.from_response(raw)
 
+def esi_response_ttl(headers: dict) -> int:
+    """
+    Returns for how many seconds an ESI response can be cached, based on its
+    ``Expires`` header. Defaults to 60 seconds if the header is absent.
+    """
     ttl = 60
-    if "Expires" in response.headers:
+    if "Expires" in headers:
         try:
             ttl = int(
                 (
-                    parser.parse(response.headers["Expires"]) - utils.now()
+                    parser.parse(headers["Expires"]) - utils.now()
                 ).total_seconds()
             )
         except ValueError as error:
             logging.warning("Could not determine ESI TTL: %s", str(error))
-    if ttl > 0:
-        cache_set(key, response.dict(), ttl)
+    return ttl
+
+
+def esi_same_cache_version(headers1: dict, headers2: dict) -> bool:
+    """
+    Tells wether two pages of the same ESI path have the same ``X-Pages`` and
+    ``Expires`` headers, i.e. wether they come from the same version of the
+    ESI cache.
+    """
+    return (
+        headers1.get("X-Pages") == headers2.get("X-Pages")
+        and headers1.get("Expires") == headers2.get("Expires")
+    )
 
-    return response
+
+def esi_stale_response(cached: dict) -> EsiResponse:
+    """
+    Converts a stale cached ESI response to a
+    :class:`sni.esi.esi.EsiResponse`, with an
+    :data:`sni.esi.esi.ESI_STALE_HEADER` header.
+    """
+    marker = "error" if cached.get("refresh_failed", False) else "revalidating"
+    headers = {**cached["headers"], ESI_STALE_HEADER: marker}
+    return EsiResponse(**{**cached, "headers": headers})
+
+
+def etag_statistics() -> EtagStatistics:
+    """
+    Returns how many cached ESI responses were revalidated with their ETag
+    (i.e. the ESI responded ``304 Not Modified``), and how many response body
+    bytes were thus not downloaded.
+    """
+    statistics = connection.hgetall(ETAG_STATISTICS_KEY)
+    return EtagStatistics(
+        bytes_saved=int(statistics.get(b"bytes_saved", 0)),
+        revalidations=int(statistics.get(b"revalidations", 0)),
+    )
 
 
 def get_esi_path_scope(path: str) -> EsiScope:
@@ -184,11 +653,27 @@ def get_esi_path_scope(path: str) -> EsiScope:
         >>> get_esi_path_scope('latest/alliances')
         EsiScope.PUBLICDATA
     """
-    esi_path: EsiPath
-    for esi_path in EsiPath.objects:
-        if re.search(esi_path.path_re, path):
-            return EsiScope(esi_path.scope)
-    raise me.DoesNotExist
+    try:
+        node = get_esi_path_trie().lookup(path)
+    except KeyError:
+        raise me.DoesNotExist from None
+    return EsiScope(node.scope)
+
+
+def get_esi_path_trie() -> EsiPathTrie:
+    """
+    Returns the in-memory index of the ESI paths in the database, building it
+    if needed. It is rebuilt after :meth:`sni.esi.esi.load_esi_openapi`.
+    """
+    global _path_trie
+    if _path_trie is None:
+        with _path_trie_lock:
+            if _path_trie is None:
+                _path_trie = EsiPathTrie.from_paths(
+                    (esi_path.path, esi_path.scope)
+                    for esi_path in EsiPath.objects.only("path", "scope")
+                )
+    return _path_trie
 
 
 def id_annotations(data: Any) -> Dict[int, str]:
@@ -196,76 +681,145 @@ def id_annotations(data: Any) -> Dict[int, str]:
     Annotates a JSON document. In documents returned by the ESI, ID fields
     always have the same name (e.g. `solar_system_id`, `character_id`, etc.).
     This method recursively searches for these ID fields and returns a dict
-    mapping these IDs to a name.
+    mapping these IDs to a name, see :meth:`sni.esi.esi.ids_to_names`.
     """
-    result_future: Dict[int, Future] = _id_annotations(data)
-    return {
-        key: future.result()
-        for key, future in result_future.items()
-        if future.result()
-    }
+    return ids_to_names(id_fields(data))
 
 
-def _id_annotations(data: Any) -> Dict[int, Future]:
+def id_fields(data: Any) -> Dict[int, str]:
     """
-    Actual recursive concurrent implementation of
-    :meth:`sni.esi.esi.id_annotations`. Basically, calls to
-    :meth`sni.esi.esi.id_to_name` are sumitted to an thread pool executor for
-    better performances.
+    Recursively searches a JSON document for ID fields, and returns a dict
+    mapping every ID found to the name of (one of) the field(s) it was found
+    in.
     """
-    annotations: Dict[int, Future] = {}
+    result: Dict[int, str] = {}
     if isinstance(data, dict):
         for key, val in data.items():
             if key.endswith("_id") and isinstance(val, int):
-                annotations[val] = executor.submit(id_to_name, val, key)
+                result[val] = key
             else:
-                annotations.update(_id_annotations(val))
+                result.update(id_fields(val))
     elif isinstance(data, list):
         for element in data:
-            annotations.update(_id_annotations(element))
-    return annotations
+            result.update(id_fields(element))
+    return result
 
 
 def id_to_name(id_field_value: int, id_field_name: str) -> str:
     """
     Converts an object ID (e.g. station, solar system, SDE type) to a name.
+    Returns an empty string if the ID cannot be resolved.
     """
-    annotators = {
-        "alliance_id": ("latest/alliances/{}/", "name"),
-        "asteroid_belt_id": ("latest/universe/asteroid_belts/{}/", "name"),
-        "character_id": ("latest/characters/{}/", "name"),
-        "corporation_id": ("latest/corporations/{}/", "name"),
-        "graphic_id": ("latest/universe/graphics/{}/", "graphic_file"),
-        "moon_id": ("latest/universe/moons/{}/", "name"),
-        "planet_id": ("latest/universe/planets/{}/", "name"),
-        "star_id": ("latest/universe/stars/{}/", "name"),
-        "stargate_id": ("latest/universe/stargates/{}/", "name"),
-        "station_id": ("latest/universe/stations/{}/", "name"),
-        "structure_id": ("latest/universe/structures/{}/", "name"),
-    }
-    if id_field_name in annotators:
-        annotator = annotators[id_field_name]
-        raw = esi_get(annotator[0].format(id_field_value))
-        result = raw.data.get(annotator[1])
-    else:
-        result = sde_get_name(id_field_value, id_field_name)
+    return ids_to_names({id_field_value: id_field_name}).get(
+        id_field_value, ""
+    )
+
+
+def _id_to_name_from_endpoint(id_field_value: int, id_field_name: str) -> str:
+    """
+    Resolves an ID through the ESI endpoint of its type, see
+    :data:`sni.esi.esi.ID_ANNOTATORS`.
+    """
+    annotator = ID_ANNOTATORS[id_field_name]
+    raw = esi_get(annotator[0].format(id_field_value))
+    result = raw.data.get(annotator[1])
     return str(result) if result is not None else ""
 
 
-def load_esi_openapi() -> None:
+def ids_to_names(ids: Dict[int, str]) -> Dict[int, str]:
+    """
+    Bulk version of :meth:`sni.esi.esi.id_to_name`. Takes a dict mapping IDs
+    to the name of their field, and returns a dict mapping IDs to names. IDs
+    that cannot be resolved are omitted.
+
+    IDs are resolved as follows:
+
+    * IDs whose field is not in :data:`sni.esi.esi.ID_ANNOTATORS` are looked
+      up in the SDE, see :meth:`sni.sde.sde.sde_get_names`;
+    * other IDs are looked up in the cache, in a single round trip;
+    * IDs whose field is in :data:`sni.esi.esi.ESI_NAMES_FIELDS` are
+      resolved by :meth:`sni.esi.esi.esi_get_names`;
+    * the rest (e.g. structures, planets) is resolved through their own
+      endpoint, concurrently.
+    """
+    result = sde_get_names(
+        {
+            id_field_value: id_field_name
+            for id_field_value, id_field_name in ids.items()
+            if id_field_name not in ID_ANNOTATORS
+        }
+    )
+    esi_ids = {
+        id_field_value: id_field_name
+        for id_field_value, id_field_name in ids.items()
+        if id_field_name in ID_ANNOTATORS
+    }
+    cached_names = cache_get_many(
+        [esi_name_cache_key(id_field_value) for id_field_value in esi_ids]
+    )
+    bulk: List[int] = []
+    futures: Dict[int, Future] = {}
+    for (id_field_value, id_field_name), name in zip(
+        esi_ids.items(), cached_names
+    ):
+        if name == "":
+            continue  # Unresolvable, see ESI_NAMES_NEGATIVE_TTL
+        if name is not None:
+            result[id_field_value] = name
+        elif id_field_name in ESI_NAMES_FIELDS:
+            bulk.append(id_field_value)
+        else:
+            futures[id_field_value] = executor.submit(
+                _id_to_name_from_endpoint, id_field_value, id_field_name
+            )
+    result.update(esi_get_names(bulk))
+    for id_field_value, future in futures.items():
+        name = future.result()
+        if name:
+            result[id_field_value] = name
+    return result
+
+
+def load_esi_openapi(force: bool = False) -> None:
     """
     Loads the ESI Swagger API into the database.
 
-    Should be called in the initialization stage.
+    Should be called in the initialization stage. The ETag and hash of the
+    specification are stored in Redis, so that nothing is done if it has not
+    changed since the last time it was loaded, unless ``force`` is set.
+    Otherwise, all paths are upserted in a single unordered bulk write.
 
     See also:
         :class:`sni.esi.esi.EsiPath`
         `EVE Swagger Interface <https://esi.evetech.net/ui>`_
         `EVE Swagger Interface (JSON) <https://esi.evetech.net/latest/swagger.json>`_
     """
+    global _path_trie
+    stored: Dict[bytes, bytes] = {}
+    if not force and EsiPath.objects.first() is not None:
+        try:
+            stored = connection.hgetall(ESI_SWAGGER_KEY)
+        except RedisError as error:
+            logging.error("Redis error: %s", str(error))
+    headers = {}
+    if b"etag" in stored:
+        headers["If-None-Match"] = stored[b"etag"].decode()
+
     logging.info("Loading ESI swagger specifications %s", ESI_SWAGGER)
-    swagger = request("GET", ESI_SWAGGER).json()
+    response = request("GET", ESI_SWAGGER, headers=headers)
+    response.raise_for_status()
+    if response.status_code == 304:
+        logging.info("ESI swagger specifications unchanged")
+        return
+    digest = xxh64_hexdigest(response.content)
+    if stored.get(b"digest") == digest.encode():
+        logging.info("ESI swagger specifications unchanged")
+        _save_esi_openapi_version(response.headers, digest)
+        return
+
+    swagger = response.json()
     base_path = swagger["basePath"][1:]
+    operations = []
     for path, path_data in swagger["paths"].items():
         for method, method_data in path_data.items():
             full_path = base_path + path
@@ -273,11 +827,77 @@ def load_esi_openapi() -> None:
             scope = None
             for security in method_data.get("security", []):
                 scope = security.get("evesso", [scope])[0]
-            EsiPath.objects(http_method=method, path=full_path,).update(
-                set__http_method=method,
-                set__path_re=path_re,
-                set__path=full_path,
-                set__scope=scope,
-                set__version="latest",
-                upsert=True,
+            operations.append(
+                UpdateOne(
+                    {"http_method": method, "path": full_path},
+                    {
+                        "$set": {
+                            "http_method": method,
+                            "path_re": path_re,
+                            "path": full_path,
+                            "scope": scope,
+                            "version": "latest",
+                        }
+                    },
+                    upsert=True,
+                )
             )
+    # pylint: disable=protected-access
+    result = EsiPath._get_collection().bulk_write(operations, ordered=False)
+    logging.info(
+        "Loaded %d ESI paths (%d new, %d modified)",
+        len(operations),
+        result.upserted_count,
+        result.modified_count,
+    )
+    _save_esi_openapi_version(response.headers, digest)
+    with _path_trie_lock:
+        _path_trie = None
+
+
+def record_etag_revalidation(body_size: int) -> None:
+    """
+    Updates the ETag revalidation statistics, see
+    :meth:`sni.esi.esi.etag_statistics`.
+    """
+    try:
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.hincrby(ETAG_STATISTICS_KEY, "revalidations", 1)
+        pipeline.hincrby(ETAG_STATISTICS_KEY, "bytes_saved", body_size)
+        pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+def _refresh_in_background(
+    path: str, key: Tuple[Optional[str], Any], kwargs: dict
+) -> None:
+    """
+    Submits :meth:`sni.esi.esi._esi_refresh` to the
+    :data:`sni.esi.esi.executor` thread pool, unless a refresh of the same
+    key is already pending in this process.
+    """
+    hashed_key = hash_key(key)
+    with _refreshes_lock:
+        if hashed_key in _refreshes:
+            return
+        _refreshes.add(hashed_key)
+    executor.submit(_esi_refresh, path, key, kwargs)
+
+
+def _save_esi_openapi_version(headers: Mapping[str, str], digest: str) -> None:
+    """
+    Stores the ETag (if any) and the hash of the ESI swagger specification
+    in Redis, see :meth:`sni.esi.esi.load_esi_openapi`.
+    """
+    mapping = {"digest": digest}
+    etag = esi_etag(dict(headers))
+    if etag is not None:
+        mapping["etag"] = etag
+    try:
+        pipeline = connection.pipeline(transaction=True)
+        pipeline.delete(ESI_SWAGGER_KEY)
+        pipeline.hset(ESI_SWAGGER_KEY, mapping=mapping)
+        pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
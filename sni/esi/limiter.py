@@ -0,0 +1,214 @@
+"""
+ESI error budget limiter.
+
+The ESI bans clients that make too many erroneous requests in a given time
+window. Every ESI response reports the remaining error budget in the
+``X-ESI-Error-Limit-Remain`` header, and the number of seconds until the
+window resets in the ``X-ESI-Error-Limit-Reset`` header. These are stored in
+Redis, so that all SNI processes (API server and scheduler threads) share the
+same view of the budget.
+
+As the budget drains, non-interactive calls (i.e. scheduled jobs) are first
+throttled, then paused until the window resets. Interactive calls (i.e. made
+while serving an API request, see :data:`sni.esi.limiter.interactive`) are
+only paused when the budget is almost exhausted.
+
+See also:
+    `ESI error limiting <https://developers.eveonline.com/blog/article/error-limiting-imminent>`_
+"""
+
+from contextvars import ContextVar
+from typing import Mapping, Optional, Tuple
+import asyncio
+import logging
+import time
+
+import pydantic as pdt
+from redis.exceptions import RedisError
+
+from sni.conf import CONFIGURATION as conf
+from sni.db.redis import new_async_redis_connection, new_redis_connection
+
+ERROR_LIMIT_KEY = "esi:error_limit_remain"
+"""Redis key holding the remaining ESI error budget. It expires when the
+error window resets."""
+
+ERROR_LIMIT_SCRIPT = """
+local current = redis.call("GET", KEYS[1])
+if current and tonumber(current) <= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+return 1
+"""
+"""Lua script recording the remaining error budget reported by a response,
+unless a lower budget is already recorded for the current window. Since
+responses may arrive out of order, a delayed one must not lift the
+throttling by reporting an older, higher budget."""
+
+async_connection = new_async_redis_connection()
+connection = new_redis_connection()
+
+interactive: ContextVar[bool] = ContextVar("esi_interactive", default=False)
+"""Wether ESI calls made in the current context are interactive. Set by the
+API server for the duration of each request."""
+
+_async_error_limit_script = async_connection.register_script(
+    ERROR_LIMIT_SCRIPT
+)
+_error_limit_script = connection.register_script(ERROR_LIMIT_SCRIPT)
+_paused_calls = 0
+_throttled_calls = 0
+
+
+class ErrorLimitStatus(pdt.BaseModel):
+    """
+    State of the ESI error budget, as seen by this SNI process
+    """
+
+    paused_calls: int
+    remain: Optional[int]
+    reset: Optional[int]
+    throttled_calls: int
+
+
+async def async_record_error_limit(headers: Mapping[str, str]) -> None:
+    """
+    Asyncio version of :meth:`sni.esi.limiter.record_error_limit`.
+    """
+    parsed = parse_error_limit_headers(headers)
+    if parsed is None:
+        return
+    try:
+        await _async_error_limit_script(
+            keys=[ERROR_LIMIT_KEY], args=[parsed[0], parsed[1]]
+        )
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+async def async_wait_for_error_budget() -> None:
+    """
+    Asyncio version of :meth:`sni.esi.limiter.wait_for_error_budget`.
+    """
+    try:
+        async with async_connection.pipeline(transaction=False) as pipeline:
+            pipeline.get(ERROR_LIMIT_KEY)
+            pipeline.ttl(ERROR_LIMIT_KEY)
+            remain, reset = await pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+        return
+    delay = error_limit_delay(remain, reset, interactive.get())
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def error_limit_delay(
+    remain: Optional[bytes], reset: Optional[int], is_interactive: bool
+) -> float:
+    """
+    Given the remaining error budget and the number of seconds until the
+    error window resets (as stored in Redis), returns how long a call should
+    wait before being issued.
+    """
+    global _paused_calls, _throttled_calls
+    if remain is None or reset is None or reset <= 0:
+        return 0
+    budget = int(remain)
+    if is_interactive:
+        if budget <= conf.esi.error_limit_interactive_threshold:
+            _paused_calls += 1
+            return reset
+        return 0
+    if budget <= conf.esi.error_limit_pause_threshold:
+        logging.warning(
+            "ESI error budget low (%d), pausing for %ds", budget, reset
+        )
+        _paused_calls += 1
+        return reset
+    if budget <= conf.esi.error_limit_throttle_threshold:
+        _throttled_calls += 1
+        return reset / (budget - conf.esi.error_limit_pause_threshold)
+    return 0
+
+
+def error_limit_status() -> ErrorLimitStatus:
+    """
+    Returns the current state of the ESI error budget. The remaining budget
+    is ``None`` if it is unknown, e.g. if Redis is unavailable.
+    """
+    try:
+        remain, reset = _read_error_limit()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+        remain, reset = None, -2
+    return ErrorLimitStatus(
+        paused_calls=_paused_calls,
+        remain=int(remain) if remain is not None else None,
+        reset=reset if remain is not None and reset > 0 else None,
+        throttled_calls=_throttled_calls,
+    )
+
+
+def parse_error_limit_headers(
+    headers: Mapping[str, str]
+) -> Optional[Tuple[int, int]]:
+    """
+    Extracts the remaining error budget and the number of seconds until the
+    error window resets from the headers of an ESI response. Returns
+    ``None`` if the headers are absent or invalid.
+    """
+    try:
+        remain = int(headers["X-ESI-Error-Limit-Remain"])
+        reset = int(headers["X-ESI-Error-Limit-Reset"])
+    except (KeyError, ValueError):
+        return None
+    if reset <= 0:
+        return None
+    return remain, reset
+
+
+def _read_error_limit() -> Tuple[Optional[bytes], int]:
+    """
+    Reads the remaining error budget and its TTL from Redis in one round
+    trip.
+    """
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.get(ERROR_LIMIT_KEY)
+    pipeline.ttl(ERROR_LIMIT_KEY)
+    remain, reset = pipeline.execute()
+    return remain, reset
+
+
+def record_error_limit(headers: Mapping[str, str]) -> None:
+    """
+    Stores the error budget reported in the headers of an ESI response, if
+    any, in Redis, unless a lower budget is already stored (see
+    :data:`sni.esi.limiter.ERROR_LIMIT_SCRIPT`). The key expires when the
+    error window resets.
+    """
+    parsed = parse_error_limit_headers(headers)
+    if parsed is None:
+        return
+    try:
+        _error_limit_script(
+            keys=[ERROR_LIMIT_KEY], args=[parsed[0], parsed[1]]
+        )
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+
+
+def wait_for_error_budget() -> None:
+    """
+    Blocks until an ESI call can be issued without risking to exhaust the
+    error budget, see :meth:`sni.esi.limiter.error_limit_delay`.
+    """
+    try:
+        remain, reset = _read_error_limit()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+        return
+    delay = error_limit_delay(remain, reset, interactive.get())
+    if delay > 0:
+        time.sleep(delay)
@@ -0,0 +1,104 @@
+"""
+In-memory index of ESI paths.
+
+ESI paths (e.g. ``latest/characters/{character_id}/assets/``) are stored in a
+segment trie, where every ``{..._id}`` parameter segment matches any
+non-empty segment. Looking up a concrete path (e.g.
+``latest/characters/123456789/assets``) takes time proportional to its
+length, regardless of the number of known paths.
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+import re
+
+PARAMETER_SEGMENT_RE = re.compile(r"^{\w+_id}$")
+"""Regular expression matching a path parameter segment"""
+
+
+class EsiPathTrie:
+    """
+    Segment trie mapping ESI path templates to the scope they require. Where
+    a segment of a concrete path matches both a literal segment and a
+    parameter segment (e.g. ``latest/characters/affiliation/``), the literal
+    one takes precedence.
+    """
+
+    children: Dict[str, "EsiPathTrie"]
+    is_path: bool
+    scope: Optional[str]
+    wildcard: Optional["EsiPathTrie"]
+
+    def __init__(self):
+        self.children = {}
+        self.is_path = False
+        self.scope = None
+        self.wildcard = None
+
+    @staticmethod
+    def from_paths(
+        paths: Iterable[Tuple[str, Optional[str]]]
+    ) -> "EsiPathTrie":
+        """
+        Builds a trie from an iterable of path templates and scopes. If a
+        path template appears more than once (e.g. for different HTTP
+        methods), the first scope is retained.
+        """
+        trie = EsiPathTrie()
+        for path, scope in paths:
+            trie.insert(path, scope)
+        return trie
+
+    def insert(self, path: str, scope: Optional[str]) -> None:
+        """
+        Inserts a path template, e.g. ``latest/characters/{character_id}/``.
+        """
+        node = self
+        for segment in split_path(path):
+            if PARAMETER_SEGMENT_RE.match(segment):
+                if node.wildcard is None:
+                    node.wildcard = EsiPathTrie()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(segment, EsiPathTrie())
+        if not node.is_path:
+            node.is_path = True
+            node.scope = scope
+
+    def lookup(self, path: str) -> "EsiPathTrie":
+        """
+        Returns the node of the path template matching a concrete path.
+        Raises a :class:`KeyError` if no template matches.
+        """
+        node = self._lookup(split_path(path), 0)
+        if node is None:
+            raise KeyError(path)
+        return node
+
+    def _lookup(
+        self, segments: Tuple[str, ...], index: int
+    ) -> Optional["EsiPathTrie"]:
+        """
+        Recursive implementation of
+        :meth:`sni.esi.routing.EsiPathTrie.lookup`. Backtracks to the
+        parameter segment if the literal one leads to a dead end.
+        """
+        if index == len(segments):
+            return self if self.is_path else None
+        segment = segments[index]
+        child = self.children.get(segment)
+        if child is not None:
+            result = child._lookup(segments, index + 1)
+            if result is not None:
+                return result
+        if self.wildcard is not None and segment:
+            return self.wildcard._lookup(segments, index + 1)
+        return None
+
+
+def split_path(path: str) -> Tuple[str, ...]:
+    """
+    Splits a path in segments. A trailing slash is ignored.
+    """
+    if path.endswith("/"):
+        path = path[:-1]
+    return tuple(path.split("/"))
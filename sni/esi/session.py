@@ -0,0 +1,142 @@
+"""
+Shared HTTP session for ESI and EVE SSO traffic.
+
+All requests to ``esi.evetech.net`` and ``login.eveonline.com`` go through a
+single :class:`requests.Session`, so that TCP and TLS connections are kept
+alive and reused between calls. The underlying ``urllib3`` pool manager keeps
+one connection pool per host.
+
+See also:
+    `requests advanced usage <https://requests.readthedocs.io/en/master/user/advanced/#session-objects>`_
+    `urllib3 Retry <https://urllib3.readthedocs.io/en/latest/reference/urllib3.util.html#urllib3.util.Retry>`_
+"""
+
+from threading import Lock
+from typing import List, Optional
+
+import pydantic as pdt
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sni.conf import CONFIGURATION as conf
+
+MAX_HOST_POOLS = 10
+"""Maximum number of per-host connection pools kept by the session"""
+
+_session: Optional[requests.Session] = None
+_session_lock = Lock()
+
+
+class ConnectionPoolStatistics(pdt.BaseModel):
+    """
+    Usage statistics of a per-host connection pool
+    """
+
+    host: str
+    num_connections: int
+    num_requests: int
+    port: Optional[int]
+    reused_connections: int
+    scheme: str
+
+
+def close_session() -> None:
+    """
+    Closes the shared session and all its pooled connections. A new session
+    is created on the next call to :meth:`sni.esi.session.get_session`.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def connection_pool_statistics() -> List[ConnectionPoolStatistics]:
+    """
+    Reports, for each host the shared session has connected to, how many
+    connections were opened and how many requests were made. The difference
+    is the number of times a kept-alive connection was reused.
+    """
+    result: List[ConnectionPoolStatistics] = []
+    for adapter in set(get_session().adapters.values()):
+        pools = adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            result.append(
+                ConnectionPoolStatistics(
+                    host=pool.host,
+                    num_connections=pool.num_connections,
+                    num_requests=pool.num_requests,
+                    port=pool.port,
+                    reused_connections=max(
+                        0, pool.num_requests - pool.num_connections
+                    ),
+                    scheme=pool.scheme,
+                )
+            )
+    return result
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the shared HTTP session, creating it if needed.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = new_session()
+    return _session
+
+
+def new_session() -> requests.Session:
+    """
+    Creates a new HTTP session with keep-alive connection pools, retries, and
+    exponential backoff, as configured in the ``esi`` section of the
+    configuration file.
+    """
+    pool_size = (
+        conf.esi.http_pool_size
+        if conf.esi.http_pool_size is not None
+        else conf.general.scheduler_thread_count
+    )
+    retry = Retry(
+        total=conf.esi.http_max_retries,
+        backoff_factor=conf.esi.http_backoff_factor,
+        raise_on_status=False,
+        status_forcelist=(502, 503, 504),
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry,
+        pool_block=False,
+        pool_connections=MAX_HOST_POOLS,
+        pool_maxsize=pool_size,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """
+    Wrapper for :meth:`sni.esi.session.request` for POST requests.
+    """
+    return request("post", url, **kwargs)
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Drop-in replacement for :meth:`requests.request` that goes through the
+    shared session. Unless specified, the connect and read timeouts are taken
+    from the configuration.
+    """
+    kwargs.setdefault(
+        "timeout",
+        (conf.esi.http_connect_timeout, conf.esi.http_read_timeout),
+    )
+    return get_session().request(method, url, **kwargs)
@@ -7,6 +7,7 @@ import logging
 from typing import List
 from urllib.parse import urljoin
 
+from aiohttp import ClientError
 from pydantic.error_wrappers import ValidationError
 from requests.exceptions import HTTPError
 import jwt
@@ -15,7 +16,9 @@ import requests
 
 from sni.conf import CONFIGURATION as conf
 
+from .async_esi import async_request
 from .scope import EsiScope
+from .session import post
 
 
 class AuthorizationCodeResponse(pdt.BaseModel):
@@ -83,6 +86,39 @@ class EsiTokenError(Exception):
     """
 
 
+async def async_get_access_token_from_callback_code(
+    code: str,
+) -> AuthorizationCodeResponse:
+    """
+    Asyncio version of
+    :meth:`sni.esi.sso.get_access_token_from_callback_code`.
+    """
+    data = {
+        "code": code,
+        "grant_type": "authorization_code",
+    }
+    headers = {
+        "Authorization": "Basic " + get_basic_authorization_code(),
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Host": "login.eveonline.com",
+    }
+    try:
+        response = await async_request(
+            "post",
+            "https://login.eveonline.com/v2/oauth/token",
+            headers=headers,
+            data=data,
+        )
+        return AuthorizationCodeResponse(**response.data)
+    except ClientError as error:
+        logging.error("Failed to get access token: %s", str(error))
+    except ValidationError as error:
+        logging.error(
+            "Failed to parse authorization code response: %s", str(error)
+        )
+    raise EsiTokenError
+
+
 def decode_access_token(access_token: str) -> DecodedAccessToken:
     """
     Converts an access token in JWT form to a :class:`sni.esi.sso.DecodedAccessToken`
@@ -180,7 +216,7 @@ def get_access_token_from_callback_code(
         "Content-Type": "application/x-www-form-urlencoded",
         "Host": "login.eveonline.com",
     }
-    response = requests.post(
+    response = post(
         "https://login.eveonline.com/v2/oauth/token",
         headers=headers,
         data=data,
@@ -216,7 +252,7 @@ def refresh_access_token(refresh_token: str) -> AuthorizationCodeResponse:
         "Host": "login.eveonline.com",
         "Authorization": "Basic " + get_basic_authorization_code(),
     }
-    response = requests.post(
+    response = post(
         "https://login.eveonline.com/v2/oauth/token",
         headers=headers,
         data=data,
@@ -1,13 +1,75 @@
 """
 Main indexation module. Allows searches and analytics over data pulled from the
 ESI.
+
+Each indexation job (e.g. the location of all characters, see
+:mod:`sni.index.jobs`) is a batch: the eligible characters are selected in a
+single aggregation over the valid refresh tokens, and indexed by a pool of
+``esi.index_concurrency`` threads. The statistics of the latest run of each
+job are recorded in Redis, see :meth:`sni.index.index.index_run_statistics`.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List
+import logging
+import time
+
+import pydantic as pdt
+from redis.exceptions import RedisError
+
+from sni.conf import CONFIGURATION as conf
+from sni.db.redis import new_redis_connection
+from sni.esi.models import EsiRefreshToken
+from sni.esi.scope import EsiScope
 from sni.esi.token import esi_get_on_befalf_of
 from sni.user.models import User
+import sni.utils as utils
 
 from .models import EsiCharacterLocation
 
+INDEX_RUN_STATISTICS_KEY = "index:runs"
+"""Redis hash mapping the name of each indexation job to the statistics of
+its latest run"""
+
+connection = new_redis_connection()
+
+
+class IndexRunStatistics(pdt.BaseModel):
+    """
+    Statistics of a run of an indexation job
+    """
+
+    characters: int
+    """Number of eligible characters"""
+    duration: float
+    """Duration of the run, in seconds"""
+    failures: int
+    """Number of characters that could not be indexed"""
+    finished_on: datetime
+    throughput: float
+    """Number of characters indexed per second"""
+
+
+def eligible_users(scopes: List[EsiScope]) -> List[User]:
+    """
+    Returns the users having valid refresh tokens that, together, cover all
+    the given ESI scopes. The users are selected with a single aggregation
+    over the refresh tokens, and fetched with a single query.
+    """
+    values = [scope.value for scope in scopes]
+    result = EsiRefreshToken.objects.aggregate(
+        [
+            {"$match": {"scopes": {"$in": values}, "valid": True}},
+            {"$unwind": "$scopes"},
+            {"$match": {"scopes": {"$in": values}}},
+            {"$group": {"_id": "$owner", "scopes": {"$addToSet": "$scopes"}}},
+            {"$match": {"scopes": {"$size": len(set(values))}}},
+        ]
+    )
+    owner_ids = [document["_id"] for document in result]
+    return list(User.objects(pk__in=owner_ids))
+
 
 def get_user_location(
     usr: User, invalidate_token_on_4xx: bool = False
@@ -51,3 +113,60 @@ def get_user_location(
         structure_name=structure_name,
         user=usr,
     )
+
+
+def index_run_statistics() -> Dict[str, IndexRunStatistics]:
+    """
+    Returns the statistics of the latest run of each indexation job
+    """
+    return {
+        name.decode(): IndexRunStatistics.parse_raw(raw)
+        for name, raw in connection.hgetall(INDEX_RUN_STATISTICS_KEY).items()
+    }
+
+
+def run_indexation(
+    name: str, scopes: List[EsiScope], function: Callable[[User], bool]
+) -> IndexRunStatistics:
+    """
+    Runs an indexation job: calls ``function`` on every user eligible for
+    the given ESI scopes (see :meth:`sni.index.index.eligible_users`), using
+    at most ``esi.index_concurrency`` threads. ``function`` returns whether
+    the user was successfully indexed. The statistics of the run are logged,
+    recorded under ``name``, and returned.
+    """
+    start = time.monotonic()
+    users = eligible_users(scopes)
+    failures = 0
+    if users:
+        with ThreadPoolExecutor(
+            max_workers=min(conf.esi.index_concurrency, len(users)),
+            thread_name_prefix=f"index-{name}",
+        ) as executor:
+            for succeeded in executor.map(function, users):
+                if not succeeded:
+                    failures += 1
+    duration = time.monotonic() - start
+    statistics = IndexRunStatistics(
+        characters=len(users),
+        duration=duration,
+        failures=failures,
+        finished_on=utils.now(),
+        throughput=len(users) / duration if duration > 0 else 0,
+    )
+    logging.info(
+        "Indexation job %s: %d characters, %d failures, in %.1fs "
+        "(%.1f characters/s)",
+        name,
+        statistics.characters,
+        statistics.failures,
+        statistics.duration,
+        statistics.throughput,
+    )
+    try:
+        connection.hset(
+            INDEX_RUN_STATISTICS_KEY, name, statistics.json(),
+        )
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+    return statistics
@@ -7,11 +7,11 @@ import html
 import re
 
 from sni.esi.scope import EsiScope
-from sni.esi.token import esi_get_on_befalf_of, has_esi_scope
+from sni.esi.token import esi_get_on_befalf_of
 from sni.scheduler import scheduler
 from sni.user.models import User
 
-from .index import get_user_location
+from .index import get_user_location, run_indexation
 from .models import (
     EsiMail,
     EsiMailRecipient,
@@ -30,9 +30,10 @@ def format_mail_body(body: str) -> str:
     return body
 
 
-def index_user_location(usr: User):
+def index_user_location(usr: User) -> bool:
     """
-    Indexes a user's location, online status, and ship
+    Indexes a user's location, online status, and ship. Returns wether it
+    succeeded.
     """
     try:
         location = get_user_location(usr, invalidate_token_on_4xx=True)
@@ -44,6 +45,8 @@ def index_user_location(usr: User):
             usr.character_name,
             str(error),
         )
+        return False
+    return True
 
 
 @scheduler.scheduled_job("interval", hours=1)
@@ -51,18 +54,21 @@ def index_users_location():
     """
     Indexes all user's location
     """
-    for usr in User.objects():
-        if (
-            has_esi_scope(usr, EsiScope.ESI_LOCATION_READ_LOCATION_V1)
-            and has_esi_scope(usr, EsiScope.ESI_LOCATION_READ_ONLINE_V1)
-            and has_esi_scope(usr, EsiScope.ESI_LOCATION_READ_SHIP_TYPE_V1)
-        ):
-            scheduler.add_job(index_user_location, args=(usr,))
+    run_indexation(
+        "location",
+        [
+            EsiScope.ESI_LOCATION_READ_LOCATION_V1,
+            EsiScope.ESI_LOCATION_READ_ONLINE_V1,
+            EsiScope.ESI_LOCATION_READ_SHIP_TYPE_V1,
+        ],
+        index_user_location,
+    )
 
 
-def index_user_mails(usr: User):
+def index_user_mails(usr: User) -> bool:
     """
-    Pulls a character's email
+    Pulls a character's email. Returns wether all new emails could be
+    indexed.
     """
     try:
         character_id = usr.character_id
@@ -78,7 +84,8 @@ def index_user_mails(usr: User):
             usr.character_name,
             str(error),
         )
-        return
+        return False
+    succeeded = True
     for header in headers:
         mail_id = header["mail_id"]
         if EsiMail.objects(mail_id=mail_id).first() is not None:
@@ -107,6 +114,8 @@ def index_user_mails(usr: User):
                 usr.character_name,
                 str(error),
             )
+            succeeded = False
+    return succeeded
 
 
 @scheduler.scheduled_job("interval", hours=1)
@@ -114,15 +123,15 @@ def index_users_mails():
     """
     Index all user emails.
     """
-    for usr in User.objects():
-        if has_esi_scope(usr, EsiScope.ESI_MAIL_READ_MAIL_V1):
-            scheduler.add_job(index_user_mails, args=(usr,))
+    run_indexation(
+        "mails", [EsiScope.ESI_MAIL_READ_MAIL_V1], index_user_mails
+    )
 
 
-def index_user_skillpoints(usr: User):
+def index_user_skillpoints(usr: User) -> bool:
     """
     Measures a user's skillpoints. See
-    :class:`sni.index.models.EsiSkillPoints`.
+    :class:`sni.index.models.EsiSkillPoints`. Returns wether it succeeded.
     """
     try:
         data = esi_get_on_befalf_of(
@@ -142,6 +151,8 @@ def index_user_skillpoints(usr: User):
             usr.character_name,
             str(error),
         )
+        return False
+    return True
 
 
 @scheduler.scheduled_job("interval", hours=12)
@@ -149,14 +160,16 @@ def index_users_skillpoints():
     """
     Measures all users skillpoints
     """
-    for usr in User.objects():
-        if has_esi_scope(usr, EsiScope.ESI_SKILLS_READ_SKILLS_V1):
-            scheduler.add_job(index_user_skillpoints, args=(usr,))
+    run_indexation(
+        "skillpoints",
+        [EsiScope.ESI_SKILLS_READ_SKILLS_V1],
+        index_user_skillpoints,
+    )
 
 
-def index_user_wallets(usr: User):
+def index_user_wallets(usr: User) -> bool:
     """
-    Indexes user wallet balance
+    Indexes user wallet balance. Returns wether it succeeded.
     """
     try:
         balance = esi_get_on_befalf_of(
@@ -172,6 +185,8 @@ def index_user_wallets(usr: User):
             usr.character_name,
             str(error),
         )
+        return False
+    return True
 
 
 @scheduler.scheduled_job("interval", hours=12)
@@ -179,6 +194,8 @@ def index_users_wallets():
     """
     Indexes user wallet balance
     """
-    for usr in User.objects():
-        if has_esi_scope(usr, EsiScope.ESI_WALLET_READ_CHARACTER_WALLET_V1):
-            scheduler.add_job(index_user_wallets, args=(usr,))
+    run_indexation(
+        "wallets",
+        [EsiScope.ESI_WALLET_READ_CHARACTER_WALLET_V1],
+        index_user_wallets,
+    )
@@ -9,11 +9,14 @@ from sni.db.redis import new_redis_connection
 import sni.utils as utils
 
 from .models import EsiObjectName
+from .name_table import build_sde_name_table, load_sde_name_table
 from .sde import (
     download_latest_sde,
     get_latest_sde_md5,
     import_sde_dump,
+    sde_dump_path,
 )
+from .universe import build_solar_system_graph, load_solar_system_graph
 
 
 @scheduler.scheduled_job(
@@ -21,12 +24,14 @@ from .sde import (
 )
 def update_sde() -> None:
     """
-    Checks the hash of the SDE, and if needed, downloads and imports it.
+    Checks the hash of the SDE, and if needed, downloads and incrementally
+    imports it (see :meth:`sni.sde.sde.import_sde_dump`), and regenerates the
+    SDE name table (see :mod:`sni.sde.name_table`) and the solar system graph
+    (see :mod:`sni.sde.universe`).
     """
     redis = new_redis_connection()
-    latest_sde_md5 = (
-        get_latest_sde_md5() + "/" + str(EsiObjectName.SCHEMA_VERSION)
-    )
+    latest_dump_md5 = get_latest_sde_md5()
+    latest_sde_md5 = latest_dump_md5 + "/" + str(EsiObjectName.SCHEMA_VERSION)
     current_sde_md5 = redis.get("sde_md5")
     if current_sde_md5 is not None:
         current_sde_md5 = current_sde_md5.decode()
@@ -34,7 +39,10 @@ def update_sde() -> None:
         logging.debug("SDE is up to date")
         return
     logging.debug("SDE is out of date")
-    dump_path = "sde.sqlite"
-    download_latest_sde(dump_path)
-    import_sde_dump(dump_path)
+    download_latest_sde(md5=latest_dump_md5)
+    import_sde_dump(sde_dump_path())
+    build_sde_name_table()
+    load_sde_name_table()
+    build_solar_system_graph(sde_dump_path())
+    load_solar_system_graph()
     redis.set("sde_md5", latest_sde_md5)
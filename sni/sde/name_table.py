@@ -0,0 +1,312 @@
+"""
+In-process SDE name table.
+
+The names of the static objects of the SDE (types, groups, categories,
+regions, constellations, and solar systems) are kept in memory, in a compact,
+read-only table, so that they can be looked up without any network round
+trip. For each ESI field name (e.g. ``solar_system_id``), the table holds a
+sorted array of IDs, along with the offset and length of each name in a
+single UTF-8 buffer. Lookups are binary searches.
+
+The table is generated from the ``esi_object_name`` collection (see
+:class:`sni.sde.models.EsiObjectName`) after each SDE import, and written to
+the file ``sde.name_table_path``. SNI processes load that file, by default
+through ``mmap``, so that they share its pages. Since the file is replaced
+atomically, and since processes reload it when it changes, a new table is
+swapped in without ever serving a partially written one.
+
+File format (native byte order, each array padded to a multiple of 8
+bytes)::
+
+    magic (8 bytes)
+    number of field names (uint32)
+    for each field name:
+        length of the field name (uint16), field name (UTF-8)
+        number of entries (uint32)
+    padding
+    for each field name:
+        IDs (int64 each), name offsets (uint32 each), name lengths (uint16
+        each)
+    names (UTF-8)
+
+The IDs of the pseudo field name ``""`` are those of all the objects, and
+are used for lookups without a field name.
+"""
+
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import mmap
+import os
+import struct
+import time
+
+from sni.conf import CONFIGURATION as conf
+
+from .models import EsiObjectName
+
+NAME_TABLE_MAGIC = b"SNISDE\x00\x01"
+"""First bytes of a name table file, including the format version"""
+
+NAME_TABLE_RELOAD_INTERVAL = 60
+"""Minimum time (in seconds) between two checks for a new name table file"""
+
+_name_table: Optional["SdeNameTable"] = None
+_name_table_checked_at = 0.0
+_name_table_lock = Lock()
+_name_table_mtime: Optional[int] = None
+_retired_name_tables: List["SdeNameTable"] = []
+
+
+class SdeNameTable:
+    """
+    Compact, read-only ID to name table. See :mod:`sni.sde.name_table`.
+    """
+
+    _buffer: Sequence[int]
+    _mmap: Optional[mmap.mmap]
+    _tables: Dict[str, Tuple[Sequence[int], Sequence[int], Sequence[int]]]
+
+    def __init__(
+        self,
+        tables: Dict[str, Tuple[Sequence[int], Sequence[int], Sequence[int]]],
+        buffer: Sequence[int],
+        mapped_file: Optional[mmap.mmap] = None,
+    ):
+        self._buffer = buffer
+        self._mmap = mapped_file
+        self._tables = tables
+
+    def __len__(self) -> int:
+        table = self._tables.get("")
+        return len(table[0]) if table is not None else 0
+
+    def close(self) -> bool:
+        """
+        Drops the views of the table on its buffer, and closes its mapped
+        file, if any. The table is empty afterwards. Returns ``False`` if the
+        mapped file could not be closed because a view on it is still in use
+        (e.g. by a lookup in progress), in which case this should be retried
+        later.
+        """
+        self._tables = {}
+        self._buffer = b""
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                return False
+            self._mmap = None
+        return True
+
+    @staticmethod
+    def from_buffer(
+        data: memoryview, mapped_file: Optional[mmap.mmap] = None
+    ) -> "SdeNameTable":
+        """
+        Reads a name table from a buffer without copying it, see
+        :meth:`sni.sde.name_table.SdeNameTable.to_bytes`. Raises a
+        :class:`ValueError` if the buffer is not a name table.
+        """
+        if bytes(data[: len(NAME_TABLE_MAGIC)]) != NAME_TABLE_MAGIC:
+            raise ValueError("Not an SDE name table")
+        position = len(NAME_TABLE_MAGIC)
+        (table_count,) = struct.unpack_from("=I", data, position)
+        position += 4
+        headers: List[Tuple[str, int]] = []
+        for _ in range(table_count):
+            (name_length,) = struct.unpack_from("=H", data, position)
+            position += 2
+            field_name = bytes(data[position : position + name_length])
+            position += name_length
+            (entry_count,) = struct.unpack_from("=I", data, position)
+            position += 4
+            headers.append((field_name.decode(), entry_count))
+        position = _padded(position)
+        tables = {}
+        for field_name, entry_count in headers:
+            arrays = []
+            for type_code in ["q", "I", "H"]:
+                size = struct.calcsize(type_code) * entry_count
+                arrays.append(data[position : position + size].cast(type_code))
+                position = _padded(position + size)
+            tables[field_name] = (arrays[0], arrays[1], arrays[2])
+        return SdeNameTable(tables, data[position:], mapped_file)
+
+    def get(self, field_id: int, field_name: Optional[str]) -> Optional[str]:
+        """
+        Returns the name of an object, or ``None`` if it is unknown.
+        """
+        table = self._tables.get(field_name or "")
+        if table is None:
+            return None
+        ids, offsets, lengths = table
+        index = bisect_left(ids, field_id)
+        if index == len(ids) or ids[index] != field_id:
+            return None
+        offset = offsets[index]
+        return bytes(self._buffer[offset : offset + lengths[index]]).decode()
+
+    @staticmethod
+    def load(path: str, use_mmap: bool = True) -> "SdeNameTable":
+        """
+        Loads a name table file, through ``mmap`` if ``use_mmap`` is set.
+        """
+        with open(path, "rb") as table_file:
+            if use_mmap:
+                mapped_file = mmap.mmap(
+                    table_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+                return SdeNameTable.from_buffer(
+                    memoryview(mapped_file), mapped_file
+                )
+            return SdeNameTable.from_buffer(memoryview(table_file.read()))
+
+    @staticmethod
+    def to_bytes(entries: Iterable[Tuple[int, List[str], str]]) -> bytes:
+        """
+        Serializes a name table. Takes an iterable of ``(id, field_names,
+        name)`` triples. If an ID appears more than once for the same field
+        name, the first name is retained.
+        """
+        buffer = bytearray()
+        names: Dict[str, Tuple[int, int]] = {}
+        index: Dict[str, Dict[int, Tuple[int, int]]] = {"": {}}
+        for field_id, field_names, name in entries:
+            if name not in names:
+                encoded = name.encode()
+                names[name] = (len(buffer), len(encoded))
+                buffer += encoded
+            for field_name in [""] + field_names:
+                index.setdefault(field_name, {}).setdefault(
+                    field_id, names[name]
+                )
+        data = bytearray(NAME_TABLE_MAGIC)
+        data += struct.pack("=I", len(index))
+        for field_name, table in sorted(index.items()):
+            encoded = field_name.encode()
+            data += struct.pack("=H", len(encoded)) + encoded
+            data += struct.pack("=I", len(table))
+        data += bytes(_padded(len(data)) - len(data))
+        for field_name, table in sorted(index.items()):
+            ids = sorted(table.keys())
+            for values in [
+                array("q", ids),
+                array("I", [table[field_id][0] for field_id in ids]),
+                array("H", [table[field_id][1] for field_id in ids]),
+            ]:
+                data += values.tobytes()
+                data += bytes(_padded(len(data)) - len(data))
+        return bytes(data + buffer)
+
+
+def build_sde_name_table(path: Optional[str] = None) -> int:
+    """
+    Generates the name table file from the ``esi_object_name`` collection,
+    and returns the number of objects it contains. The file is written next
+    to its destination and then renamed, so that it is replaced atomically.
+    """
+    if path is None:
+        path = conf.sde.name_table_path
+    # pylint: disable=protected-access
+    documents = EsiObjectName._get_collection().find(
+        {"expires_on": None},
+        {"_id": 0, "field_id": 1, "field_names": 1, "name": 1},
+    )
+    data = SdeNameTable.to_bytes(
+        (
+            document["field_id"],
+            # Older imports stored a single field name as a string
+            [field_names] if isinstance(field_names, str) else field_names,
+            document["name"],
+        )
+        for document in documents
+        if document.get("name") is not None
+        for field_names in [document.get("field_names", [])]
+    )
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as table_file:
+        table_file.write(data)
+    os.replace(temporary_path, path)
+    table = SdeNameTable.from_buffer(memoryview(data))
+    logging.info(
+        "Generated SDE name table %s: %d objects, %d bytes",
+        path,
+        len(table),
+        len(data),
+    )
+    return len(table)
+
+
+def get_sde_name_table() -> Optional[SdeNameTable]:
+    """
+    Returns the name table of this process, or ``None`` if the name table
+    file does not exist. The file is checked for changes at most every
+    :data:`sni.sde.name_table.NAME_TABLE_RELOAD_INTERVAL` seconds, and
+    reloaded if needed.
+    """
+    if time.monotonic() - _name_table_checked_at > NAME_TABLE_RELOAD_INTERVAL:
+        load_sde_name_table()
+    return _name_table
+
+
+def init_sde_name_table() -> None:
+    """
+    Loads the name table file at startup. If it does not exist but the SDE
+    has already been imported, it is generated first.
+    """
+    if load_sde_name_table() is None and EsiObjectName.objects.first():
+        build_sde_name_table()
+        load_sde_name_table()
+
+
+def load_sde_name_table(force: bool = False) -> Optional[SdeNameTable]:
+    """
+    Loads (or reloads) the name table file if it has changed since it was
+    last loaded, or if ``force`` is set, and swaps it in. Returns the name
+    table, or ``None`` if the file does not exist.
+
+    The table that is swapped out is closed at the next call, so that the
+    lookups still using it can complete, and its file mapping is released.
+    """
+    global _name_table, _name_table_checked_at, _name_table_mtime
+    global _retired_name_tables
+    with _name_table_lock:
+        _name_table_checked_at = time.monotonic()
+        _retired_name_tables = [
+            table for table in _retired_name_tables if not table.close()
+        ]
+        try:
+            mtime = os.stat(conf.sde.name_table_path).st_mtime_ns
+        except FileNotFoundError:
+            return _name_table
+        if force or mtime != _name_table_mtime:
+            try:
+                table = SdeNameTable.load(
+                    conf.sde.name_table_path, conf.sde.name_table_mmap
+                )
+                if _name_table is not None:
+                    _retired_name_tables.append(_name_table)
+                _name_table = table
+                _name_table_mtime = mtime
+                logging.info(
+                    "Loaded SDE name table %s (%d objects)",
+                    conf.sde.name_table_path,
+                    len(_name_table),
+                )
+            except (OSError, ValueError, struct.error) as error:
+                logging.error(
+                    "Could not load SDE name table %s: %s",
+                    conf.sde.name_table_path,
+                    str(error),
+                )
+        return _name_table
+
+
+def _padded(position: int) -> int:
+    """
+    Rounds a position up to a multiple of 8
+    """
+    return (position + 7) // 8 * 8
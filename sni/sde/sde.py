@@ -5,48 +5,197 @@ See also:
     `EVE Developer Ressources <https://developers.eveonline.com/resource/resources>`_
 """
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import bz2
 import hashlib
 import logging
+import os
 import sqlite3
+import time
 
-import mongoengine as me
+from pymongo import DeleteMany, UpdateOne
+from pymongo.collection import Collection
+from redis.exceptions import RedisError
 import requests
+from xxhash import xxh64, xxh64_intdigest
 
-from sni.db.cache import cache_get, cache_set
-from sni.utils import DAY
+from sni.conf import CONFIGURATION as conf
+from sni.db.cache import CacheEntry, cache_get_many, cache_set_many, cached
+from sni.db.redis import new_redis_connection
+from sni.utils import DAY, HOUR
 
 from .models import EsiObjectName
+from .name_table import get_sde_name_table
 
 SDE_ROOT_URL = "https://www.fuzzwork.co.uk/dump/"
 SDE_SQLITE_MD5_URL = SDE_ROOT_URL + "sqlite-latest.sqlite.bz2.md5"
 SDE_SQLITE_DUMP_URL = SDE_ROOT_URL + "sqlite-latest.sqlite.bz2"
 
+SDE_DUMP_FILE_NAME = "sde.sqlite"
+"""Name of the decompressed SDE dump, in ``sde.data_directory``"""
 
-def download_latest_sde(dump_path: str) -> str:
+SDE_HASHES_KEY_PREFIX = "sde:hashes:"
+"""Prefix of the Redis hashes recording, for each SDE table, the hash of
+each import batch, see :meth:`sni.sde.sde._import_sde_table`"""
+
+SDE_NEGATIVE_TTL = 1 * HOUR
+"""TTL (in seconds) of the cache entries of unknown IDs"""
+
+SDE_VALIDATOR_SUFFIX = ".validator"
+"""Suffix of the file recording the validator (``ETag`` or
+``Last-Modified``) of a partial SDE download, see
+:meth:`sni.sde.sde._download_sde_chunks`"""
+
+connection = new_redis_connection()
+
+
+def _decompress_sde(chunks: "Queue[Optional[bytes]]", path: str) -> None:
+    """
+    Decompresses the chunks of a bz2 SDE dump into ``path``, until ``None``
+    is received. If the decompression fails, the remaining chunks are
+    consumed, so that the producer is never blocked. See
+    :meth:`sni.sde.sde.download_latest_sde`.
+    """
+    decompressor = bz2.BZ2Decompressor()
+    data: Optional[bytes] = b""
+    try:
+        with open(path, "wb") as dump:
+            while True:
+                data = chunks.get()
+                if data is None:
+                    break
+                dump.write(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise EOFError("The SDE dump is truncated")
+    except BaseException:
+        while data is not None:
+            data = chunks.get()
+        raise
+
+
+def download_latest_sde(
+    dump_path: Optional[str] = None, md5: Optional[str] = None
+) -> str:
     """
-    Downloads and decompresses the latest SDE sqlite dump.
+    Downloads and decompresses the latest SDE sqlite dump to ``dump_path``
+    (by default, :meth:`sni.sde.sde.sde_dump_path`).
+
+    The compressed dump is downloaded in chunks of ``sde.download_chunk_size``
+    bytes, and appended to ``<dump_path>.bz2.part``. If that file already
+    exists, e.g. after an interrupted download, the download resumes from
+    its end with a ``Range`` request, provided that the dump has not changed
+    upstream in the meantime (``If-Range``). The chunks are decompressed in a
+    separate thread, which receives them through a queue of at most
+    ``sde.download_queue_size`` chunks, into a temporary file. Once the
+    download completes and, if ``md5`` is given, its checksum matches, the
+    temporary file is renamed to ``dump_path``, so that a failed download
+    never replaces the previous dump. If the dump cannot be decompressed, or
+    if its checksum does not match, the partial download is deleted, and a
+    :class:`ValueError` is raised.
 
     Returns:
         The MD5 checksum of the dump (before decompression).
     """
+    if dump_path is None:
+        os.makedirs(conf.sde.data_directory, exist_ok=True)
+        dump_path = sde_dump_path()
+    download_path = dump_path + ".bz2.part"
+    temporary_path = f"{dump_path}.{os.getpid()}.tmp"
+    hasher = hashlib.md5()  # nosec
+    chunks: "Queue[Optional[bytes]]" = Queue(conf.sde.download_queue_size)
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            decompression = executor.submit(
+                _decompress_sde, chunks, temporary_path
+            )
+            try:
+                for data in _download_sde_chunks(download_path):
+                    hasher.update(data)
+                    chunks.put(data)
+                    if decompression.done():
+                        break
+            finally:
+                chunks.put(None)
+            error = decompression.exception()
+        if error is not None:
+            _remove_sde_download(download_path)
+            raise ValueError("Could not decompress the SDE") from error
+        digest = hasher.hexdigest()
+        if md5 is not None and digest != md5:
+            _remove_sde_download(download_path)
+            raise ValueError(
+                f"Downloaded SDE has hash {digest}, but {md5} was expected"
+            )
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, dump_path)
+    _remove_sde_download(download_path)
+    logging.debug("Downloaded latest SDE with hash %s", digest)
+    return digest
+
+
+def _download_sde_chunks(download_path: str) -> Iterator[bytes]:
+    """
+    Yields the chunks of the compressed SDE dump, and appends them to
+    ``download_path``. If that file exists, its content is yielded first,
+    and the download resumes from its end, unless the server does not
+    support ``Range`` requests, or the dump has changed since the download
+    started. For the latter, the validator of the dump (its strong ``ETag``,
+    or else its ``Last-Modified`` date) is recorded next to
+    ``download_path``, and sent in an ``If-Range`` header, so that the server
+    answers with the whole new dump instead of the rest of the old one. See
+    :meth:`sni.sde.sde.download_latest_sde`.
+    """
+    validator_path = download_path + SDE_VALIDATOR_SUFFIX
+    offset = 0
+    headers = {}
+    if os.path.exists(download_path) and os.path.exists(validator_path):
+        offset = os.path.getsize(download_path)
+        with open(validator_path, "r") as validator_file:
+            validator = validator_file.read()
+        if offset > 0 and validator:
+            headers = {"If-Range": validator, "Range": f"bytes={offset}-"}
+        else:
+            offset = 0
     logging.debug(
-        "Downloading and decompressing SDE Sqlite dump to %s", dump_path
+        "Downloading SDE Sqlite dump to %s from byte %d", download_path, offset
     )
-    response = requests.get(SDE_SQLITE_DUMP_URL, stream=True)
-    response.raise_for_status()
-    decompressor = bz2.BZ2Decompressor()
-    hasher = hashlib.md5()  # nosec
-    with open(dump_path, "wb+") as dump:
-        for data in response.iter_content(chunk_size=512):
-            hasher.update(data)
-            decompressed_data = decompressor.decompress(data)
-            if decompressed_data:
-                dump.write(decompressed_data)
-    md5 = hasher.hexdigest()
-    logging.debug("Downloaded latest SDE with hash %s", md5)
-    return md5
+    response = requests.get(SDE_SQLITE_DUMP_URL, headers=headers, stream=True)
+    with response:
+        if response.status_code == 416:
+            # The previous download is already complete
+            response = None
+        else:
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+                etag = response.headers.get("ETag", "")
+                if etag.startswith("W/"):
+                    # Weak ETags cannot be used in If-Range
+                    etag = ""
+                with open(validator_path, "w") as validator_file:
+                    validator_file.write(
+                        etag or response.headers.get("Last-Modified", "")
+                    )
+        if offset > 0:
+            with open(download_path, "rb") as download:
+                while True:
+                    data = download.read(conf.sde.download_chunk_size)
+                    if not data:
+                        break
+                    yield data
+        if response is None:
+            return
+        with open(download_path, "ab" if offset > 0 else "wb") as download:
+            for data in response.iter_content(
+                chunk_size=conf.sde.download_chunk_size
+            ):
+                download.write(data)
+                yield data
 
 
 def get_latest_sde_md5() -> str:
@@ -59,6 +208,75 @@ def get_latest_sde_md5() -> str:
     return md5
 
 
+def _import_sde_batch(
+    collection: Collection,
+    field_names: List[str],
+    field_name: str,
+    lower: Optional[int],
+    upper: Optional[int],
+    rows: List[Tuple[int, str]],
+) -> int:
+    """
+    Synchronizes the documents of an ID range (``lower`` excluded, ``upper``
+    included, ``None`` meaning unbounded) with the rows of an SDE batch, and
+    returns the number of documents written or deleted. Documents that
+    expire (i.e. that do not come from the SDE) are left untouched. See
+    :meth:`sni.sde.sde._import_sde_table`.
+    """
+    id_range: Dict[str, int] = {}
+    if lower is not None:
+        id_range["$gt"] = lower
+    if upper is not None:
+        id_range["$lte"] = upper
+    query: dict = {"expires_on": None, "field_names": field_name}
+    if id_range:
+        query["field_id"] = id_range
+    documents = {
+        document["field_id"]: document
+        for document in collection.find(
+            query,
+            {
+                "_id": 0,
+                "_version": 1,
+                "field_id": 1,
+                "field_names": 1,
+                "name": 1,
+            },
+        )
+    }
+    operations: list = []
+    for field_id, name in rows:
+        expected = {
+            "_version": EsiObjectName.SCHEMA_VERSION,
+            "field_id": field_id,
+            "field_names": field_names,
+            "name": name,
+        }
+        if documents.pop(field_id, None) == expected:
+            continue
+        operations.append(
+            UpdateOne(
+                {"field_id": field_id, "field_names": field_name},
+                {"$set": expected},
+                upsert=True,
+            )
+        )
+    operation_count = len(operations) + len(documents)
+    if documents:
+        operations.append(
+            DeleteMany(
+                {
+                    "expires_on": None,
+                    "field_id": {"$in": list(documents.keys())},
+                    "field_names": field_name,
+                }
+            )
+        )
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return operation_count
+
+
 def import_sde_dump(dump_path: str) -> None:
     """
     Imports the relevant SDE table in to the database
@@ -78,126 +296,278 @@ def import_sde_dump_inv_categories(client: sqlite3.Connection) -> None:
     """
     Imports the ``invCategories`` table
     """
-    logging.debug("Importing SDE table invCategories")
-    for row in client.execute("SELECT * FROM invCategories;"):
-        EsiObjectName.objects(
-            field_id=row["categoryID"], field_names="category_id",
-        ).update(
-            set___version=EsiObjectName.SCHEMA_VERSION,
-            set__field_id=row["categoryID"],
-            set__field_names=["category_id"],
-            set__name=row["categoryName"],
-            upsert=True,
-        )
+    _import_sde_table(
+        client, "invCategories", "categoryID", "categoryName", ["category_id"]
+    )
 
 
 def import_sde_dump_inv_groups(client: sqlite3.Connection) -> None:
     """
     Imports the ``invGroups`` table
     """
-    logging.debug("Importing SDE table invGroups")
-    for row in client.execute("SELECT * FROM invGroups;"):
-        EsiObjectName.objects(
-            field_id=row["groupID"], field_names="group_id",
-        ).update(
-            set___version=EsiObjectName.SCHEMA_VERSION,
-            set__field_id=row["groupID"],
-            set__field_names=["group_id"],
-            set__name=row["groupName"],
-            upsert=True,
-        )
+    _import_sde_table(
+        client, "invGroups", "groupID", "groupName", ["group_id"]
+    )
 
 
 def import_sde_dump_inv_types(client: sqlite3.Connection) -> None:
     """
     Imports the ``invTypes`` table
     """
-    logging.debug("Importing SDE table invTypes")
-    for row in client.execute("SELECT * FROM invTypes;"):
-        EsiObjectName.objects(
-            field_id=row["typeID"], field_names="type_id",
-        ).update(
-            set___version=EsiObjectName.SCHEMA_VERSION,
-            set__field_id=row["typeID"],
-            set__field_names=[
-                "item_type_id",
-                "ship_type_id",
-                "type_id",
-                "weapon_type_id",
-            ],
-            set__name=row["typeName"],
-            upsert=True,
-        )
+    _import_sde_table(
+        client,
+        "invTypes",
+        "typeID",
+        "typeName",
+        ["item_type_id", "ship_type_id", "type_id", "weapon_type_id"],
+        "type_id",
+    )
 
 
 def import_sde_dump_map_regions(client: sqlite3.Connection) -> None:
     """
     Imports the ``mapRegions`` table
     """
-    logging.debug("Importing SDE table mapRegions")
-    for row in client.execute("SELECT * FROM mapRegions;"):
-        EsiObjectName.objects(
-            field_id=row["regionID"], field_names="region_id",
-        ).update(
-            set___version=EsiObjectName.SCHEMA_VERSION,
-            set__field_id=row["regionID"],
-            set__field_names="region_id",
-            set__name=row["regionName"],
-            upsert=True,
-        )
+    _import_sde_table(
+        client, "mapRegions", "regionID", "regionName", ["region_id"]
+    )
 
 
 def import_sde_dump_inv_constellations(client: sqlite3.Connection) -> None:
     """
     Imports the ``mapConstellations`` table
     """
-    logging.debug("Importing SDE table mapConstellations")
-    for row in client.execute("SELECT * FROM mapConstellations;"):
-        EsiObjectName.objects(
-            field_id=row["constellationID"], field_names="constellation_id",
-        ).update(
-            set___version=EsiObjectName.SCHEMA_VERSION,
-            set__field_id=row["constellationID"],
-            set__field_names="constellation_id",
-            set__name=row["constellationName"],
-            upsert=True,
-        )
+    _import_sde_table(
+        client,
+        "mapConstellations",
+        "constellationID",
+        "constellationName",
+        ["constellation_id"],
+    )
 
 
 def import_sde_dump_inv_solar_systems(client: sqlite3.Connection) -> None:
     """
     Imports the ``mapSolarSystems`` table
     """
-    logging.debug("Importing SDE table mapSolarSystems")
-    for row in client.execute("SELECT * FROM mapSolarSystems;"):
-        EsiObjectName.objects(
-            field_id=row["solarSystemID"], field_names="solar_system_id",
-        ).update(
-            set___version=EsiObjectName.SCHEMA_VERSION,
-            set__field_id=row["solarSystemID"],
-            set__field_names="solar_system_id",
-            set__name=row["solarSystemName"],
-            upsert=True,
+    _import_sde_table(
+        client,
+        "mapSolarSystems",
+        "solarSystemID",
+        "solarSystemName",
+        ["solar_system_id"],
+    )
+
+
+def _import_sde_table(
+    client: sqlite3.Connection,
+    table: str,
+    id_column: str,
+    name_column: str,
+    field_names: List[str],
+    field_name: Optional[str] = None,
+) -> int:
+    """
+    Incrementally imports an SDE table into the ``esi_object_name``
+    collection (see :class:`sni.sde.models.EsiObjectName`), and returns the
+    number of documents written or deleted. Documents are matched by ID and
+    ``field_name``, which defaults to the first element of ``field_names``.
+
+    The rows are streamed from the SQLite dump in ID order, and split into
+    batches (see :meth:`sni.sde.sde.sde_batches`). The hash of each batch is
+    compared to the one recorded by the previous import, in the Redis hash
+    ``sde:hashes:<table>``, and unchanged batches are skipped. The documents
+    in the ID range of a changed batch are compared to its rows, and only
+    the added or changed rows are upserted, and the orphaned documents
+    deleted, in a single unordered bulk write. Recorded hashes are ignored if
+    the collection holds no document for that table.
+    """
+    if field_name is None:
+        field_name = field_names[0]
+    logging.debug("Importing SDE table %s", table)
+    # pylint: disable=protected-access
+    collection = EsiObjectName._get_collection()
+    hashes_key = SDE_HASHES_KEY_PREFIX + table
+    previous_hashes: Dict[str, str] = {}
+    if collection.find_one({"field_names": field_name}, {"_id": 1}):
+        try:
+            previous_hashes = {
+                batch.decode(): digest.decode()
+                for batch, digest in connection.hgetall(hashes_key).items()
+            }
+        except RedisError as error:
+            logging.error("Redis error: %s", str(error))
+    start = time.monotonic()
+    batch_count = changed_batch_count = operation_count = 0
+    hashes: Dict[str, str] = {}
+    seed = f"{EsiObjectName.SCHEMA_VERSION}:{field_names}".encode()
+    cursor = client.execute(
+        f"SELECT {id_column}, {name_column} FROM {table} "  # nosec
+        f"ORDER BY {id_column};"
+    )
+    for lower, upper, rows in sde_batches(cursor):
+        batch = str(upper) if upper is not None else "end"
+        hasher = xxh64(seed)
+        for field_id, name in rows:
+            hasher.update(f"{field_id}\0{name}\0".encode())
+        hashes[batch] = hasher.hexdigest()
+        batch_count += 1
+        if previous_hashes.get(batch) == hashes[batch]:
+            continue
+        changed_batch_count += 1
+        operation_count += _import_sde_batch(
+            collection, field_names, field_name, lower, upper, rows
         )
+    try:
+        pipeline = connection.pipeline()
+        pipeline.delete(hashes_key)
+        pipeline.hset(hashes_key, mapping=hashes)
+        pipeline.execute()
+    except RedisError as error:
+        logging.error("Redis error: %s", str(error))
+    duration = time.monotonic() - start
+    logging.info(
+        "Imported SDE table %s: %d/%d batches changed, %d documents written "
+        "or deleted in %.1fs",
+        table,
+        changed_batch_count,
+        batch_count,
+        operation_count,
+        duration,
+    )
+    return operation_count
+
+
+def _remove_sde_download(download_path: str) -> None:
+    """
+    Deletes a partial SDE download and its validator, see
+    :meth:`sni.sde.sde._download_sde_chunks`.
+    """
+    for path in [download_path, download_path + SDE_VALIDATOR_SUFFIX]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def sde_batches(
+    rows: Iterable[Tuple[int, str]]
+) -> Iterator[Tuple[Optional[int], Optional[int], List[Tuple[int, str]]]]:
+    """
+    Splits rows sorted by ID into batches of
+    ``sde.import_batch_size`` rows on average, and yields ``(lower, upper,
+    rows)`` triples, where ``lower`` (excluded) and ``upper`` (included) bound
+    the IDs of the batch. The first batch has no lower bound, and the last
+    one (which is always yielded, even if empty) has no upper bound.
+
+    A batch ends after each row whose ID hashes to a multiple of the batch
+    size, so that the boundaries only depend on the IDs themselves: adding
+    or removing a row only changes the batch containing it, and the other
+    batches keep their hashes.
+    """
+    batch_size = conf.sde.import_batch_size
+    lower: Optional[int] = None
+    batch: List[Tuple[int, str]] = []
+    for field_id, name in rows:
+        batch.append((field_id, name))
+        if xxh64_intdigest(str(field_id).encode()) % batch_size == 0:
+            yield lower, field_id, batch
+            lower, batch = field_id, []
+    yield lower, None, batch
+
+
+def sde_dump_path() -> str:
+    """
+    Returns the path of the decompressed SDE dump, in
+    ``sde.data_directory``.
+    """
+    return os.path.join(conf.sde.data_directory, SDE_DUMP_FILE_NAME)
 
 
 def sde_get_name(field_id: int, field_name: Optional[str]) -> Optional[str]:
     """
-    Fetches a document from the ``esi_object_name`` collection. See
-    :class:`sni.sde.models.EsiObjectName`.
+    Returns the name of an SDE object. The name table of this process is
+    looked up first (see :mod:`sni.sde.name_table`), and then the
+    ``esi_object_name`` collection, see
+    :class:`sni.sde.models.EsiObjectName`. Database results are cached by ID
+    and field name, and unknown IDs are cached for
+    :data:`sni.sde.sde.SDE_NEGATIVE_TTL` seconds.
     """
-    key = ("sde:" + str(field_id), None)
-    name = cache_get(key)
-    if name is None:
-        if field_name is None:
-            query_set = EsiObjectName.objects(field_id=field_id)
-        else:
-            query_set = EsiObjectName.objects(
-                field_id=field_id, field_names=field_name,
-            )
-        try:
-            name = query_set.get().name
-            cache_set(key, name, 1 * DAY)
-        except me.DoesNotExist:
-            name = None
-    return name
+    table = get_sde_name_table()
+    if table is not None:
+        name = table.get(field_id, field_name)
+        if name is not None:
+            return name
+    return _sde_get_name(field_id, field_name)
+
+
+@cached(
+    lambda field_id, field_name: ("sde:" + str(field_id), field_name),
+    1 * DAY,
+    negative_ttl=SDE_NEGATIVE_TTL,
+)
+def _sde_get_name(field_id: int, field_name: Optional[str]) -> Optional[str]:
+    """
+    Cached database lookup of :meth:`sni.sde.sde.sde_get_name`.
+    """
+    if field_name is None:
+        query_set = EsiObjectName.objects(field_id=field_id)
+    else:
+        query_set = EsiObjectName.objects(
+            field_id=field_id, field_names=field_name,
+        )
+    document = query_set.first()
+    return document.name if document is not None else None
+
+
+def sde_get_names(field_ids: Dict[int, Optional[str]]) -> Dict[int, str]:
+    """
+    Bulk version of :meth:`sni.sde.sde.sde_get_name`, sharing its cache
+    entries. Takes a dict mapping IDs to field names (or ``None``), and
+    returns a dict mapping IDs to names. Names that are not in the name table
+    are retrieved from the cache in a single round trip, and the other IDs
+    are fetched from the database in a single query. Unknown IDs are omitted.
+    """
+    result: Dict[int, str] = {}
+    table = get_sde_name_table()
+    if table is not None:
+        for field_id, field_name in field_ids.items():
+            name = table.get(field_id, field_name)
+            if name is not None:
+                result[field_id] = name
+        field_ids = {
+            field_id: field_name
+            for field_id, field_name in field_ids.items()
+            if field_id not in result
+        }
+        if not field_ids:
+            return result
+    entries = cache_get_many(
+        [
+            ("sde:" + str(field_id), field_name)
+            for field_id, field_name in field_ids.items()
+        ]
+    )
+    missing: Dict[int, Optional[str]] = {}
+    for (field_id, field_name), entry in zip(field_ids.items(), entries):
+        if not isinstance(entry, CacheEntry):
+            missing[field_id] = field_name
+        elif entry.value is not None:
+            result[field_id] = entry.value
+    if not missing:
+        return result
+    fetched: Dict[int, Optional[str]] = dict.fromkeys(missing.keys())
+    for document in EsiObjectName.objects(field_id__in=list(missing.keys())):
+        field_name = missing.get(document.field_id)
+        if field_name is not None and field_name not in document.field_names:
+            continue
+        if fetched[document.field_id] is None:
+            fetched[document.field_id] = document.name
+    items = []
+    for field_id, name in fetched.items():
+        ttl = 1 * DAY if name is not None else SDE_NEGATIVE_TTL
+        entry = CacheEntry.new(name, ttl)
+        key = ("sde:" + str(field_id), missing[field_id])
+        items.append((key, entry, ttl))
+        if name is not None:
+            result[field_id] = name
+    cache_set_many(items)
+    return result
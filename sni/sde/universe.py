@@ -0,0 +1,362 @@
+"""
+Solar system graph.
+
+The solar systems of the SDE, their constellation, region, and security
+status, and the stargate jumps between them (``mapSolarSystemJumps``), are
+kept in memory in a compact, read-only graph, so that jump distances can be
+computed without any ESI route call. Solar systems are indexed by their
+position in a sorted array of IDs, and the jumps are stored in compressed
+sparse row (CSR) form: the neighbours of the system of index ``i`` are
+``neighbours[offsets[i]:offsets[i + 1]]``.
+
+The graph is generated from the SDE dump after each SDE import, and written
+to the file ``sde.solar_system_graph_path``, which SNI processes load (and
+reload when it changes), like the SDE name table (see
+:mod:`sni.sde.name_table`).
+
+File format (native byte order, each array padded to a multiple of 8
+bytes)::
+
+    magic (8 bytes)
+    number of solar systems (uint32), number of neighbour entries (uint32)
+    solar system IDs (int64 each)
+    constellation IDs (uint32 each)
+    region IDs (uint32 each)
+    security statuses (float64 each)
+    neighbour offsets (uint32 each, one more than the number of systems)
+    neighbours (uint32 each)
+"""
+
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+import logging
+import os
+import sqlite3
+import struct
+import time
+
+from xxhash import xxh64_hexdigest
+
+from sni.conf import CONFIGURATION as conf
+from sni.db.cache import cached
+from sni.utils import DAY
+
+SOLAR_SYSTEM_GRAPH_MAGIC = b"SNIMAP\x00\x01"
+"""First bytes of a solar system graph file, including the format version"""
+
+SOLAR_SYSTEM_GRAPH_RELOAD_INTERVAL = 60
+"""Minimum time (in seconds) between two checks for a new solar system graph
+file"""
+
+_graph: Optional["SolarSystemGraph"] = None
+_graph_checked_at = 0.0
+_graph_lock = Lock()
+_graph_mtime: Optional[int] = None
+
+
+class SolarSystem(NamedTuple):
+    """
+    Location and security status of a solar system
+    """
+
+    constellation_id: int
+    region_id: int
+    security: float
+
+
+class SolarSystemGraph:
+    """
+    Compact, read-only solar system graph. See :mod:`sni.sde.universe`.
+    """
+
+    _constellation_ids: Sequence[int]
+    _ids: Sequence[int]
+    _neighbours: Sequence[int]
+    _offsets: Sequence[int]
+    _region_ids: Sequence[int]
+    _security: Sequence[float]
+    version: str
+    """Hash of the serialized graph"""
+
+    def __init__(self, data: bytes):
+        """
+        Reads a serialized graph, see
+        :meth:`sni.sde.universe.SolarSystemGraph.to_bytes`. Raises a
+        :class:`ValueError` if ``data`` is not a solar system graph.
+        """
+        if data[: len(SOLAR_SYSTEM_GRAPH_MAGIC)] != SOLAR_SYSTEM_GRAPH_MAGIC:
+            raise ValueError("Not a solar system graph")
+        position = len(SOLAR_SYSTEM_GRAPH_MAGIC)
+        system_count, neighbour_count = struct.unpack_from(
+            "=II", data, position
+        )
+        position = _padded(position + 8)
+        view = memoryview(data)
+        arrays: List[Sequence] = []
+        for type_code, count in [
+            ("q", system_count),
+            ("I", system_count),
+            ("I", system_count),
+            ("d", system_count),
+            ("I", system_count + 1),
+            ("I", neighbour_count),
+        ]:
+            size = struct.calcsize(type_code) * count
+            arrays.append(view[position : position + size].cast(type_code))
+            position = _padded(position + size)
+        (
+            self._ids,
+            self._constellation_ids,
+            self._region_ids,
+            self._security,
+            self._offsets,
+            self._neighbours,
+        ) = arrays
+        self.version = xxh64_hexdigest(data)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def distances(self, origins: Iterable[int]) -> array:
+        """
+        Returns the number of jumps from the nearest of the origin solar
+        systems to every solar system, as an array indexed like the solar
+        systems (see :meth:`sni.sde.universe.SolarSystemGraph.index`). The
+        distance to unreachable systems is ``-1``. This is a multi-source
+        breadth-first search.
+        """
+        distances = array("h", [-1]) * len(self._ids)
+        frontier: List[int] = []
+        for origin in origins:
+            index = self.index(origin)
+            if index is not None and distances[index] < 0:
+                distances[index] = 0
+                frontier.append(index)
+        neighbours, offsets = self._neighbours, self._offsets
+        jumps = 0
+        while frontier:
+            jumps += 1
+            next_frontier = []
+            for index in frontier:
+                start, end = offsets[index], offsets[index + 1]
+                for neighbour in neighbours[start:end]:
+                    if distances[neighbour] < 0:
+                        distances[neighbour] = jumps
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return distances
+
+    def index(self, solar_system_id: int) -> Optional[int]:
+        """
+        Returns the index of a solar system, or ``None`` if it is unknown.
+        """
+        index = bisect_left(self._ids, solar_system_id)
+        if index == len(self._ids) or self._ids[index] != solar_system_id:
+            return None
+        return index
+
+    def solar_system(self, solar_system_id: int) -> Optional[SolarSystem]:
+        """
+        Returns the constellation, region, and security status of a solar
+        system, or ``None`` if it is unknown.
+        """
+        index = self.index(solar_system_id)
+        if index is None:
+            return None
+        return SolarSystem(
+            constellation_id=self._constellation_ids[index],
+            region_id=self._region_ids[index],
+            security=self._security[index],
+        )
+
+    @staticmethod
+    def to_bytes(
+        solar_systems: Iterable[Tuple[int, int, int, float]],
+        jumps: Iterable[Tuple[int, int]],
+    ) -> bytes:
+        """
+        Serializes a solar system graph. Takes an iterable of ``(id,
+        constellation_id, region_id, security)`` tuples, and an iterable of
+        ``(from_id, to_id)`` jumps. Jumps are made symmetric, and jumps from
+        or to unknown solar systems are ignored.
+        """
+        rows = sorted(solar_systems)
+        index = {row[0]: i for i, row in enumerate(rows)}
+        adjacency: List[Set[int]] = [set() for _ in rows]
+        for from_id, to_id in jumps:
+            if from_id in index and to_id in index and from_id != to_id:
+                adjacency[index[from_id]].add(index[to_id])
+                adjacency[index[to_id]].add(index[from_id])
+        offsets = [0]
+        neighbours: List[int] = []
+        for neighbour_set in adjacency:
+            neighbours.extend(sorted(neighbour_set))
+            offsets.append(len(neighbours))
+        data = bytearray(SOLAR_SYSTEM_GRAPH_MAGIC)
+        data += struct.pack("=II", len(rows), len(neighbours))
+        data += bytes(_padded(len(data)) - len(data))
+        for values in [
+            array("q", [row[0] for row in rows]),
+            array("I", [row[1] for row in rows]),
+            array("I", [row[2] for row in rows]),
+            array("d", [row[3] for row in rows]),
+            array("I", offsets),
+            array("I", neighbours),
+        ]:
+            data += values.tobytes()
+            data += bytes(_padded(len(data)) - len(data))
+        return bytes(data)
+
+
+def build_solar_system_graph(
+    dump_path: str, path: Optional[str] = None
+) -> int:
+    """
+    Generates the solar system graph file from the ``mapSolarSystems`` and
+    ``mapSolarSystemJumps`` tables of an SDE dump, and returns the number of
+    solar systems it contains. The file is written next to its destination
+    and then renamed, so that it is replaced atomically.
+    """
+    if path is None:
+        path = conf.sde.solar_system_graph_path
+    client = sqlite3.connect(dump_path)
+    try:
+        data = SolarSystemGraph.to_bytes(
+            client.execute(
+                "SELECT solarSystemID, constellationID, regionID, security "
+                "FROM mapSolarSystems;"
+            ),
+            client.execute(
+                "SELECT fromSolarSystemID, toSolarSystemID "
+                "FROM mapSolarSystemJumps;"
+            ),
+        )
+    finally:
+        client.close()
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as graph_file:
+        graph_file.write(data)
+    os.replace(temporary_path, path)
+    graph = SolarSystemGraph(data)
+    logging.info(
+        "Generated solar system graph %s: %d solar systems, %d bytes",
+        path,
+        len(graph),
+        len(data),
+    )
+    return len(graph)
+
+
+@cached(
+    lambda graph, origins: ("sde:distances:" + graph.version, origins),
+    1 * DAY,
+)
+def _cached_distances(
+    graph: SolarSystemGraph, origins: Tuple[int, ...]
+) -> bytes:
+    """
+    Cached version of :meth:`sni.sde.universe.SolarSystemGraph.distances`.
+    Cache entries are specific to a version of the graph.
+    """
+    return graph.distances(origins).tobytes()
+
+
+def get_solar_system_graph() -> Optional[SolarSystemGraph]:
+    """
+    Returns the solar system graph of this process, or ``None`` if the graph
+    file does not exist. The file is checked for changes at most every
+    :data:`sni.sde.universe.SOLAR_SYSTEM_GRAPH_RELOAD_INTERVAL` seconds, and
+    reloaded if needed.
+    """
+    elapsed = time.monotonic() - _graph_checked_at
+    if elapsed > SOLAR_SYSTEM_GRAPH_RELOAD_INTERVAL:
+        load_solar_system_graph()
+    return _graph
+
+
+def init_solar_system_graph(dump_path: str) -> None:
+    """
+    Loads the solar system graph file at startup. If it does not exist but
+    the SDE dump ``dump_path`` does, it is generated first.
+    """
+    if load_solar_system_graph() is None and os.path.exists(dump_path):
+        build_solar_system_graph(dump_path)
+        load_solar_system_graph()
+
+
+def load_solar_system_graph(force: bool = False) -> Optional[SolarSystemGraph]:
+    """
+    Loads (or reloads) the solar system graph file if it has changed since it
+    was last loaded, or if ``force`` is set, and swaps it in. Returns the
+    graph, or ``None`` if the file does not exist.
+    """
+    global _graph, _graph_checked_at, _graph_mtime
+    path = conf.sde.solar_system_graph_path
+    with _graph_lock:
+        _graph_checked_at = time.monotonic()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return _graph
+        if force or mtime != _graph_mtime:
+            try:
+                with open(path, "rb") as graph_file:
+                    _graph = SolarSystemGraph(graph_file.read())
+                _graph_mtime = mtime
+                logging.info(
+                    "Loaded solar system graph %s (%d solar systems)",
+                    path,
+                    len(_graph),
+                )
+            except (OSError, ValueError, struct.error) as error:
+                logging.error(
+                    "Could not load solar system graph %s: %s",
+                    path,
+                    str(error),
+                )
+        return _graph
+
+
+def _padded(position: int) -> int:
+    """
+    Rounds a position up to a multiple of 8
+    """
+    return (position + 7) // 8 * 8
+
+
+def solar_system_jumps(
+    origins: Iterable[int], destinations: Iterable[int]
+) -> Dict[int, Optional[int]]:
+    """
+    Returns the number of jumps from the nearest of the origin solar systems
+    to each destination solar system, or ``None`` if a destination is
+    unknown or unreachable, or if the solar system graph is not available.
+    The distances from a given set of origins (e.g. a staging system) to all
+    solar systems are cached, so that subsequent queries only cost a lookup
+    per destination.
+    """
+    destinations = list(destinations)
+    graph = get_solar_system_graph()
+    if graph is None:
+        return dict.fromkeys(destinations)
+    distances = array("h")
+    distances.frombytes(
+        _cached_distances(graph, tuple(sorted(set(origins))))
+    )
+    result: Dict[int, Optional[int]] = {}
+    for destination in destinations:
+        index = graph.index(destination)
+        distance = distances[index] if index is not None else -1
+        result[destination] = distance if distance >= 0 else None
+    return result
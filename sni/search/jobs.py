@@ -0,0 +1,20 @@
+"""
+Recurrent search jobs
+"""
+
+from sni.scheduler import scheduler
+import sni.utils as utils
+
+from .search import build_search_index
+
+
+@scheduler.scheduled_job(
+    "interval", hours=1, start_date=utils.now_plus(seconds=10)
+)
+def rebuild_search_index() -> None:
+    """
+    Rebuilds the search index (see :mod:`sni.search.search`) from the
+    database. This picks up SDE updates, and drops the trigram postings of
+    removed names.
+    """
+    build_search_index()
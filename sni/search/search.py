@@ -0,0 +1,389 @@
+"""
+In-memory name search index.
+
+The names of SDE objects (types, solar systems, constellations, and regions,
+see :class:`sni.sde.models.EsiObjectName`), and of the characters,
+corporations, and alliances known to SNI, are kept in memory, so that they
+can be searched by partial name without querying the database.
+
+Each name is indexed under several keys: its normalized (case-folded) form,
+and the suffixes of that form starting at each word. The keys are kept in a
+sorted array, so that all the names having a given prefix, or a word having
+that prefix, are found with a binary search. Names are also indexed by
+trigrams, which are used for fuzzy matching (e.g. to tolerate typos) when
+there are not enough prefix matches.
+
+The index is built at startup, rebuilt periodically (see
+:mod:`sni.search.jobs`), and kept current in between by database signals
+(see :mod:`sni.search.signals`).
+"""
+
+from bisect import bisect_left, insort
+from collections import Counter
+from threading import Lock
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+import logging
+import time
+
+from sni.sde.models import EsiObjectName
+from sni.user.models import Alliance, Corporation, User
+
+FUZZY_CANDIDATE_COUNT = 300
+"""Number of fuzzy match candidates whose similarity with the query is
+computed"""
+
+FUZZY_POSTING_BUDGET = 15000
+"""Maximum total length of the trigram postings counted to find fuzzy match
+candidates. The postings of the rarest trigrams of the query are counted
+first, and the most common ones are skipped once the budget is spent (except
+the rarest one, which is always counted)."""
+
+FUZZY_MIN_SIMILARITY = 0.3
+"""Minimum trigram similarity (Jaccard index) of a fuzzy match"""
+
+PREFIX_SCAN_LIMIT = 200
+"""Maximum number of keys examined for prefix matches"""
+
+SDE_SEARCH_CATEGORIES = {
+    "constellation_id": "constellation",
+    "region_id": "region",
+    "solar_system_id": "solar_system",
+    "type_id": "type",
+}
+"""Search category of the SDE objects, by ESI field name"""
+
+SEARCH_CATEGORIES = sorted(
+    ["alliance", "character", "corporation"]
+    + list(SDE_SEARCH_CATEGORIES.values())
+)
+"""All search categories"""
+
+_build_lock = Lock()
+_index: Optional["SearchIndex"] = None
+_index_lock = Lock()
+
+
+class SearchResult(NamedTuple):
+    """
+    Search result
+    """
+
+    category: str
+    id: int
+    name: str
+    score: float
+    """Relevance of the result. Names starting with the query score above 2,
+    names having a word starting with the query score above 1, and fuzzy
+    matches score their trigram similarity with the query."""
+
+
+class SearchIndex:
+    """
+    Name search index. See :mod:`sni.search.search`.
+    """
+
+    _entries: List[Optional[Tuple[str, int, str, str]]]
+    """Indexed names, as ``(category, id, name, normalized name)`` tuples,
+    or ``None`` if removed"""
+
+    _ids: Dict[Tuple[str, int], int]
+    """Position in ``_entries`` of each ``(category, id)`` pair"""
+
+    _keys: List[Tuple[str, int]]
+    """Sorted ``(key, position in _entries)`` pairs"""
+
+    _trigrams: Dict[str, List[int]]
+    """Positions in ``_entries`` of the names containing each trigram"""
+
+    def __init__(self, entries: Iterable[Tuple[str, int, str]] = ()):
+        """
+        Builds an index from ``(category, id, name)`` triples. If a
+        ``(category, id)`` pair appears more than once, the last name is
+        retained.
+        """
+        self._entries = []
+        self._ids = {}
+        self._keys = []
+        self._trigrams = {}
+        for category, object_id, name in entries:
+            self._remove((category, object_id))
+            self._keys.extend(self._append(category, object_id, name))
+        self._keys.sort()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, category: str, object_id: int, name: str) -> None:
+        """
+        Adds or renames an object. Does nothing if the object is already
+        indexed under that name.
+        """
+        position = self._ids.get((category, object_id))
+        if position is not None and self._entries[position][2] == name:
+            return
+        self._remove((category, object_id))
+        for key in self._append(category, object_id, name):
+            insort(self._keys, key)
+
+    def _append(
+        self, category: str, object_id: int, name: str
+    ) -> List[Tuple[str, int]]:
+        """
+        Appends an entry and its trigram postings, and returns its keys,
+        which the caller adds to ``_keys``.
+        """
+        position = len(self._entries)
+        normalized = _normalize(name)
+        self._entries.append((category, object_id, name, normalized))
+        self._ids[(category, object_id)] = position
+        for trigram in _trigrams(normalized, True):
+            self._trigrams.setdefault(trigram, []).append(position)
+        return [(key, position) for key in _keys(normalized)]
+
+    def _fuzzy_search(
+        self,
+        text: str,
+        category_set: Optional[Set[str]],
+        scores: Dict[int, float],
+    ) -> None:
+        """
+        Adds the fuzzy matches of a normalized query to ``scores``. Names
+        sharing trigrams with the query are counted, rarest trigrams first,
+        within :data:`sni.search.search.FUZZY_POSTING_BUDGET`, and the exact
+        similarity of the :data:`sni.search.search.FUZZY_CANDIDATE_COUNT`
+        names sharing the most trigrams is then computed.
+        """
+        trigrams = _trigrams(text, False)
+        postings = sorted(
+            (
+                self._trigrams[trigram]
+                for trigram in trigrams
+                if trigram in self._trigrams
+            ),
+            key=len,
+        )
+        budget = FUZZY_POSTING_BUDGET
+        counts: "Counter[int]" = Counter()
+        for posting in postings:
+            if len(posting) > budget and counts:
+                break
+            counts.update(posting)
+            budget -= len(posting)
+        if not counts:
+            return
+        best = max(counts.values())
+        candidates = [
+            position for position, count in counts.items() if count == best
+        ]
+        for position in candidates[:FUZZY_CANDIDATE_COUNT]:
+            entry = self._entries[position]
+            if (
+                entry is None
+                or position in scores
+                or (category_set is not None and entry[0] not in category_set)
+            ):
+                continue
+            entry_trigrams = _trigrams(entry[3], True)
+            shared = len(trigrams & entry_trigrams)
+            similarity = shared / (
+                len(trigrams) + len(entry_trigrams) - shared
+            )
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scores[position] = similarity
+
+    def remove(self, category: str, object_id: int) -> None:
+        """
+        Removes an object, if it is indexed.
+        """
+        self._remove((category, object_id))
+
+    def _remove(self, pair: Tuple[str, int]) -> None:
+        """
+        Removes an entry and its keys. Its trigram postings are left in
+        place, and skipped by searches, until the index is rebuilt.
+        """
+        position = self._ids.pop(pair, None)
+        if position is None:
+            return
+        entry = self._entries[position]
+        self._entries[position] = None
+        for key in _keys(entry[3]):
+            index = bisect_left(self._keys, (key, position))
+            if self._keys[index : index + 1] == [(key, position)]:
+                del self._keys[index]
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        categories: Optional[Iterable[str]] = None,
+    ) -> List[SearchResult]:
+        """
+        Returns the (at most ``limit``) most relevant objects whose name
+        matches ``query``, optionally restricted to some categories. Prefix
+        matches come first, shorter names first. If there are fewer than
+        ``limit`` of them, and if the query is at least 3 characters long,
+        fuzzy matches are added.
+        """
+        text = _normalize(query)
+        if not text or limit <= 0:
+            return []
+        category_set = set(categories) if categories is not None else None
+        scores: Dict[int, float] = {}
+        start = bisect_left(self._keys, (text,))
+        end = min(
+            bisect_left(self._keys, (text + "\U0010ffff",)),
+            start + PREFIX_SCAN_LIMIT,
+        )
+        for key, position in self._keys[start:end]:
+            entry = self._entries[position]
+            if entry is None or (
+                category_set is not None and entry[0] not in category_set
+            ):
+                continue
+            score = (2 if key == entry[3] else 1) + len(text) / len(entry[3])
+            scores[position] = max(score, scores.get(position, 0))
+        if len(scores) < limit and len(text) >= 3:
+            self._fuzzy_search(text, category_set, scores)
+        best = sorted(
+            scores.items(),
+            key=lambda item: (-item[1], self._entries[item[0]][2]),
+        )[:limit]
+        return [
+            SearchResult(
+                category=self._entries[position][0],
+                id=self._entries[position][1],
+                name=self._entries[position][2],
+                score=score,
+            )
+            for position, score in best
+        ]
+
+
+def build_search_index() -> SearchIndex:
+    """
+    Builds the search index from the database, and swaps it in.
+    """
+    global _index
+    start = time.monotonic()
+    index = SearchIndex(_database_entries())
+    with _index_lock:
+        _index = index
+    logging.info(
+        "Built search index: %d entries in %.1fs",
+        len(index),
+        time.monotonic() - start,
+    )
+    return index
+
+
+def _database_entries() -> Iterable[Tuple[str, int, str]]:
+    """
+    Yields the ``(category, id, name)`` triples to index
+    """
+    # pylint: disable=protected-access
+    for document in EsiObjectName._get_collection().find(
+        {
+            "expires_on": None,
+            "field_names": {"$in": list(SDE_SEARCH_CATEGORIES.keys())},
+        },
+        {"_id": 0, "field_id": 1, "field_names": 1, "name": 1},
+    ):
+        for field_name, category in SDE_SEARCH_CATEGORIES.items():
+            if field_name in document["field_names"] and document.get("name"):
+                yield category, document["field_id"], document["name"]
+                break
+    for alliance in Alliance.objects.only("alliance_id", "alliance_name"):
+        yield "alliance", alliance.alliance_id, alliance.alliance_name
+    for corporation in Corporation.objects.only(
+        "corporation_id", "corporation_name"
+    ):
+        yield (
+            "corporation",
+            corporation.corporation_id,
+            corporation.corporation_name,
+        )
+    for usr in User.objects(character_id__ne=0).only(
+        "character_id", "character_name"
+    ):
+        yield "character", usr.character_id, usr.character_name
+
+
+def get_search_index() -> SearchIndex:
+    """
+    Returns the search index, building it if needed. Concurrent callers wait
+    for a single build.
+    """
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                return build_search_index()
+    return _index
+
+
+def _keys(normalized: str) -> List[str]:
+    """
+    Returns the keys of a normalized name: the suffixes starting at each of
+    its words.
+    """
+    return [
+        normalized[i:]
+        for i in range(len(normalized))
+        if i == 0 or (normalized[i - 1] == " " and normalized[i] != " ")
+    ]
+
+
+def _normalize(name: str) -> str:
+    """
+    Normalizes a name or a query: case-folds it, and collapses whitespaces
+    """
+    return " ".join(name.casefold().split())
+
+
+def remove_from_search_index(category: str, object_id: int) -> None:
+    """
+    Removes an object from the search index, if it has been built
+    """
+    with _index_lock:
+        if _index is not None:
+            _index.remove(category, object_id)
+
+
+def search(
+    query: str, limit: int = 10, categories: Optional[Iterable[str]] = None
+) -> List[SearchResult]:
+    """
+    Searches the search index, see
+    :meth:`sni.search.search.SearchIndex.search`. The index is locked during
+    the search, so that signals do not modify it concurrently.
+    """
+    index = get_search_index()
+    with _index_lock:
+        return index.search(query, limit, categories)
+
+
+def _trigrams(normalized: str, complete: bool) -> Set[str]:
+    """
+    Returns the trigrams of a normalized string, padded with two leading
+    spaces. Complete names are also padded with a trailing space, but not
+    queries, since their last word may be incomplete.
+    """
+    padded = "  " + normalized + (" " if complete else "")
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def update_search_index(category: str, object_id: int, name: str) -> None:
+    """
+    Adds or renames an object in the search index, if it has been built
+    """
+    with _index_lock:
+        if _index is not None:
+            _index.add(category, object_id, name)
@@ -0,0 +1,74 @@
+"""
+Database signals keeping the search index (see :mod:`sni.search.search`)
+current. See `Mongoengine signals
+<http://docs.mongoengine.org/guide/signals.html>`_
+"""
+
+from typing import Any
+
+import mongoengine.signals as signals
+
+from sni.user.models import Alliance, Corporation, User
+
+from .search import remove_from_search_index, update_search_index
+
+
+@signals.post_delete.connect_via(Alliance)
+def on_alliance_post_delete(_sender: Any, **kwargs):
+    """
+    Whenever an alliance is deleted from the database.
+    """
+    alliance: Alliance = kwargs["document"]
+    remove_from_search_index("alliance", alliance.alliance_id)
+
+
+@signals.post_save.connect_via(Alliance)
+def on_alliance_post_save(_sender: Any, **kwargs):
+    """
+    Whenever an alliance is saved in the database.
+    """
+    alliance: Alliance = kwargs["document"]
+    update_search_index(
+        "alliance", alliance.alliance_id, alliance.alliance_name
+    )
+
+
+@signals.post_delete.connect_via(Corporation)
+def on_corporation_post_delete(_sender: Any, **kwargs):
+    """
+    Whenever a corporation is deleted from the database.
+    """
+    corporation: Corporation = kwargs["document"]
+    remove_from_search_index("corporation", corporation.corporation_id)
+
+
+@signals.post_save.connect_via(Corporation)
+def on_corporation_post_save(_sender: Any, **kwargs):
+    """
+    Whenever a corporation is saved in the database.
+    """
+    corporation: Corporation = kwargs["document"]
+    update_search_index(
+        "corporation",
+        corporation.corporation_id,
+        corporation.corporation_name,
+    )
+
+
+@signals.post_delete.connect_via(User)
+def on_user_post_delete(_sender: Any, **kwargs):
+    """
+    Whenever a user is deleted from the database.
+    """
+    usr: User = kwargs["document"]
+    remove_from_search_index("character", usr.character_id)
+
+
+@signals.post_save.connect_via(User)
+def on_user_post_save(_sender: Any, **kwargs):
+    """
+    Whenever a user is saved in the database. The root user is not indexed.
+    """
+    usr: User = kwargs["document"]
+    if usr.character_id != 0:
+        update_search_index("character", usr.character_id, usr.character_name)
@@ -12,7 +12,7 @@ import pydantic as pdt
 from ts3.query import TS3Connection, TS3QueryError
 
 from sni.conf import CONFIGURATION as conf
-from sni.db.cache import cache_get, cache_set, invalidate_cache
+from sni.db.cache import cached_call, invalidate_cache
 from sni.user.models import User
 from sni.user.user import ensure_autogroup
 from sni.utils import HOUR
@@ -72,11 +72,9 @@ def cached_teamspeak_query(
         "ts:" + query.__name__,
         [args, sorted(kwargs.items())],
     )
-    result = cache_get(key)
-    if result is None:
-        result = query(connection, *args, **kwargs).parsed
-        cache_set(key, result, ttl)
-    return result
+    return cached_call(
+        key, lambda: query(connection, *args, **kwargs).parsed, ttl
+    )
 
 
 def client_list(connection: TS3Connection) -> List[TeamspeakClient]:
@@ -53,11 +53,19 @@ the declaration of all scopes.
 
 from dataclasses import dataclass
 import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 from sni.esi.scope import EsiScope
-from sni.db.cache import cache_get, cache_set
+from sni.db.cache import (
+    CacheEntry,
+    cache_get_many,
+    cache_set_many,
+    cache_tag_many,
+    cached,
+    invalidate_tag,
+)
 from sni.user.models import Coalition, User
+from sni.utils import HOUR
 
 
 class AbstractScope:
@@ -142,6 +150,11 @@ class ESIScope(AbstractScope):
         )
 
 
+CLEARANCE_CACHE_TTL = 6 * HOUR
+"""TTL (in seconds) of the cached results of clearance checks. Results are
+tagged (see :meth:`sni.uac.clearance.clearance_tags`), and invalidated when
+the users, corporations, alliances, or coalitions involved change."""
+
 SCOPES: Dict[str, AbstractScope] = {
     EsiScope.ESI_ALLIANCES_READ_CONTACTS_V1: ESIScope(0),
     EsiScope.ESI_ASSETS_READ_ASSETS_V1: ESIScope(0),
@@ -237,6 +250,7 @@ SCOPES: Dict[str, AbstractScope] = {
     "sni.read_per_token": AbsoluteScope(9),
     "sni.read_use_token": AbsoluteScope(0),
     "sni.read_user": AbsoluteScope(0),
+    "sni.search": AbsoluteScope(0),
     "sni.set_authorized_to_login": AbsoluteScope(9),
     "sni.set_clearance_level_0": ClearanceModificationScope(0),
     "sni.set_clearance_level_1": ClearanceModificationScope(1),
@@ -258,7 +272,10 @@ SCOPES: Dict[str, AbstractScope] = {
     "sni.update_per_token": AbsoluteScope(10),
     "sni.update_use_token": AbsoluteScope(0),
     "sni.update_user": AbsoluteScope(9),
+    "sni.system.read_cache_statistics": AbsoluteScope(10),
     "sni.system.read_configuration": AbsoluteScope(10),
+    "sni.system.read_esi_statistics": AbsoluteScope(10),
+    "sni.system.read_index_statistics": AbsoluteScope(10),
     "sni.system.read_jobs": AbsoluteScope(10),
     "sni.system.submit_job": AbsoluteScope(10),
     "sni.fetch_corporation": AbsoluteScope(8),
@@ -327,6 +344,58 @@ def assert_has_clearance(
         raise PermissionError
 
 
+def assert_has_clearances(
+    source: User, checks: List[Tuple[str, Optional[User]]]
+) -> None:
+    """
+    Like :meth:`sni.uac.clearance.has_clearances` but raises a
+    :class:`PermissionError` if any result is ``False``.
+    """
+    if not all(has_clearances(source, checks)):
+        raise PermissionError
+
+
+def _clearance_cache_key(
+    source: User, scope_name: str, target: Optional[User] = None
+) -> Tuple[str, list]:
+    """
+    Cache key of a clearance check, see
+    :meth:`sni.uac.clearance.has_clearance`.
+    """
+    return (
+        "clr",
+        [
+            source.character_id,
+            scope_name,
+            target.character_id if target is not None else None,
+        ],
+    )
+
+
+def clearance_tags(
+    source: User, scope_name: str, target: Optional[User] = None
+) -> List[str]:
+    """
+    Cache tags of a clearance check, i.e. ``user:<character_id>``,
+    ``corp:<corporation_id>``, ``alliance:<alliance_id>``, and
+    ``coalition:<coalition_id>`` for both users, their corporation, alliance,
+    and coalitions. See :meth:`sni.db.cache.invalidate_tag`.
+    """
+    tags = set()
+    for usr in [source, target]:
+        if usr is None:
+            continue
+        tags.add(f"user:{usr.character_id}")
+        if usr.corporation is None:
+            continue
+        tags.add(f"corp:{usr.corporation.corporation_id}")
+        if usr.corporation.alliance is not None:
+            tags.add(f"alliance:{usr.corporation.alliance.alliance_id}")
+        for coalition in usr.coalitions():
+            tags.add(f"coalition:{coalition.pk}")
+    return sorted(tags)
+
+
 def distance_penalty(source: User, target: User) -> int:
     """
     Returns 0 if both users are the same user; returns 1 if they are not the
@@ -352,22 +421,81 @@ def has_clearance(
     Check wether the *source* user has sufficient clearance to perform a given
     action (or *scope*) against the *target* user.
     """
-    scope = SCOPES.get(scope_name)
-    if scope is None:
+    if scope_name not in SCOPES:
         logging.warning('Unknown scope "%s"', scope_name)
         return False
-    cache_key = (
-        "clr",
-        [
-            source.character_id,
-            scope_name,
-            target.character_id if target is not None else None,
-        ],
-    )
-    result = cache_get(cache_key)
-    if not isinstance(result, bool):
-        result = scope.has_clearance(source, target)
-        cache_set(cache_key, result)
+    result = _has_clearance(source, scope_name, target)
+    _log_clearance(source, scope_name, target, result)
+    return result
+
+
+@cached(_clearance_cache_key, CLEARANCE_CACHE_TTL, tags=clearance_tags)
+def _has_clearance(
+    source: User, scope_name: str, target: Optional[User] = None
+) -> bool:
+    """
+    Cached implementation of :meth:`sni.uac.clearance.has_clearance`. The
+    scope must exist.
+    """
+    return SCOPES[scope_name].has_clearance(source, target)
+
+
+def has_clearances(
+    source: User, checks: List[Tuple[str, Optional[User]]]
+) -> List[bool]:
+    """
+    Bulk version of :meth:`sni.uac.clearance.has_clearance`, sharing its
+    cache entries. Takes a list of scope names and (optional) targets, and
+    returns the list of results. Cached results are retrieved in a single
+    round trip.
+    """
+    cache_keys = [
+        _clearance_cache_key(source, scope_name, target)
+        for scope_name, target in checks
+    ]
+    entries = cache_get_many(cache_keys)
+    results: List[bool] = []
+    new_entries = []
+    new_tags = []
+    for cache_key, entry, (scope_name, target) in zip(
+        cache_keys, entries, checks
+    ):
+        scope = SCOPES.get(scope_name)
+        if scope is None:
+            logging.warning('Unknown scope "%s"', scope_name)
+            results.append(False)
+            continue
+        if isinstance(entry, CacheEntry):
+            result = bool(entry.value)
+        else:
+            result = scope.has_clearance(source, target)
+            new_entries.append(
+                (
+                    cache_key,
+                    CacheEntry.new(result, CLEARANCE_CACHE_TTL),
+                    CLEARANCE_CACHE_TTL,
+                )
+            )
+            new_tags.append(
+                (
+                    cache_key,
+                    clearance_tags(source, scope_name, target),
+                    CLEARANCE_CACHE_TTL,
+                )
+            )
+        _log_clearance(source, scope_name, target, result)
+        results.append(result)
+    cache_set_many(new_entries)
+    cache_tag_many(new_tags)
+    return results
+
+
+def _log_clearance(
+    source: User, scope_name: str, target: Optional[User], result: bool
+) -> None:
+    """
+    Logs the result of a clearance check.
+    """
     logging.debug(
         "Access %s --[%s]--> %s %s",
         source.character_name,
@@ -375,7 +503,6 @@ def has_clearance(
         target.character_name if target is not None else "N/A",
         "granted" if result else "denied",
     )
-    return result
 
 
 def reset_clearance(usr: User, save: bool = False):
@@ -387,6 +514,12 @@ def reset_clearance(usr: User, save: bool = False):
     of 4 is granted instead. If the user is root or has a clearance level of
     10, then a level of 10 is applied (so that superusers are preserved no
     matter what). Otherwise, the user's clearance level is set to 0.
+
+    The cached clearance checks involving the user are invalidated once the
+    user is saved, either here if ``save`` is set, or by the ``post_save``
+    signal handler (see :meth:`sni.user.signals.on_user_post_save`).
+    Invalidating before saving would let concurrent checks cache a decision
+    based on the old clearance level.
     """
     if usr.clearance_level >= 9:
         return
@@ -405,3 +538,4 @@ def reset_clearance(usr: User, save: bool = False):
             usr.clearance_level,
         )
         usr.save()
+        invalidate_tag(f"user:{usr.character_id}")
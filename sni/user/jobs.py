@@ -6,6 +6,7 @@ import logging
 
 import mongoengine as me
 
+from sni.db.cache import invalidate_tag
 from sni.esi.esi import esi_get
 from sni.esi.scope import EsiScope
 from sni.esi.token import (
@@ -234,6 +235,7 @@ def update_corporation_from_esi(corporation: Corporation):
         "Updating properties of corproation %s", corporation.corporation_name
     )
     data = esi_get(f"latest/corporations/{corporation.corporation_id}").data
+    old_alliance = corporation.alliance
     corporation.alliance = (
         ensure_alliance(int(data["alliance_id"]))
         if "alliance_id" in data
@@ -244,6 +246,10 @@ def update_corporation_from_esi(corporation: Corporation):
     if old_ceo.character_id != corporation.ceo_character_id:
         reset_clearance(old_ceo, save=True)
     corporation.save()
+    # Invalidate after saving, so that concurrent clearance checks cannot
+    # cache a decision based on the old alliance
+    if corporation.alliance != old_alliance:
+        invalidate_tag(f"corp:{corporation.corporation_id}")
 
 
 @scheduler.scheduled_job("interval", days=1)
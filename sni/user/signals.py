@@ -6,6 +6,7 @@ from typing import Any
 
 import mongoengine.signals as signals
 
+from sni.db.cache import invalidate_tag
 from sni.scheduler import scheduler
 
 from .models import Coalition, User
@@ -28,10 +29,12 @@ def on_coalition_post_save(_sender: Any, **kwargs):
 @signals.post_save.connect_via(User)
 def on_user_post_save(_sender: Any, **kwargs):
     """
-    Whenever a user is saved in the database.
+    Whenever a user is saved in the database. Invalidates the cached
+    clearance checks involving that user.
     """
     if not kwargs.get("created", False):
         usr: User = kwargs["document"]
+        invalidate_tag(f"user:{usr.character_id}")
         if usr.character_id == 0:
             return
         # scheduler.add_job(update_user_from_esi, args=(usr, ))